@@ -21,10 +21,9 @@ async def debug_single_workflow(target_url):
 
     # 2. Fetch and Parse
     print(f"Step 2: Fetching from {target_url}...")
-    rss = RSSManager(cfg, db="debug_history.json")
+    rss = RSSManager(cfg, db="debug_history.db", state="debug_feed_state.json")
     # Bypass the OPML logic to test just this URL
     import aiohttp
-    import feedparser
     async with aiohttp.ClientSession() as session:
         try:
             feed = await rss._fetch_one(session, target_url)
@@ -36,27 +35,22 @@ async def debug_single_workflow(target_url):
             print("❌ Failed to fetch or parse the feed (Likely timeout or status code != 200).")
             return
         
-        print(f"✅ Feed fetched: {feed.feed.get('title', 'Unknown Source')}")
+        print(f"✅ Feed fetched: {feed['title']}")
         
         new_items = []
-        for entry in feed.entries[:1]: # Just take the first one for testing
-            link = entry.get('link')
+        for entry in feed['entries'][:1]: # Just take the first one for testing
+            link = entry['link']
             u_hash = hashlib.md5(link.encode()).hexdigest()
-            content = ""
-            if 'content' in entry:
-                content = entry.content[0].value
-            elif 'summary' in entry:
-                content = entry.summary
-            
             item = {
-                "title": entry.get('title', 'Untitled'),
+                "title": entry['title'],
                 "link": link,
-                "content": content,
-                "source": feed.feed.get('title', 'Source'),
+                "content": entry['content'],
+                "source": feed['title'],
                 "hash": u_hash
             }
             new_items.append(item)
             print(f"📄 Found article: {item['title']}")
+    rss.close()
 
     if not new_items:
         print("❌ No articles extracted.")
@@ -70,6 +64,8 @@ async def debug_single_workflow(target_url):
     except Exception as e:
         print(f"⚠️ AI request failed: {e}")
         processed = []
+    finally:
+        await hub.close()
     
     if not processed:
         print("💡 Since AI failed or quota was hit, using a fallback mock summary to test notifications...")
@@ -86,7 +82,7 @@ async def debug_single_workflow(target_url):
         print("-" * 30)
         print(f"标题: {processed[0]['title']}")
         print(f"来源: {processed[0]['source']}")
-        print(f"AI 总结预览:\n{processed[0].get('ai_html', 'No AI HTML generated')}")
+        print(f"AI 总结预览:\n{processed[0].get('ai_html') or processed[0].get('ai_data', 'No AI HTML generated')}")
         print("-" * 30)
 
         # 4. Notification Step
@@ -1,10 +1,17 @@
+import argparse
 import asyncio
 import os
+import signal
 import configparser
 from dotenv import load_dotenv
 from src.parser import RSSManager
-from src.ai_hub import IntelligenceHub
-from src.notifier import send_all_reports
+from src.ai_hub import IntelligenceHub, create_pool
+from src.notifier import send_all_reports, enqueue_reports, flush_outbox
+from src.outbox import Outbox
+from src.dedup import NearDuplicateIndex
+from src.pipeline import run_pipeline
+from src.scheduler import Scheduler
+from src.http_pool import HttpPool
 
 
 load_dotenv()
@@ -22,12 +29,12 @@ class AppConfig:
         self.TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
         self.TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "").strip()
 
-    def validate(self):
-        """检查必要配置是否存在"""
+    def validate(self, require_ai=True):
+        """检查必要配置是否存在（仅投递发件箱时不需要 AI 密钥）"""
         missing = []
         
         # 基础必填项
-        if not self.GEMINI_KEY:
+        if require_ai and not self.GEMINI_KEY:
             missing.append("GEMINI_API_KEY")
         
         # 如果启用了邮件
@@ -49,51 +56,209 @@ class AppConfig:
         if missing:
             raise ValueError(f"缺少必要环境变量: {', '.join(missing)}")
 
-async def main():
+async def run_cycle(cfg, rss, hub_factory, http=None, dedup=None, outbox=None, report_idle=True, pool=None):
+    """一轮 抓取 → AI 总结 → 投递，返回 (processed, quota_exceeded)
+
+    rss / dedup / outbox / http 由调用方创建与关闭，常驻模式下在各轮之间复用；
+    传入已创建的模型池 pool 时，调度预算取其当日剩余请求数。
+    report_idle 为 False 时，无新文章的轮次不发送“正常运行”报告（常驻模式避免频繁打扰）。
+    """
+    # 2. 获取文章并 AI 智能处理 (Phase 1 + 2，流式进行)
+    # 每个源抓取完成即送入 AI worker；往期遗留的待处理文章随后入队
+    if dedup:
+        dedup.reset()
+    processed, quota_exceeded = await run_pipeline(
+        rss,
+        hub_factory,
+        # 近重复合并：本轮内的转载合并为一次 AI 调用，与往期重复的直接标记完成
+        dedup=dedup,
+        queue_size=cfg.config.getint('SYSTEM', 'QueueSize', fallback=20),
+        # 配额感知调度：剩余预算不足时按订阅源优先级、时效性、成本与积压时间挑选文章
+        scheduler=Scheduler.from_config(
+            cfg, rss.feed_priorities(), remaining=pool.remaining_requests() if pool is not None else None),
+    )
+    idle = not processed and not quota_exceeded
+    if idle and report_idle:
+        print("☕ 暂无待处理文章，将发送系统正常运行状态报告。")
+
+    if dedup:
+        # 记录本轮已处理文章的签名，供后续运行识别转载
+        dedup.add(processed)
+
+    # 3. 发送多渠道报告并持久化历史 (Phase 3)
+    warning = None
+    if quota_exceeded:
+        warning = "由于 AI 额度不足，未处理文章已安全存入历史，将在下次运行时尝试处理。"
+
+    if idle and not report_idle:
+        # 常驻模式下无新文章的轮次不发送报告，只投递发件箱中的积压消息
+        pass
+    elif outbox:
+        # 报告先持久化到发件箱，此后投递失败只需重发消息，无需重新调用 AI
+        enqueue_reports(cfg, outbox, processed, warning=warning)
+    else:
+        try:
+            await send_all_reports(cfg, processed, warning=warning, http=http)
+        except Exception as e:
+            print(f"⚠️ 通知环节出现问题: {e}")
+
+    # 处理结果持久化
+    if processed:
+        # 报告已入队（或已发送），标记为已完成
+        rss.mark_as_processed(processed)
+        print(f"🏁 任务处理完成：今日成功处理 {len(processed)} 篇文章。")
+    elif quota_exceeded:
+        print("⚠️ 未能总结任何文章（AI 配额耗尽）。文章已保留，下次运行。")
+    else:
+        print("🏁 任务处理完成：无新动态。")
+    rss.save_and_clean()
+
+    if outbox:
+        # 投递本轮报告以及往期未送达的消息
+        try:
+            await flush_outbox(cfg, outbox, http=http)
+        except Exception as e:
+            print(f"⚠️ 通知环节出现问题: {e}")
+    return processed, quota_exceeded
+
+
+def load_config(force_refresh=False, require_ai=True):
+    """读取并校验配置"""
+    cfg = AppConfig()
+    cfg.validate(require_ai=require_ai)
+    if force_refresh:
+        # 忽略自适应轮询计划，抓取全部订阅源
+        cfg.config.set('SYSTEM', 'ForceRefresh', 'true')
+    return cfg
+
+
+async def main(force_refresh=False):
+    http = rss = dedup = outbox = None
     try:
         # 1. 初始化配置
-        cfg = AppConfig()
-        cfg.validate()
+        cfg = load_config(force_refresh)
+        # 抓取与通知阶段共享的连接池（DNS 缓存、keep-alive、单主机并发上限）
+        http = HttpPool.from_config(cfg)
+        rss = RSSManager(cfg, http=http)
+        dedup = NearDuplicateIndex.from_config(cfg)
+        outbox = Outbox.from_config(cfg)
+        await run_cycle(cfg, rss, lambda: IntelligenceHub(cfg), http=http, dedup=dedup, outbox=outbox)
+    except Exception as e:
+        print(f"🔥 程序运行期间发生致命错误: {e}")
+    finally:
+        await shutdown(rss, dedup, outbox, http)
 
-        # 2. 获取文章 (Phase 1)
-        # fetch_all 现在会返回所有“待处理”文章（包括本次新抓取的和之前遗留的）
-        rss = RSSManager(cfg)
-        pending_articles = await rss.fetch_all()
-        
-        # 3. AI 智能处理 (Phase 2)
-        processed = []
-        quota_exceeded = False
-        
-        if pending_articles:
-            print(f"✅ 准备处理 {len(pending_articles)} 篇待办文章（含历史遗留）。")
-            hub = IntelligenceHub(cfg)
-            processed, quota_exceeded = await hub.process_articles(pending_articles)
-        else:
-            print("☕ 暂无待处理文章，将发送系统正常运行状态报告。")
-
-        # 4. 发送多渠道报告并持久化历史 (Phase 3)
-        warning = None
-        if quota_exceeded:
-            warning = "由于 AI 额度不足，未处理文章已安全存入历史，将在下次运行时尝试处理。"
-            
+
+async def shutdown(rss=None, dedup=None, outbox=None, http=None, pool=None):
+    """写回历史存储并关闭各项资源（任一步骤失败不影响其余步骤）"""
+    steps = []
+    if rss is not None:
+        steps += [rss.save_and_clean, rss.close]
+    if dedup is not None:
+        steps.append(dedup.close)
+    if outbox is not None:
+        steps.append(outbox.close)
+    for step in steps:
         try:
-            await send_all_reports(cfg, processed, warning=warning)
+            step()
         except Exception as e:
-            print(f"⚠️ 通知环节出现问题: {e}")
-        
-        # 处理结果持久化
-        if processed:
-            # 仅将处理并发送成功的标记为已完成
-            rss.mark_as_processed(processed)
-            print(f"🏁 任务处理完成：今日成功处理 {len(processed)} 篇文章。")
-        elif quota_exceeded:
-            print("⚠️ 未能总结任何文章（AI 配额耗尽）。文章已保留，下次运行。")
-        else:
-            print("🏁 任务处理完成：无新动态。")
-        rss.save_and_clean()    
+            print(f"⚠️ 关闭资源时出错: {e}")
+    if pool is not None:
+        await pool.aclose()
+    if http is not None:
+        await http.close()
+
+
+async def daemon(force_refresh=False):
+    """常驻模式：连接池、订阅源状态、历史存储与 AI 客户端在各轮之间保持常驻，按 [SYSTEM] DaemonIntervalMinutes 循环运行
+
+    收到 SIGTERM / SIGINT 时不再开始新的一轮；正在进行的一轮最多再等待 ShutdownGrace 秒，
+    超时则取消（已完成的 AI 总结已逐篇写入检查点），随后写回历史存储并退出。
+    force_refresh (--force-refresh) 只作用于第一轮，之后恢复自适应轮询。
+    """
+    http = rss = dedup = outbox = pool = None
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows 等不支持信号处理的平台
+            pass
 
+    try:
+        cfg = load_config()
+        interval = cfg.config.getfloat('SYSTEM', 'DaemonIntervalMinutes', fallback=60) * 60
+        grace = cfg.config.getfloat('SYSTEM', 'ShutdownGrace', fallback=20)
+        http = HttpPool.from_config(cfg)
+        rss = RSSManager(cfg, http=http)
+        dedup = NearDuplicateIndex.from_config(cfg)
+        outbox = Outbox.from_config(cfg)
+        # 配置文件中的 ForceRefresh 每轮生效，命令行 --force-refresh 只作用于第一轮
+        configured_refresh = rss.force_refresh
+        rss.force_refresh = configured_refresh or force_refresh
+
+        def hub_factory():
+            # 模型池在首次需要 AI 时创建并跨轮复用，限流与每日配额计数随之保留
+            nonlocal pool
+            if pool is None:
+                pool = create_pool(cfg)
+            return IntelligenceHub(cfg, pool=pool)
+
+        print(f"🛰️ 常驻模式启动：每 {interval / 60:g} 分钟运行一轮。")
+        while not stop.is_set():
+            cycle = asyncio.create_task(
+                run_cycle(cfg, rss, hub_factory, http=http, dedup=dedup, outbox=outbox,
+                          report_idle=False, pool=pool))
+            stopper = asyncio.create_task(stop.wait())
+            await asyncio.wait({cycle, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            if not cycle.done():
+                print(f"🛑 收到停止信号，最多等待 {grace:g} 秒让本轮完成……")
+                await asyncio.wait({cycle}, timeout=grace)
+                cycle.cancel()
+            stopper.cancel()
+            try:
+                await cycle
+            except asyncio.CancelledError:
+                print("🛑 本轮已中断，未完成的文章保留到下次运行。")
+            except Exception as e:
+                print(f"🔥 本轮运行出错: {e}")
+            rss.force_refresh = configured_refresh
+            # 等待下一轮（期间收到信号立即退出）
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    except Exception as e:
+        print(f"🔥 程序运行期间发生致命错误: {e}")
+    finally:
+        await shutdown(rss, dedup, outbox, http, pool)
+        print("👋 常驻模式已退出，历史已写回。")
+
+
+async def flush_only():
+    """仅投递发件箱中积压的消息，不抓取、不调用 AI"""
+    try:
+        cfg = load_config(require_ai=False)
+        outbox = Outbox.from_config(cfg)
+        if outbox is None:
+            print("📭 未配置发件箱 ([SYSTEM] OutboxDB)，无需投递。")
+            return
+        sent, failed = await flush_outbox(cfg, outbox)
+        outbox.close()
+        print(f"📬 发件箱投递完成：成功 {sent} 条，失败 {failed} 条。")
     except Exception as e:
         print(f"🔥 程序运行期间发生致命错误: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="RSS 智能情报局")
+    parser.add_argument('--flush-outbox', action='store_true', help="仅重试发件箱中未送达的消息")
+    parser.add_argument('--force-refresh', action='store_true', help="忽略自适应轮询计划，抓取全部订阅源")
+    parser.add_argument('--daemon', action='store_true', help="常驻运行，按 DaemonIntervalMinutes 周期循环")
+    args = parser.parse_args()
+    if args.flush_outbox:
+        asyncio.run(flush_only())
+    elif args.daemon:
+        asyncio.run(daemon(force_refresh=args.force_refresh))
+    else:
+        asyncio.run(main(force_refresh=args.force_refresh))
\ No newline at end of file
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+
+def cache_key(text, model_name, prompt_version):
+    """内容寻址键：清洗后的正文 + 模型名 + prompt 版本"""
+    h = hashlib.sha256()
+    for part in (prompt_version, model_name, text):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ResultCache:
+    """持久化的 AI 结果缓存（SQLite），按条数与存活时间淘汰"""
+
+    def __init__(self, path="ai_cache.db", max_entries=500, max_age_days=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ai_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_ai_cache_last_used ON ai_cache (last_used);
+        """)
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, cfg):
+        """[AI] CacheDB 为空时不启用缓存"""
+        path = cfg.config.get('AI', 'CacheDB', fallback='').strip()
+        if not path:
+            return None
+        return cls(
+            path,
+            max_entries=cfg.config.getint('AI', 'CacheMaxEntries', fallback=500),
+            max_age_days=cfg.config.getint('AI', 'CacheMaxAgeDays', fallback=30),
+        )
+
+    def get(self, key):
+        """命中时返回结果字典并刷新使用时间，过期或不存在时返回 None"""
+        row = self.conn.execute("SELECT result, created FROM ai_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.max_age and row[1] < now - self.max_age:
+            return None
+        self.conn.execute("UPDATE ai_cache SET last_used = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ai_cache (key, result, created, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(result, ensure_ascii=False), now, now)
+        )
+        self.conn.commit()
+
+    def evict(self):
+        """删除过期条目，并按最近使用时间只保留 max_entries 条"""
+        if self.max_age:
+            self.conn.execute("DELETE FROM ai_cache WHERE created < ?", (time.time() - self.max_age,))
+        if self.max_entries:
+            self.conn.execute(
+                "DELETE FROM ai_cache WHERE key NOT IN "
+                "(SELECT key FROM ai_cache ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+
+    def close(self):
+        self.evict()
+        self.conn.close()
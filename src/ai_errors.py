@@ -0,0 +1,67 @@
+import asyncio
+import random
+import re
+from src.rate_limit import QuotaExhausted
+
+# 错误类别
+THROTTLED = "throttled"    # 每分钟限流 (RPM / TPM)：等待后重试
+EXHAUSTED = "exhausted"    # 当日配额耗尽 (RPD)：该端点今日不再可用
+TRANSIENT = "transient"    # 服务端 5xx / 超时 / 连接错误：退避后重试
+ABORTED = "aborted"        # 配额耗尽后被主动取消的请求
+FATAL = "fatal"            # 其他错误（请求非法、响应格式错误等）：不重试
+
+# 可重试的服务端状态码与状态名
+TRANSIENT_CODES = {500, 502, 503, 504}
+TRANSIENT_STATUSES = ("UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED")
+
+# 429 响应 QuotaFailure 中的按日配额标识，例如 GenerateRequestsPerDayPerProjectPerModel-FreeTier
+_PER_DAY_RE = re.compile(r'per\s*day', re.IGNORECASE)
+# RetryInfo 中服务端建议的等待时间，例如 'retryDelay': '34s'
+_RETRY_DELAY_RE = re.compile(r'retry_?delay[\'"]?\s*[:=]\s*[\'"]?(\d+(?:\.\d+)?)s', re.IGNORECASE)
+_CODE_RE = re.compile(r'^\s*(\d{3})\b')
+
+
+class RequestAborted(Exception):
+    """配额耗尽后被主动取消的请求"""
+
+
+def _status_code(e):
+    """google-genai 的 APIError 带 code 属性；其他异常从消息开头解析状态码"""
+    code = getattr(e, 'code', None)
+    if isinstance(code, int):
+        return code
+    match = _CODE_RE.match(str(e))
+    return int(match.group(1)) if match else None
+
+
+def classify(e):
+    """将 Gemini 调用异常归入 THROTTLED / EXHAUSTED / TRANSIENT / ABORTED / FATAL 之一"""
+    if isinstance(e, RequestAborted):
+        return ABORTED
+    if isinstance(e, QuotaExhausted):
+        return EXHAUSTED
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return TRANSIENT
+    message = str(e)
+    code = _status_code(e)
+    if code == 429 or "RESOURCE_EXHAUSTED" in message:
+        return EXHAUSTED if _PER_DAY_RE.search(message) else THROTTLED
+    if code in TRANSIENT_CODES or any(s in message for s in TRANSIENT_STATUSES):
+        return TRANSIENT
+    return FATAL
+
+
+def retry_delay(e):
+    """服务端在 RetryInfo 中给出的建议等待秒数，没有时返回 None"""
+    match = _RETRY_DELAY_RE.search(str(e))
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt, base=2.0, cap=60.0, server_delay=None):
+    """第 attempt 次重试（从 0 开始）前的等待秒数
+
+    服务端给出等待时间时照办并加少量抖动；否则使用带完全抖动的指数退避，避免多个 worker 同时重试。
+    """
+    if server_delay is not None:
+        return server_delay + random.uniform(0, min(1.0, base))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
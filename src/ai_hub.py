@@ -1,92 +1,501 @@
 import asyncio
-from google import genai
-from bs4 import BeautifulSoup
-import markdown
+import json
+import re
+import time
+from src.rate_limit import QuotaExhausted, estimate_tokens
+from src.model_pool import ModelPool
+from src.ai_errors import (
+    RequestAborted, classify, retry_delay, backoff_delay, THROTTLED, EXHAUSTED, TRANSIENT, ABORTED,
+)
+from src.ai_cache import ResultCache, cache_key
+from src.extract import extract_text
+
+# 每篇报告的输出 token 预估，计入 TPM 预算
+EXPECTED_OUTPUT_TOKENS = 800
+
+# 修改 prompt 或报告格式时递增，使旧的缓存结果失效
+PROMPT_VERSION = "1"
+
+REPORT_FORMAT = (
+    "## 1. 速览 (Summary)\n"
+    "- [Point 1: Concise summary in Chinese]\n"
+    "- [Point 2: Concise summary in Chinese]\n"
+    "- [Point 3: Concise summary in Chinese]\n\n"
+    "## 2. 深度 (Insights)\n"
+    "| Key Insight (English) | 核心观点 (Chinese) |\n"
+    "| :--- | :--- |\n"
+    "| [Key point 1 in English] | [Key point 1 in Chinese] |\n"
+    "| [Key point 2 in English] | [Key point 2 in Chinese] |\n"
+    "| [Key point 3 in English] | [Key point 3 in Chinese] |\n\n"
+    "Constraints:\n"
+    "- Ensure the Chinese summary captures 100% of the core value.\n"
+    "- The table must track the original English phrasing against the Chinese interpretation.\n"
+)
+
+
+# 结构化输出模式：要求 Gemini 按 JSON Schema 返回，省去 Markdown 格式说明与 HTML 往返转换
+REPORT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "insights": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"en": {"type": "STRING"}, "zh": {"type": "STRING"}},
+                "required": ["en", "zh"],
+            },
+        },
+    },
+    "required": ["summary", "insights"],
+}
+
+BATCH_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": dict(REPORT_SCHEMA["properties"], index={"type": "INTEGER"}),
+        "required": ["index", "summary", "insights"],
+    },
+}
+
+STRUCTURED_TASK = (
+    "summary: 3 concise points in Chinese capturing 100% of the core value; "
+    "insights: 3 key points, each with the original English phrasing (en) and its Chinese interpretation (zh).\n"
+)
+
+
+def parse_report(data):
+    """校验结构化报告，返回 {"summary": [...], "insights": [{"en", "zh"}, ...]}，格式不符时返回 None"""
+    if not isinstance(data, dict):
+        return None
+    summary = data.get('summary')
+    insights = data.get('insights')
+    if not isinstance(summary, list) or not isinstance(insights, list):
+        return None
+    summary = [str(s).strip() for s in summary if str(s).strip()]
+    insights = [{"en": str(i.get('en', '')).strip(), "zh": str(i.get('zh', '')).strip()}
+                for i in insights if isinstance(i, dict)]
+    if not summary:
+        return None
+    return {"summary": summary, "insights": insights}
+
+
+def has_result(art):
+    """文章是否已有 AI 总结（Markdown 模式的 ai_html 或结构化模式的 ai_data）"""
+    return 'ai_html' in art or 'ai_data' in art
+
+
+def clean_text(art):
+    """AI 使用的正文（结果保存在 art['text']，去重、批次规划与构造 prompt 共用）
+
+    新抓取的文章已在解析进程中提取好正文，这里只为旧的待处理文章补做提取。
+    """
+    if 'text' not in art:
+        art['text'] = extract_text(art['content'])
+    return art['text']
+
+# 批量模式下每篇报告前的分隔行，例如 ===REPORT 2===
+_REPORT_MARK_RE = re.compile(r'^\s*===\s*REPORT\s+(\d+)\s*===\s*$', re.MULTILINE)
+
+
+def create_pool(cfg):
+    """按配置创建 Key / 模型池（常驻模式下跨轮次复用，限流与配额状态随之保留）"""
+    # google.genai 导入耗时较长，只在确有文章需要 AI 处理时加载
+    from google import genai
+    return ModelPool.from_config(cfg, genai.Client)
+
+
+def to_html(text):
+    """Markdown 报告转 HTML（markdown 库按需加载）"""
+    import markdown
+    return markdown.markdown(text)
+
 
 class IntelligenceHub:
-    def __init__(self, cfg):
-        # 初始化最新的 Google GenAI 客户端
-        self.client = genai.Client(api_key=cfg.GEMINI_KEY)
-        self.model_name = cfg.config.get('AI', 'ModelName', fallback='gemini-1.5-flash')
-        self.delay = cfg.config.getint('AI', 'RequestDelay', fallback=4)
+    def __init__(self, cfg, pool=None):
+        # Key / 模型池：每个 Key × 模型一个端点，各自独立的 RPM / TPM / RPD 限流器
+        self.pool = pool or create_pool(cfg)
+        # 外部传入的模型池由调用方负责关闭
+        self._owns_pool = pool is None
         self.concurrency = cfg.config.getint('AI', 'Concurrency', fallback=2)
+        # 优先使用 SDK 原生异步接口 (client.aio)，其连接池在所有请求间共享
+        self.use_async = cfg.config.getboolean('AI', 'AsyncClient', fallback=True)
+        # 批量模式：将多篇短文打包进一次请求，0 表示关闭
+        self.batch_budget = cfg.config.getint('AI', 'BatchTokenBudget', fallback=0)
+        self.batch_size = cfg.config.getint('AI', 'BatchMaxArticles', fallback=5)
+        # 内容寻址的结果缓存：相同正文不重复调用 API
+        self.cache = ResultCache.from_config(cfg)
+        # 结构化输出模式：结果存入 art['ai_data']，由渲染器直接使用字段
+        self.structured = cfg.config.getboolean('AI', 'StructuredOutput', fallback=False)
+        # 限流 / 服务端临时错误的单篇重试次数上限与指数退避参数（秒）
+        self.max_retries = cfg.config.getint('AI', 'MaxRetries', fallback=3)
+        self.retry_base = cfg.config.getfloat('AI', 'RetryBaseDelay', fallback=2)
+        self.retry_cap = cfg.config.getfloat('AI', 'RetryMaxDelay', fallback=60)
+        self.quota_exceeded = False
+        # 每篇文章完成总结时的回调（用于检查点持久化）
+        self.on_result = None
+        # 进行中的请求任务，以及因配额耗尽被主动取消的请求
+        self._inflight = set()
+        self._aborted = set()
 
     async def process_articles(self, articles):
         """并行处理所有文章列表，支持配额异常捕获"""
+        queue = asyncio.Queue()
+        for art in articles:
+            queue.put_nowait(art)
+        queue.put_nowait(None)
+        return await self.process_stream(queue)
+
+    async def process_stream(self, queue, first=None):
+        """由 Concurrency 个 worker 持续消费队列直到结束标记 None
+
+        配额耗尽后 worker 不再发起请求，但继续排空队列，保证上游生产者不会因背压而阻塞；
+        被跳过的文章仍留在历史中，下次运行再处理。first 为调用方已从队列取出的第一篇。
+        """
         results = []
         self.quota_exceeded = False
-        
-        # 使用信号量控制并发，从配置中读取
-        sem = asyncio.Semaphore(self.concurrency) 
-        
-        async def _worker(art):
-            if self.quota_exceeded:
-                return None
-            
-            async with sem:
-                res = await self._process_one(art)
-                if res:
-                    results.append(res)
-                return res
-
-        # 创建所有任务
-        tasks = [_worker(art) for art in articles]
-        await asyncio.gather(*tasks)
+        preload = [first] if first is not None else []
+
+        async def _worker():
+            carry = []
+            while True:
+                if carry:
+                    art = carry.pop()
+                elif preload:
+                    art = preload.pop()
+                else:
+                    art = await queue.get()
+                if art is None:
+                    # 结束标记留给其他 worker
+                    queue.put_nowait(None)
+                    return
+                # 上次运行已总结、尚未投递的文章（检查点）直接完成
+                if has_result(art):
+                    results.append(art)
+                    continue
+                if self.quota_exceeded:
+                    continue
+                # 命中缓存的文章直接完成，不占用限流预算
+                if self._load_cached(art):
+                    self._complete(art, results)
+                    continue
+                unit = self._take_batch(art, queue, carry, results)
+                try:
+                    await self._run_unit(unit, results)
+                except Exception as e:
+                    print(f"❌ AI 处理异常: {e}")
+
+        workers = [asyncio.create_task(_worker()) for _ in range(max(1, self.concurrency))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            raise
                 
         return results, self.quota_exceeded
 
+    async def _run_unit(self, unit, results):
+        """处理一个批次（或单篇），批量响应中缺失/格式错误的文章改为单篇重试"""
+        if len(unit) > 1:
+            done, unit = await self._process_batch(unit)
+            for art in done:
+                self._complete(art, results)
+        for art in unit:
+            if self.quota_exceeded:
+                break
+            res = await self._process_one(art)
+            if res:
+                self._complete(res, results)
+
+    def _complete(self, art, results):
+        results.append(art)
+        if self.on_result is not None:
+            self.on_result(art)
+
+    def _batchable(self, art):
+        return (self.batch_budget > 0 and self.batch_size > 1
+                and estimate_tokens(clean_text(art)) <= self.batch_budget // 2)
+
+    def _take_batch(self, art, queue, carry, results):
+        """批量模式下从队列中顺带取出已就绪的短文，按 token 预算贪心打包；放不下的文章留给下一轮"""
+        unit = [art]
+        if not self._batchable(art):
+            return unit
+        used = estimate_tokens(clean_text(art))
+        while len(unit) < self.batch_size and not queue.empty():
+            nxt = queue.get_nowait()
+            if nxt is not None and has_result(nxt):
+                results.append(nxt)
+                continue
+            if nxt is not None and self._load_cached(nxt):
+                self._complete(nxt, results)
+                continue
+            if nxt is None or not self._batchable(nxt) or used + estimate_tokens(clean_text(nxt)) > self.batch_budget:
+                carry.append(nxt)
+                break
+            unit.append(nxt)
+            used += estimate_tokens(clean_text(nxt))
+        return unit
+
+    def _abort_inflight(self):
+        """配额耗尽后取消其余进行中的请求，异步请求会被真正中断"""
+        for request in list(self._inflight):
+            if not request.done():
+                self._aborted.add(request)
+                request.cancel()
+
+    async def _acquire(self, tokens):
+        """选择负载最低的健康端点并等待其限流器放行；端点当日额度用尽时换下一个，全部用尽时抛出 QuotaExhausted"""
+        while True:
+            endpoint = self.pool.pick(tokens)
+            if endpoint is None:
+                raise QuotaExhausted("模型池中所有端点的配额均已耗尽")
+            # 端点仍在限流冷却期内时先等待
+            cooldown = endpoint.available_at - time.monotonic()
+            if cooldown > 0:
+                await asyncio.sleep(cooldown)
+            try:
+                await endpoint.limiter.acquire(tokens)
+                return endpoint
+            except QuotaExhausted:
+                self.pool.mark_exhausted(endpoint)
+
+    async def _generate(self, endpoint, prompt, schema=None):
+        """以可取消的任务发起请求，被 _abort_inflight 取消时抛出 RequestAborted"""
+        request = asyncio.ensure_future(self._call_model(endpoint, prompt, schema))
+        self._inflight.add(request)
+        endpoint.inflight += 1
+        try:
+            return await request
+        except asyncio.CancelledError:
+            if request in self._aborted:
+                raise RequestAborted("配额耗尽，请求已取消") from None
+            raise
+        finally:
+            endpoint.inflight -= 1
+            self._inflight.discard(request)
+            self._aborted.discard(request)
+
+    async def _call_model(self, endpoint, prompt, schema=None):
+        """调用 Gemini：优先原生异步接口，不可用或被禁用时回退到线程池"""
+        kwargs = {}
+        if schema is not None:
+            kwargs['config'] = {"response_mime_type": "application/json", "response_schema": schema}
+        client = endpoint.client
+        if self.use_async and hasattr(client, 'aio'):
+            return await client.aio.models.generate_content(
+                model=endpoint.model_name,
+                contents=prompt,
+                **kwargs
+            )
+
+        # 使用 loop 包装同步的 SDK 调用
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, 
+            lambda: client.models.generate_content(
+                model=endpoint.model_name,
+                contents=prompt,
+                **kwargs
+            )
+        )
+
+    def _cache_key(self, art, model_name):
+        version = f"{PROMPT_VERSION}-json" if self.structured else PROMPT_VERSION
+        return cache_key(clean_text(art), model_name, version)
+
+    def _load_cached(self, art):
+        """按模型池的回退顺序查找任一模型已生成的结果"""
+        if self.cache is None:
+            return False
+        for model_name in self.pool.models():
+            cached = self.cache.get(self._cache_key(art, model_name))
+            if cached is not None:
+                print(f"♻️ 命中缓存: {art['title']}")
+                art.update(cached)
+                return True
+        return False
+
+    def _store_result(self, art, endpoint):
+        """结果按实际生成它的模型写入缓存"""
+        if self.cache is not None:
+            field = 'ai_data' if self.structured else 'ai_html'
+            self.cache.put(self._cache_key(art, endpoint.model_name), {field: art[field]})
+
+    async def close(self):
+        """关闭模型池（客户端共享连接与用量存储），并整理结果缓存"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self._owns_pool:
+            await self.pool.aclose()
+
     async def _process_one(self, art):
         """处理单篇文章"""
         print(f"🤖 正在处理: {art['title']}")
         
-        # 清理 HTML 标签
-        soup = BeautifulSoup(art['content'], "html.parser")
-        text = soup.get_text(separator="\n", strip=True)[:6000]
-        
-        prompt = (
-            "Role: Professional Bilingual News Editor.\n"
-            "Task: Analyze the provided content and output a structured report strictly in the following Markdown format:\n\n"
-            "## 1. 速览 (Summary)\n"
-            "- [Point 1: Concise summary in Chinese]\n"
-            "- [Point 2: Concise summary in Chinese]\n"
-            "- [Point 3: Concise summary in Chinese]\n\n"
-            "## 2. 深度 (Insights)\n"
-            "| Key Insight (English) | 核心观点 (Chinese) |\n"
-            "| :--- | :--- |\n"
-            "| [Key point 1 in English] | [Key point 1 in Chinese] |\n"
-            "| [Key point 2 in English] | [Key point 2 in Chinese] |\n"
-            "| [Key point 3 in English] | [Key point 3 in Chinese] |\n\n"
-            "Constraints:\n"
-            "- Ensure the Chinese summary captures 100% of the core value.\n"
-            "- The table must track the original English phrasing against the Chinese interpretation.\n"
-            f"Title: {art['title']}\n"
-            f"Content: {text}"
-        )
-        
-        try:
-            # 使用 loop 包装同步的 SDK 调用
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: self.client.models.generate_content(
-                    model=self.model_name, 
-                    contents=prompt
-                )
+        text = clean_text(art)
+        if self.structured:
+            prompt = (
+                "Role: Professional Bilingual News Editor.\n"
+                f"Task: Analyze the article and return JSON. {STRUCTURED_TASK}\n"
+                f"Title: {art['title']}\n"
+                f"Content: {text}"
+            )
+        else:
+            prompt = (
+                "Role: Professional Bilingual News Editor.\n"
+                "Task: Analyze the provided content and output a structured report strictly in the following Markdown format:\n\n"
+                f"{REPORT_FORMAT}"
+                f"Title: {art['title']}\n"
+                f"Content: {text}"
             )
-            
-            # 获取生成文本并转为 HTML
-            art['ai_html'] = markdown.markdown(response.text)
-            
-            # 免费版 API 必须设置延迟以防 RPM 限制
-            await asyncio.sleep(self.delay)
-            return art
+        
+        tokens = estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS
+        attempt = 0
+        while True:
+            endpoint = None
+            try:
+                # 按预估 token 成本等待所选端点的限流器放行
+                endpoint = await self._acquire(tokens)
+
+                if self.structured:
+                    response = await self._generate(endpoint, prompt, REPORT_SCHEMA)
+                    data = parse_report(json.loads(response.text))
+                    if data is None:
+                        raise ValueError("结构化响应缺少 summary / insights 字段")
+                    art['ai_data'] = data
+                else:
+                    response = await self._generate(endpoint, prompt)
+                    # 获取生成文本并转为 HTML
+                    art['ai_html'] = to_html(response.text)
+                self._store_result(art, endpoint)
+                return art
+
+            except Exception as e:
+                delay = self._on_error(e, endpoint, attempt, art['title'])
+                if delay is None:
+                    return None
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _process_batch(self, batch):
+        """一次请求处理多篇短文，返回 (成功的文章, 需要重新排队的文章)"""
+        print(f"🤖 正在批量处理 {len(batch)} 篇: " + " | ".join(art['title'] for art in batch))
 
+        if self.structured:
+            parts = [
+                "Role: Professional Bilingual News Editor.\n"
+                f"Task: Analyze each of the {len(batch)} articles below independently and return a JSON array "
+                f"with one object per article; index is the article number. {STRUCTURED_TASK}\n"
+            ]
+        else:
+            parts = [
+                "Role: Professional Bilingual News Editor.\n"
+                f"Task: Analyze each of the {len(batch)} articles below independently and output one report per article, "
+                "each strictly in the following Markdown format:\n\n"
+                f"{REPORT_FORMAT}"
+                "- Start each report with a line `===REPORT k===`, where k is the article number, and output the reports in order.\n\n"
+            ]
+        for i, art in enumerate(batch, 1):
+            parts.append(f"===ARTICLE {i}===\nTitle: {art['title']}\nContent: {clean_text(art)}\n\n")
+        prompt = "".join(parts)
+
+        endpoint = None
+        try:
+            endpoint = await self._acquire(estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS * len(batch))
+            response = await self._generate(endpoint, prompt, BATCH_SCHEMA if self.structured else None)
         except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg:
-                if not self.quota_exceeded:
-                    print(f"⚠️ AI 配额已耗尽，停止后续处理。")
-                    self.quota_exceeded = True
+            # 出错时（退避后）整批回退为单篇处理，由单篇的重试与端点回退接手（配额全部耗尽时会被跳过）
+            delay = self._on_error(e, endpoint, 0, f"批量 {len(batch)} 篇")
+            if delay:
+                await asyncio.sleep(delay)
+            return [], batch
+
+        if self.structured:
+            sections = self._split_structured(response.text or "", len(batch))
+        else:
+            sections = self._split_reports(response.text or "", len(batch))
+        done, retry = [], []
+        for i, art in enumerate(batch, 1):
+            section = sections.get(i)
+            if section:
+                if self.structured:
+                    art['ai_data'] = section
+                else:
+                    art['ai_html'] = to_html(section)
+                self._store_result(art, endpoint)
+                done.append(art)
             else:
-                print(f"❌ AI 处理失败 [{art['title']}]: {e}")
-            return None
\ No newline at end of file
+                retry.append(art)
+        if retry:
+            print(f"⚠️ 批量响应中有 {len(retry)} 篇缺失或格式错误，改为单篇重试。")
+        return done, retry
+
+    @staticmethod
+    def _split_reports(text, count):
+        """按 ===REPORT k=== 分隔符切分批量响应，只保留编号合法、内容含 Markdown 标题的段落"""
+        marks = list(_REPORT_MARK_RE.finditer(text))
+        sections = {}
+        for idx, mark in enumerate(marks):
+            num = int(mark.group(1))
+            end = marks[idx + 1].start() if idx + 1 < len(marks) else len(text)
+            body = text[mark.end():end].strip()
+            if 1 <= num <= count and num not in sections and "##" in body:
+                sections[num] = body
+        return sections
+
+    @staticmethod
+    def _split_structured(text, count):
+        """解析结构化批量响应，按 index 返回校验通过的报告"""
+        try:
+            items = json.loads(text)
+        except ValueError:
+            return {}
+        sections = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            num = item.get('index')
+            data = parse_report(item)
+            if isinstance(num, int) and 1 <= num <= count and num not in sections and data:
+                sections[num] = data
+        return sections
+
+    def _on_error(self, e, endpoint, attempt, label):
+        """按错误类别决定后续动作：返回重试前需等待的秒数，None 表示放弃本次处理
+
+        - 每分钟限流：该端点进入冷却（优先采用服务端给出的等待时间），文章换端点或稍后重试
+        - 当日配额耗尽：该端点停用，池中还有端点时立即换端点重试，全部耗尽才停止后续处理
+        - 5xx / 超时：带抖动的指数退避后重试
+        重试次数达到 MaxRetries 后放弃该文章，文章留在待处理列表中下次运行再处理。
+        """
+        kind = classify(e)
+        if kind == ABORTED:
+            return None
+        server_side = endpoint is not None and not isinstance(e, QuotaExhausted)
+        if kind == EXHAUSTED:
+            if server_side:
+                self.pool.mark_exhausted(endpoint)
+                if not self.pool.exhausted:
+                    return 0
+            if not self.quota_exceeded:
+                print(f"⚠️ AI 配额已耗尽，停止后续处理。")
+                self.quota_exceeded = True
+            # 服务端已拒绝时中断其余请求；本地预算用尽时已发出的请求仍在额度内，让其完成
+            if server_side:
+                self._abort_inflight()
+            return None
+        if kind in (THROTTLED, TRANSIENT) and attempt < self.max_retries:
+            delay = backoff_delay(attempt, self.retry_base, self.retry_cap, retry_delay(e))
+            reason = "触发限流" if kind == THROTTLED else "服务暂时不可用"
+            print(f"⏳ [{label}] {reason}，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+            if kind == THROTTLED and endpoint is not None:
+                # 冷却期由 _acquire 等待，其间其他端点可以接手
+                endpoint.cool_down(delay)
+                return 0
+            return delay
+        print(f"❌ AI 处理失败 [{label}]: {e}")
+        return None
@@ -0,0 +1,202 @@
+import asyncio
+import functools
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import time
+from src.ai_hub import clean_text, has_result
+
+# 拉丁文按单词切分，CJK 按单字切分
+_TOKEN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[^\W_]+')
+_PRIME = (1 << 61) - 1
+
+# LSH 分桶数与每桶行数，签名长度 = 两者之积
+DEFAULT_BANDS = 16
+ROWS_PER_BAND = 4
+
+
+class MinHasher:
+    """基于词级 shingle 的 MinHash 签名"""
+
+    def __init__(self, num_perm=64, shingle_size=4, seed=42, max_tokens=2000):
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self.shingle_size = shingle_size
+        self.max_tokens = max_tokens
+
+    def signature(self, text):
+        """返回签名列表；正文过短（不足以可靠比较）时返回 None"""
+        tokens = _TOKEN_RE.findall(text.lower())[:self.max_tokens]
+        k = self.shingle_size
+        if len(tokens) < k * 5:
+            return None
+        shingles = {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for s in shingles]
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self.params]
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """两个签名估算的 Jaccard 相似度"""
+        return sum(x == y for x, y in zip(sig_a, sig_b)) / len(sig_a)
+
+
+@functools.lru_cache(maxsize=None)
+def _hasher(num_perm):
+    return MinHasher(num_perm=num_perm)
+
+
+def signature(text, num_perm=DEFAULT_BANDS * ROWS_PER_BAND):
+    """计算 MinHash 签名（纯 Python、CPU 密集，新文章在解析进程中调用）"""
+    return _hasher(num_perm).signature(text)
+
+
+def signature_perms(cfg):
+    """启用近重复检测时解析进程需要计算的签名长度，未启用时为 0"""
+    if not cfg.config.get('DEDUP', 'IndexDB', fallback='').strip():
+        return 0
+    return DEFAULT_BANDS * ROWS_PER_BAND
+
+
+class NearDuplicateIndex:
+    """MinHash + LSH 近重复检测，签名与分桶持久化在 SQLite 中以便跨运行比较"""
+
+    def __init__(self, path="dedup.db", threshold=0.7, bands=DEFAULT_BANDS, retention_days=30):
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.retention = retention_days * 24 * 3600
+        self.hasher = _hasher(bands * ROWS_PER_BAND)
+        self.rows = len(self.hasher.params) // bands
+        # 本轮内代表文章的 LSH 分桶
+        self._local = {}
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                hash TEXT PRIMARY KEY,
+                sig TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON lsh_buckets (band, bucket);
+            CREATE INDEX IF NOT EXISTS idx_lsh_hash ON lsh_buckets (hash);
+        """)
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, cfg):
+        """[DEDUP] IndexDB 为空时不启用近重复检测"""
+        path = cfg.config.get('DEDUP', 'IndexDB', fallback='').strip()
+        if not path:
+            return None
+        return cls(
+            path,
+            threshold=cfg.config.getfloat('DEDUP', 'Threshold', fallback=0.7),
+            retention_days=cfg.config.getint('DEDUP', 'RetentionDays', fallback=30),
+        )
+
+    def _buckets(self, sig):
+        for band in range(self.bands):
+            chunk = sig[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(repr(chunk).encode(), digest_size=8).hexdigest()
+            yield band, digest
+
+    def _query_persisted(self, sig, exclude):
+        """在持久化索引中查找相似度达到阈值的已处理文章哈希"""
+        candidates = set()
+        for band, bucket in self._buckets(sig):
+            rows = self.conn.execute(
+                "SELECT hash FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)
+            )
+            candidates.update(r[0] for r in rows)
+        candidates.discard(exclude)
+        for u_hash in candidates:
+            row = self.conn.execute("SELECT sig FROM signatures WHERE hash = ?", (u_hash,)).fetchone()
+            if row and MinHasher.similarity(sig, json.loads(row[0])) >= self.threshold:
+                return u_hash
+        return None
+
+    def _signature(self, art):
+        """已有的签名（None 表示正文过短）长度匹配时直接使用，否则重新计算"""
+        if '_sig' in art:
+            sig = art['_sig']
+            if sig is None or len(sig) == len(self.hasher.params):
+                return sig
+        return self.hasher.signature(clean_text(art))
+
+    async def prepare(self, art):
+        """确保文章带有签名：新文章已在解析进程中算好，只为旧的待处理文章在线程中补算，不阻塞事件循环"""
+        if '_sig' not in art:
+            art['_sig'] = await asyncio.to_thread(self._signature, art)
+
+    def check(self, art):
+        """增量判断一篇文章，返回 'unique' / 'related' / 'skipped'
+
+        本轮内的重复项挂到首次出现的代表文章的 related 列表上（'related'），只占用一次 AI 调用；
+        与往期已处理文章重复的返回 'skipped'。
+        已有 AI 结果的文章（检查点）不会被合并或跳过，直接作为代表文章，避免丢弃已付费的总结。
+        """
+        sig = art['_sig'] = self._signature(art)
+        if sig is None:
+            return 'unique'
+
+        if not has_result(art):
+            for key in self._buckets(sig):
+                for rep in self._local.get(key, ()):
+                    if MinHasher.similarity(sig, rep['_sig']) >= self.threshold:
+                        related = rep.setdefault('related', [])
+                        # 从检查点恢复的代表文章已记录过这些转载
+                        if not art.get('hash') or all(r.get('hash') != art['hash'] for r in related):
+                            related.append({"title": art['title'], "link": art['link'],
+                                            "source": art['source'], "hash": art.get('hash')})
+                        print(f"🔗 近重复合并: {art['title']} -> {rep['title']}")
+                        return 'related'
+
+            if self._query_persisted(sig, art.get('hash')):
+                print(f"🔗 与往期文章重复，跳过: {art['title']}")
+                return 'skipped'
+
+        for key in self._buckets(sig):
+            self._local.setdefault(key, []).append(art)
+        return 'unique'
+
+    def reset(self):
+        """开始新的一轮：清空本轮代表文章（常驻模式下每轮调用，避免新文章并入已投递的文章）"""
+        self._local = {}
+
+    def add(self, articles):
+        """将处理完成的文章签名写入持久化索引"""
+        now = time.time()
+        for art in articles:
+            sig = art.pop('_sig', None)
+            u_hash = art.get('hash')
+            if sig is None or not u_hash:
+                continue
+            self.conn.execute(
+                "INSERT OR REPLACE INTO signatures (hash, sig, ts) VALUES (?, ?, ?)",
+                (u_hash, json.dumps(sig), now)
+            )
+            self.conn.execute("DELETE FROM lsh_buckets WHERE hash = ?", (u_hash,))
+            self.conn.executemany(
+                "INSERT INTO lsh_buckets (band, bucket, hash) VALUES (?, ?, ?)",
+                [(band, bucket, u_hash) for band, bucket in self._buckets(sig)]
+            )
+        self.conn.commit()
+
+    def prune(self):
+        cutoff = time.time() - self.retention
+        self.conn.execute(
+            "DELETE FROM lsh_buckets WHERE hash IN (SELECT hash FROM signatures WHERE ts < ?)", (cutoff,)
+        )
+        self.conn.execute("DELETE FROM signatures WHERE ts < ?", (cutoff,))
+        self.conn.commit()
+
+    def close(self):
+        self.prune()
+        self.conn.close()
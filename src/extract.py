@@ -0,0 +1,56 @@
+from src.rate_limit import estimate_tokens
+
+# 送入 AI 的正文默认 token 预算
+DEFAULT_TOKEN_BUDGET = 2000
+
+# 与正文无关的噪声元素，连同其内容一起删除
+NOISE_TAGS = (
+    'script', 'style', 'noscript', 'template', 'nav', 'header', 'footer', 'aside',
+    'figure', 'figcaption', 'form', 'button', 'iframe', 'svg', 'canvas', 'video', 'audio',
+)
+
+# 块级元素：其前后断段
+BLOCK_TAGS = (
+    'p', 'div', 'section', 'article', 'li', 'blockquote', 'pre', 'tr', 'table', 'ul', 'ol', 'dl', 'dt', 'dd',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'hr',
+)
+
+
+def paragraphs(content):
+    """用 lxml 解析 HTML 片段，去除噪声元素，按块级元素切分为段落列表"""
+    if not content or not content.strip():
+        return []
+    # lxml 按需加载：正文提取主要在解析进程中进行，主进程的空跑无需加载
+    import lxml.etree
+    import lxml.html
+    try:
+        root = lxml.html.fragment_fromstring(content, create_parent='div')
+    except (lxml.etree.ParserError, ValueError):
+        return [line.strip() for line in content.splitlines() if line.strip()]
+    lxml.etree.strip_elements(root, lxml.etree.Comment, *NOISE_TAGS, with_tail=False)
+    for el in root.iter(*BLOCK_TAGS):
+        # 块前的文字（父元素 text 或前一兄弟的 tail）与块内容之间、块与其后的 tail 之间都要断开
+        el.text = "\n" + el.text if el.text else "\n"
+        el.tail = "\n" + el.tail if el.tail else "\n"
+    return [" ".join(line.split()) for line in root.text_content().splitlines() if line.strip()]
+
+
+def _truncate(text, budget):
+    """单段超出预算时按比例截断，再逐步收缩到预算以内"""
+    while text and estimate_tokens(text) > budget:
+        text = text[:max(1, len(text) * budget // estimate_tokens(text) - 1)]
+    return text
+
+
+def extract_text(content, token_budget=DEFAULT_TOKEN_BUDGET):
+    """提取正文并按 token 预算在段落边界截断（首段本身超出预算时才截断段内）"""
+    kept, used = [], 0
+    for para in paragraphs(content):
+        cost = estimate_tokens(para)
+        if token_budget and used + cost > token_budget:
+            if not kept:
+                kept.append(_truncate(para, token_budget))
+            break
+        kept.append(para)
+        used += cost
+    return "\n".join(kept)
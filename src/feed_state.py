@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import statistics
+import time
+
+
+class FeedStateStore:
+    """按订阅源 URL 持久化的抓取状态（ETag / Last-Modified 校验值、高水位线、健康统计等）"""
+
+    # 每个源记录的最近条目 ID 数量，通常覆盖一次完整的订阅输出
+    SEEN_IDS_LIMIT = 100
+    # 每个源保留的最近抓取耗时样本数（用于计算延迟分位数）
+    LATENCY_SAMPLES = 20
+    # 用于估计发布节奏的最近发布时间戳数量
+    POST_TIMES_LIMIT = 20
+    # 轮询到期判断的提前量（间隔的比例），避免定时任务的少许抖动使源被推迟整整一个周期
+    POLL_SLACK = 0.1
+
+    def __init__(self, path="feed_state.json"):
+        self.path = path
+        self.feeds = self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                    if isinstance(raw, dict):
+                        return raw
+            except:
+                return {}
+        return {}
+
+    def get(self, url):
+        """返回某个源的状态字典（不存在时创建空字典）"""
+        return self.feeds.setdefault(url, {})
+
+    def update_validators(self, url, headers):
+        """记录响应中的缓存校验值，供下次条件请求使用"""
+        state = self.get(url)
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            value = headers.get(header)
+            if value:
+                state[key] = value
+            else:
+                state.pop(key, None)
+
+    def conditional_headers(self, url):
+        """根据已保存的校验值构造 If-None-Match / If-Modified-Since 请求头"""
+        state = self.feeds.get(url, {})
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return headers
+
+    def advance_watermark(self, url, entries):
+        """返回可能是新文章的条目，并推进该源的高水位线
+
+        带时间戳的条目按时间从新到旧扫描：ID 已见过的直接跳过（集合查找，无需哈希），
+        早于已记录窗口下界的部分视为已知区域，扫描到此停止；
+        没有时间戳的条目无法判断，全部交给哈希去重。
+        """
+        state = self.get(url)
+        seen = set(state.get('seen_ids', []))
+        floor = state.get('floor')
+        dated = sorted((e for e in entries if e.get('ts')), key=lambda e: e['ts'], reverse=True)
+
+        candidates = []
+        for entry in dated:
+            if floor is not None and entry['ts'] < floor:
+                break
+            if entry['id'] not in seen:
+                candidates.append(entry)
+        candidates.extend(e for e in entries if not e.get('ts'))
+
+        if dated:
+            window = dated[:self.SEEN_IDS_LIMIT]
+            state['hwm'] = max(state.get('hwm') or 0, window[0]['ts'])
+            state['floor'] = window[-1]['ts']
+            state['seen_ids'] = [e['id'] for e in window]
+        return candidates
+
+    def record_success(self, url, latency, now=None):
+        """记录一次成功抓取（含 304）：保存耗时样本，清零连续失败并关闭熔断"""
+        state = self.get(url)
+        state['latencies'] = (state.get('latencies', []) + [round(latency, 3)])[-self.LATENCY_SAMPLES:]
+        state['last_success'] = now or time.time()
+        for key in ('failures', 'retry_at', 'last_error'):
+            state.pop(key, None)
+
+    def record_failure(self, url, error, now=None, threshold=3, backoff=3600, max_backoff=86400):
+        """记录一次失败；连续失败达到 threshold 次后熔断，按指数退避推迟下次尝试"""
+        now = now or time.time()
+        state = self.get(url)
+        failures = state.get('failures', 0) + 1
+        state['failures'] = failures
+        state['last_error'] = str(error)[:200]
+        if threshold and failures >= threshold:
+            state['retry_at'] = now + min(max_backoff, backoff * 2 ** (failures - threshold))
+        return failures
+
+    def is_due(self, url, now=None):
+        """熔断期内返回 False；熔断到期后放行一次试探请求，失败则退避时间翻倍"""
+        retry_at = self.feeds.get(url, {}).get('retry_at')
+        return retry_at is None or (now or time.time()) >= retry_at
+
+    def latency(self, url, pct):
+        """最近抓取耗时的分位数（最近邻法），没有样本时返回 None"""
+        samples = sorted(self.feeds.get(url, {}).get('latencies', []))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))]
+
+    def adaptive_timeout(self, url, floor, ceiling, factor=3, min_samples=5):
+        """按该源的 p95 耗时推算超时：慢源可用满上限，快源出故障时不再拖满整段超时"""
+        p95 = self.latency(url, 95)
+        if p95 is None or len(self.feeds[url]['latencies']) < min_samples:
+            return ceiling
+        return max(floor, min(ceiling, p95 * factor))
+
+    def learn_cadence(self, url, entries):
+        """合并条目的发布时间戳，以最近相邻发布时间差的中位数作为该源的发布间隔（秒）"""
+        state = self.get(url)
+        stamps = set(state.get('post_times', [])) | {e['ts'] for e in entries if e.get('ts')}
+        stamps = sorted(stamps, reverse=True)[:self.POST_TIMES_LIMIT]
+        state['post_times'] = stamps
+        gaps = [newer - older for newer, older in zip(stamps, stamps[1:])]
+        if gaps:
+            state['interval'] = statistics.median(gaps)
+
+    def is_poll_due(self, url, now=None, min_interval=3600, max_interval=86400):
+        """上次成功抓取后经过了该源的发布间隔（限制在 [min_interval, max_interval]）才需要再次抓取
+
+        从未成功抓取或发布节奏未知时按 min_interval 处理。
+        """
+        state = self.feeds.get(url, {})
+        last = state.get('last_success')
+        if last is None:
+            return True
+        interval = max(min_interval, min(max_interval, state.get('interval', min_interval)))
+        return (now or time.time()) >= last + interval * (1 - self.POLL_SLACK)
+
+    def save(self):
+        """原子写入：先写临时文件再替换，避免中途崩溃留下损坏的状态文件"""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.feeds, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
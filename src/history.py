@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+
+
+class HistoryStore(ABC):
+    """历史记录存储接口：按链接哈希记录文章的处理状态与待处理正文"""
+
+    @abstractmethod
+    def known(self, hashes):
+        """返回 hashes 中已存在于历史的哈希集合"""
+
+    def __contains__(self, u_hash):
+        return bool(self.known([u_hash]))
+
+    @abstractmethod
+    def add_pending(self, records):
+        """批量写入新文章 [(hash, ts, data), ...]，已存在的哈希保持不变"""
+
+    @abstractmethod
+    def pending(self):
+        """所有待处理文章的 data，按 ts 降序；已总结未投递的文章附带检查点中的总结字段"""
+
+    @abstractmethod
+    def save_summary(self, u_hash, summary):
+        """检查点：立即持久化单篇文章的 AI 总结，状态为“已总结、未投递”"""
+
+    @abstractmethod
+    def mark_processed(self, hashes, ts):
+        """标记为已处理并清除正文；历史中尚不存在的哈希同样写入为已处理（各后端行为一致）"""
+
+    @abstractmethod
+    def prune(self, cutoff):
+        """删除已处理且 ts 不晚于 cutoff 的条目"""
+
+    @abstractmethod
+    def get(self, u_hash):
+        """返回单条记录 {"ts", "processed", ["data"], ["summary"]}，不存在时为 None"""
+
+    def flush(self):
+        """将内存中的改动持久化"""
+
+    def close(self):
+        self.flush()
+
+
+def load_json_history(path):
+    """读取 history.json，并自动迁移旧格式 (hash: timestamp) -> 新格式 (hash: {ts, processed})"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+    except:
+        return {}
+    upgraded = {}
+    for k, v in raw.items():
+        if isinstance(v, (int, float)):
+            upgraded[k] = {"ts": float(v), "processed": True}
+        else:
+            upgraded[k] = v
+    return upgraded
+
+
+class JsonHistoryStore(HistoryStore):
+    """整表读入内存、整体重写的 JSON 历史（兼容旧部署）"""
+
+    def __init__(self, path="history.json"):
+        self.path = path
+        self.records = load_json_history(path)
+
+    def known(self, hashes):
+        return {h for h in hashes if h in self.records}
+
+    def add_pending(self, records):
+        for u_hash, ts, data in records:
+            if u_hash not in self.records:
+                self.records[u_hash] = {"ts": ts, "processed": False, "data": data}
+
+    def pending(self):
+        items = [info for info in self.records.values()
+                 if not info.get('processed', False) and 'data' in info]
+        items.sort(key=lambda x: x.get('ts', 0), reverse=True)
+        return [dict(item['data'], **item.get('summary', {})) for item in items]
+
+    def save_summary(self, u_hash, summary):
+        info = self.records.get(u_hash)
+        if info is None or info.get('processed', False):
+            return
+        info['summary'] = summary
+        self.flush()
+
+    def mark_processed(self, hashes, ts):
+        for u_hash in hashes:
+            info = self.records.setdefault(u_hash, {})
+            info['processed'] = True
+            info['ts'] = ts
+            info.pop('data', None)
+            info.pop('summary', None)
+
+    def prune(self, cutoff):
+        self.records = {h: info for h, info in self.records.items()
+                        if not info.get('processed', False) or info.get('ts', 0) > cutoff}
+
+    def get(self, u_hash):
+        return self.records.get(u_hash)
+
+    def flush(self):
+        # 先写临时文件再替换，检查点写入中途崩溃也不会损坏历史
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.records, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """带索引的 SQLite 历史：增量写入，TTL 清理为单条 DELETE"""
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path="history.db", legacy_json=None):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self._init_schema()
+        if legacy_json:
+            migrate_json_history(legacy_json, self)
+
+    def _init_schema(self):
+        """按 PRAGMA user_version 逐级升级表结构"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS history (
+                    hash TEXT PRIMARY KEY,
+                    ts REAL NOT NULL,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    data TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_processed_ts ON history (processed, ts);
+            """)
+        if version < 2:
+            # v2: AI 总结检查点（已总结、未投递）
+            self.conn.execute("ALTER TABLE history ADD COLUMN summary TEXT")
+        self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM history LIMIT 1").fetchone() is None
+
+    def known(self, hashes):
+        hashes = list(hashes)
+        found = set()
+        # SQLite 默认单条语句最多 999 个参数，分块查询
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT hash FROM history WHERE hash IN ({marks})", chunk)
+            found.update(r[0] for r in rows)
+        return found
+
+    def add_pending(self, records):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO history (hash, ts, processed, data) VALUES (?, ?, 0, ?)",
+            [(h, ts, json.dumps(data, ensure_ascii=False)) for h, ts, data in records]
+        )
+        self.conn.commit()
+
+    def pending(self):
+        rows = self.conn.execute(
+            "SELECT data, summary FROM history WHERE processed = 0 AND data IS NOT NULL ORDER BY ts DESC"
+        )
+        return [dict(json.loads(data), **json.loads(summary or '{}')) for data, summary in rows]
+
+    def save_summary(self, u_hash, summary):
+        self.conn.execute(
+            "UPDATE history SET summary = ? WHERE hash = ? AND processed = 0",
+            (json.dumps(summary, ensure_ascii=False), u_hash)
+        )
+        self.conn.commit()
+
+    def mark_processed(self, hashes, ts):
+        self.conn.executemany(
+            "INSERT INTO history (hash, ts, processed, data) VALUES (?, ?, 1, NULL) "
+            "ON CONFLICT(hash) DO UPDATE SET processed = 1, ts = excluded.ts, data = NULL, summary = NULL",
+            [(h, ts) for h in hashes]
+        )
+        self.conn.commit()
+
+    def prune(self, cutoff):
+        self.conn.execute("DELETE FROM history WHERE processed = 1 AND ts <= ?", (cutoff,))
+        self.conn.commit()
+
+    def get(self, u_hash):
+        row = self.conn.execute(
+            "SELECT ts, processed, data, summary FROM history WHERE hash = ?", (u_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        info = {"ts": row[0], "processed": bool(row[1])}
+        if row[2] is not None:
+            info["data"] = json.loads(row[2])
+        if row[3] is not None:
+            info["summary"] = json.loads(row[3])
+        return info
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_json_history(json_path, store):
+    """一次性迁移：将 V1/V2 格式的 history.json 导入空的 SQLite 库，完成后重命名原文件"""
+    if not os.path.exists(json_path) or not store.is_empty():
+        return 0
+    records = load_json_history(json_path)
+    rows = [(h, float(info.get('ts', 0)), 1 if info.get('processed', False) else 0,
+             json.dumps(info['data'], ensure_ascii=False) if 'data' in info else None)
+            for h, info in records.items()]
+    store.conn.executemany(
+        "INSERT OR IGNORE INTO history (hash, ts, processed, data) VALUES (?, ?, ?, ?)", rows
+    )
+    store.conn.commit()
+    os.replace(json_path, f"{json_path}.migrated")
+    print(f"📦 已将 {len(rows)} 条历史记录从 {json_path} 迁移到 {store.path}")
+    return len(rows)
+
+
+def open_history_store(cfg, path=None, legacy_json=None):
+    """根据 [SYSTEM] HistoryBackend 创建历史存储（sqlite / json）
+
+    只有默认的 history.db 会自动迁移工作目录下的 history.json；指定其他路径（如调试库）时
+    只迁移显式传入的 legacy_json，避免把生产历史迁移进去。
+    """
+    backend = cfg.config.get('SYSTEM', 'HistoryBackend', fallback='sqlite').strip().lower()
+    if backend == 'json':
+        return JsonHistoryStore(path or "history.json")
+    if backend != 'sqlite':
+        raise ValueError(f"未知的 HistoryBackend: {backend}")
+    if path is None:
+        path = "history.db"
+        legacy_json = legacy_json or "history.json"
+    return SQLiteHistoryStore(path, legacy_json=legacy_json)
@@ -0,0 +1,62 @@
+import aiohttp
+
+
+class HttpPool:
+    """进程内共享的 aiohttp 连接池：抓取与通知阶段复用同一个 TCPConnector
+
+    全局连接上限与单主机上限分开控制，同一主机（如 substack、GitHub Pages）上的多个订阅源
+    只在该主机的名额内排队，不再占用其他主机的连接；DNS 结果与 keep-alive 连接在各阶段间复用。
+    """
+
+    def __init__(self, limit=10, limit_per_host=2, dns_ttl=300, keepalive=30, verify_ssl=False):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.verify_ssl = verify_ssl
+        self._connector = None
+
+    @classmethod
+    def from_config(cls, cfg):
+        conf = cfg.config
+        return cls(
+            limit=conf.getint('SYSTEM', 'MaxConcurrency', fallback=10),
+            limit_per_host=conf.getint('SYSTEM', 'MaxPerHost', fallback=2),
+            dns_ttl=conf.getint('SYSTEM', 'DnsCacheTTL', fallback=300),
+            keepalive=conf.getfloat('SYSTEM', 'KeepAlive', fallback=30),
+            verify_ssl=conf.getboolean('SYSTEM', 'VerifySSL', fallback=False),
+        )
+
+    @property
+    def connector(self):
+        """连接器绑定事件循环，首次使用时才创建；关闭后可在新的事件循环中重建"""
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+                ssl=self.verify_ssl,
+            )
+        return self._connector
+
+    def session(self, timeout=None):
+        """共享连接器的会话；会话关闭时不关闭连接器"""
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        return aiohttp.ClientSession(connector=self.connector, connector_owner=False, **kwargs)
+
+    async def close(self):
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+
+def fetch_timeout(cfg):
+    """抓取超时拆分为建立连接与读取两部分（读取超时按两次数据到达之间的间隔计算），另设单次请求总时长上限"""
+    conf = cfg.config
+    return aiohttp.ClientTimeout(
+        total=conf.getfloat('SYSTEM', 'FetchTimeout', fallback=30),
+        sock_connect=conf.getfloat('SYSTEM', 'ConnectTimeout', fallback=5),
+        sock_read=conf.getfloat('SYSTEM', 'ReadTimeout', fallback=15),
+    )
@@ -0,0 +1,164 @@
+import hashlib
+import time
+from src.rate_limit import RateLimiter, UsageLedger, quota_day
+
+
+def configured_keys(cfg):
+    """GEMINI_API_KEY 可用逗号分隔多个 Key"""
+    return [k.strip() for k in cfg.GEMINI_KEY.split(',') if k.strip()] or [cfg.GEMINI_KEY]
+
+
+def configured_models(cfg):
+    """[AI] ModelName 可用逗号分隔多个模型，按回退顺序排列"""
+    models = cfg.config.get('AI', 'ModelName', fallback='gemini-1.5-flash')
+    return [m.strip() for m in models.split(',') if m.strip()]
+
+
+def pool_size(cfg):
+    """端点数（Key 数 × 模型数），每个端点各有一份 RPM / TPM / RPD 额度"""
+    return len(configured_keys(cfg)) * len(configured_models(cfg))
+
+
+def endpoint_id(model, key):
+    """持久化用量时的端点标识：模型名 + Key 摘要，不落盘明文 Key"""
+    return f"{model}@{hashlib.sha256(key.encode()).hexdigest()[:10]}"
+
+
+def remaining_requests(cfg):
+    """不创建客户端，按持久化的当日用量估算模型池当日剩余请求数；未设置 RPD 时返回 None（不限）"""
+    rpd = cfg.config.getint('AI', 'RPD', fallback=0)
+    if not rpd:
+        return None
+    ledger = UsageLedger.from_config(cfg)
+    if ledger is None:
+        return rpd * pool_size(cfg)
+    try:
+        day = quota_day()
+        return sum(max(0, rpd - ledger.used(day, endpoint_id(model, key)))
+                   for model in configured_models(cfg) for key in configured_keys(cfg))
+    finally:
+        ledger.close()
+
+
+class Endpoint:
+    """一个 (API Key, 模型) 组合：独立的客户端、限流器与健康状态"""
+
+    def __init__(self, client, model_name, limiter, label=""):
+        self.client = client
+        self.model_name = model_name
+        self.limiter = limiter
+        self.label = label or model_name
+        # 当日配额耗尽后不再路由到该端点
+        self.exhausted = False
+        self.inflight = 0
+        # 被服务端限流 (429) 后的冷却截止时间 (monotonic)
+        self.available_at = 0.0
+
+    def cool_down(self, seconds):
+        """服务端限流时暂停使用该端点 seconds 秒"""
+        self.available_at = max(self.available_at, time.monotonic() + seconds)
+
+    def wait_time(self, tokens=0, now=None):
+        """发出请求前还需等待的秒数：限流器预算与冷却期取较大者"""
+        now = time.monotonic() if now is None else now
+        return max(self.limiter.wait_time(tokens, now), self.available_at - now, 0.0)
+
+    def __repr__(self):
+        return f"Endpoint({self.label})"
+
+
+class ModelPool:
+    """Key / 模型池：请求路由到负载最低的健康端点，模型耗尽时按配置顺序回退到下一个模型
+
+    endpoints 按回退顺序排列：同一模型的多个 Key 为同一层，层内按负载均衡，整层耗尽后才使用下一层。
+    """
+
+    def __init__(self, endpoints, ledger=None):
+        if not endpoints:
+            raise ValueError("模型池至少需要一个端点")
+        self.endpoints = endpoints
+        # 各端点每日请求计数的持久化存储，可为 None
+        self.ledger = ledger
+        self.day = quota_day()
+
+    @classmethod
+    def from_config(cls, cfg, client_factory):
+        """GEMINI_API_KEY 与 [AI] ModelName 均可用逗号分隔多个值；每个 Key × 模型一个端点，各自独立限流"""
+        keys = configured_keys(cfg)
+        models = configured_models(cfg)
+        clients = [client_factory(api_key=k) for k in keys]
+        ledger = UsageLedger.from_config(cfg)
+        endpoints = [
+            Endpoint(client, model, RateLimiter.from_config(cfg, ledger, endpoint_id(model, key)),
+                     label=f"{model}#{i + 1}" if len(keys) > 1 else model)
+            for model in models
+            for i, (key, client) in enumerate(zip(keys, clients))
+        ]
+        return cls(endpoints, ledger)
+
+    @property
+    def primary(self):
+        return self.endpoints[0]
+
+    @property
+    def exhausted(self):
+        self._roll_day()
+        return all(e.exhausted for e in self.endpoints)
+
+    def _roll_day(self):
+        """常驻运行跨过配额日时，当日耗尽的端点恢复可用"""
+        today = quota_day()
+        if today != self.day:
+            self.day = today
+            for e in self.endpoints:
+                e.exhausted = False
+
+    def models(self):
+        """去重后的模型名，按回退顺序"""
+        return list(dict.fromkeys(e.model_name for e in self.endpoints))
+
+    def pick(self, tokens=0):
+        """在第一个仍有健康端点的模型层中，选预计等待时间（限流 + 冷却）最短、进行中请求最少的端点；全部耗尽时返回 None"""
+        self._roll_day()
+        for model in self.models():
+            tier = [e for e in self.endpoints if e.model_name == model and not e.exhausted]
+            if tier:
+                now = time.monotonic()
+                return min(tier, key=lambda e: (e.wait_time(tokens, now), e.inflight))
+        return None
+
+    def remaining_requests(self):
+        """所有未耗尽端点当日剩余请求数之和；任一端点未设置 RPD 时返回 None（不限）"""
+        self._roll_day()
+        total = 0
+        for e in self.endpoints:
+            if e.exhausted:
+                continue
+            remaining = e.limiter.remaining_today
+            if remaining is None:
+                return None
+            total += remaining
+        return total
+
+    def mark_exhausted(self, endpoint):
+        if not endpoint.exhausted:
+            endpoint.exhausted = True
+            fallback = self.pick()
+            if fallback is not None:
+                print(f"⚠️ {endpoint.label} 配额已耗尽，切换到 {fallback.label}。")
+
+    def clients(self):
+        """去重后的客户端列表（同一 Key 的多个模型共用一个客户端）"""
+        return list({id(e.client): e.client for e in self.endpoints}.values())
+
+    async def aclose(self):
+        """关闭各客户端异步接口的共享连接与用量存储"""
+        for client in self.clients():
+            if hasattr(client, 'aio'):
+                try:
+                    await client.aio.aclose()
+                except Exception:
+                    pass
+        if self.ledger is not None:
+            self.ledger.close()
+            self.ledger = None
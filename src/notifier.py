@@ -1,8 +1,24 @@
+import os
 import smtplib
+import time
 import aiohttp
 import asyncio
 from email.mime.text import MIMEText
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
+from src import renderer
+from src.telegram_sender import TelegramSender, TelegramSendError, TelegramPermanentError, split_message
+
+# smtplib 为阻塞调用，统一放到专用线程中执行，避免冻结事件循环
+_smtp_executor = None
+
+
+def _get_smtp_executor():
+    global _smtp_executor
+    if _smtp_executor is None:
+        _smtp_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+    return _smtp_executor
+
 
 class EmailNotifier:
     def __init__(self, cfg):
@@ -10,146 +26,230 @@ class EmailNotifier:
 
     def send_report(self, processed_articles, warning=None):
         """构建并发送 HTML 格式的每日报告"""
-        msg = MIMEMultipart()
-        
-        if not processed_articles:
-            msg['Subject'] = "RSS 智能情报局 - 今日暂无新情报"
-        else:
-            msg['Subject'] = f"RSS 智能情报局 - {len(processed_articles)} 篇新更新"
-            
-        msg['From'] = self.cfg.SENDER
-        msg['To'] = self.cfg.RECEIVER
+        self.send_items(renderer.prepare(processed_articles), warning=warning)
 
-        # 构建邮件正文
-        body = "<html><body style='font-family: Arial, sans-serif; color: #333; max-width: 800px; margin: 0 auto;'>"
-        
-        if warning:
-            body += f"""
-            <div style='background-color: #fff3cd; color: #856404; border: 1px solid #ffeeba; padding: 15px; margin-bottom: 20px; border-radius: 4px;'>
-                <strong>⚠️ 注意:</strong> {warning}
-            </div>
-            """
-
-        if not processed_articles:
-            body += f"""
-            <div style='text-align: center; padding: 50px 20px; color: #666;'>
-                <h2 style='color: #1a73e8;'>☕ 今日暂无新情报</h2>
-                <p>系统运行正常，所有订阅源均已同步，暂未发现符合条件的更新。</p>
-            </div>
-            """
-        else:
-            body += "<h1 style='color: #1a73e8; border-bottom: 2px solid #1a73e8; padding-bottom: 10px;'>今日情报摘要</h1>"
-            for art in processed_articles:
-                body += f"""
-                <div style='margin-bottom: 40px; border-left: 4px solid #1a73e8; padding-left: 15px;'>
-                    <h2 style='margin-top: 0;'><a href='{art['link']}' style='text-decoration: none; color: #1a73e8;'>{art['title']}</a></h2>
-                    <p style='font-size: 0.9em; color: #666;'>来源: {art['source']}</p>
-                    <div style='line-height: 1.6;'>{art['ai_html']}</div>
-                </div>
-                """
-        
-        body += "</body></html>"
-        msg.attach(MIMEText(body, 'html'))
+    def send_items(self, items, warning=None):
+        """发送已转换为渲染中间形式（renderer.prepare）的报告，多渠道共用同一次转换"""
+        self.deliver(renderer.render_email(items, warning=warning))
 
+    def render(self, processed_articles, warning=None):
+        """渲染报告为 {"subject", "html"}，可直接存入发件箱"""
+        return renderer.render_email(renderer.prepare(processed_articles), warning=warning)
+
+    def deliver(self, payload):
+        """发送已渲染的报告，失败时抛出异常"""
+        sent, error = self.deliver_many([payload])
+        if error:
+            raise error
+
+    def deliver_many(self, payloads):
+        """复用一条 SMTP 连接按顺序发送多份报告，返回 (成功份数, 异常或 None)"""
+        sent = 0
         try:
-            host = self.cfg.config.get('SMTP', 'Server')
-            port = self.cfg.config.getint('SMTP', 'Port')
-            
-            if port == 465:
-                server = smtplib.SMTP_SSL(host, port, timeout=30)
-            else:
-                server = smtplib.SMTP(host, port, timeout=30)
-                if port == 587:
-                    server.starttls()
-            
-            with server:
+            with self._connect() as server:
                 server.login(self.cfg.SENDER, self.cfg.SMTP_PASS)
-                server.sendmail(self.cfg.SENDER, self.cfg.RECEIVER, msg.as_string())
-            print("邮件报告发送成功！")
+                for payload in payloads:
+                    server.sendmail(self.cfg.SENDER, self.cfg.RECEIVER, self._build_message(payload).as_string())
+                    sent += 1
+                    print("邮件报告发送成功！")
         except Exception as e:
             print(f"邮件发送失败: {e}")
             if "EOF" in str(e) or "protocol" in str(e).lower():
                 print("💡 诊断提示: 检测到 SSL 握手异常。这通常是因为 Gmail/国外邮箱的 SMTP 服务被网络环境封锁。")
                 print("💡 解决建议: 建议更换为国内邮箱（如 QQ、163）的 SMTP 服务，稳定性更高。")
-            raise e
+            return sent, e
+        return sent, None
+
+    async def deliver_async(self, payloads):
+        """在专用 SMTP 线程中发送，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_smtp_executor(), self.deliver_many, payloads)
+
+    def _connect(self):
+        host = self.cfg.config.get('SMTP', 'Server')
+        port = self.cfg.config.getint('SMTP', 'Port')
+        timeout = self.cfg.config.getint('SMTP', 'Timeout', fallback=30)
+        if port == 465:
+            return smtplib.SMTP_SSL(host, port, timeout=timeout)
+        server = smtplib.SMTP(host, port, timeout=timeout)
+        if port == 587:
+            server.starttls()
+        return server
+
+    def _build_message(self, payload):
+        msg = MIMEMultipart()
+        msg['Subject'] = payload['subject']
+        msg['From'] = self.cfg.SENDER
+        msg['To'] = self.cfg.RECEIVER
+        msg.attach(MIMEText(payload['html'], 'html'))
+        return msg
 
 class TelegramNotifier:
-    def __init__(self, cfg):
+    def __init__(self, cfg, http=None):
         self.cfg = cfg
+        # 与抓取阶段共享的连接池（src.http_pool.HttpPool），未传入时每次投递自建会话
+        self.http = http
         self.token = cfg.TELEGRAM_BOT_TOKEN
-        self.chat_id = cfg.TELEGRAM_CHAT_ID
+        # TELEGRAM_CHAT_ID 支持以逗号分隔的多个聊天
+        self.chat_ids = [c.strip() for c in cfg.TELEGRAM_CHAT_ID.split(',') if c.strip()]
+        self.timeout = aiohttp.ClientTimeout(total=cfg.config.getint('TELEGRAM', 'Timeout', fallback=30))
+        self.sender = TelegramSender(
+            self.token,
+            global_rate=cfg.config.getint('TELEGRAM', 'GlobalRate', fallback=30),
+            chat_interval=cfg.config.getfloat('TELEGRAM', 'ChatInterval', fallback=1.0),
+            max_retries=cfg.config.getint('TELEGRAM', 'MaxRetries', fallback=3),
+        )
+
+    def session(self):
+        """所有聊天共享的会话；传入共享连接池时复用其中的 keep-alive 连接与 DNS 缓存"""
+        if self.http is not None:
+            return self.http.session(self.timeout)
+        return aiohttp.ClientSession(timeout=self.timeout)
 
     async def send_report(self, processed_articles, warning=None):
-        """发送 Telegram 消息报告"""
-        if not processed_articles:
-            header = "☕ <b>RSS 智能情报局 - 今日暂无新情报</b>\n\n系统运行正常，暂未发现新文章。"
-            if warning:
-                header += f"\n\n⚠️ <b>注意: {warning}</b>"
-            messages = [header]
-        else:
-            header = f"🚀 <b>RSS 智能情报局 - {len(processed_articles)} 篇新更新</b>\n"
-            if warning:
-                header += f"\n⚠️ <b>注意: {warning}</b>\n"
-            header += "\n"
-            
-            messages = []
-            current_msg = header
-            
-            for art in processed_articles:
-                # AI summary is in HTML, we need to convert or strip it for Telegram
-                ai_summary = art.get('ai_html', '')
-                
-                # Simple HTML to Telegram HTML conversion
-                import re
-                ai_summary = re.sub(r'<h[1-6]>(.*?)</h[1-6]>', r'<b>\1</b>', ai_summary)
-                ai_summary = ai_summary.replace('<p>', '').replace('</p>', '\n')
-                ai_summary = ai_summary.replace('<ul>', '').replace('</ul>', '')
-                ai_summary = ai_summary.replace('<li>', '• ').replace('</li>', '\n')
-                ai_summary = re.sub(r'<(?!/?(b|strong|i|em|u|ins|s|strike|del|a|code|pre)\b)[^>]+>', '', ai_summary)
-                
-                item_text = f"<b><a href='{art['link']}'>{art['title']}</a></b>\n"
-                item_text += f"<i>来源: {art['source']}</i>\n"
-                item_text += f"{ai_summary.strip()}\n\n"
-                
-                if len(current_msg) + len(item_text) > 4000:
-                    messages.append(current_msg)
-                    current_msg = item_text
-                else:
-                    current_msg += item_text
-            
-            messages.append(current_msg)
-
-        async with aiohttp.ClientSession() as session:
-            for msg in messages:
-                url = f"https://api.telegram.org/bot{self.token}/sendMessage"
-                payload = {
-                    "chat_id": self.chat_id,
-                    "text": msg,
-                    "parse_mode": "HTML",
-                    "disable_web_page_preview": True
-                }
-                try:
-                    async with session.post(url, json=payload) as resp:
-                        if resp.status != 200:
-                            err_text = await resp.text()
-                            print(f"Telegram 发送失败 ({resp.status}): {err_text}")
-                        else:
-                            print("Telegram 报告发送成功！")
-                except Exception as e:
-                    print(f"Telegram 发送异常: {e}")
-
-async def send_all_reports(cfg, processed_articles, warning=None):
-    """根据配置发送所有启用的通知"""
-    tasks = []
-    
-    # 1. Email (Sync)
-    try:
-        email_notifier = EmailNotifier(cfg)
-        email_notifier.send_report(processed_articles, warning=warning)
-    except Exception as e:
-        print(f"邮件发送失败，跳过: {e}")
-
-    # 2. Telegram (Async)
+        """发送 Telegram 消息报告，多个聊天并发投递"""
+        await self.send_items(renderer.prepare(processed_articles), warning=warning)
+
+    async def send_items(self, items, warning=None):
+        """发送已转换为渲染中间形式（renderer.prepare）的报告"""
+        messages = split_message(renderer.render_telegram(items, warning=warning))
+        async with self.session() as session:
+            await asyncio.gather(*(self.deliver_chat(session, chat_id, messages) for chat_id in self.chat_ids))
+
+    async def deliver_chat(self, session, chat_id, messages, on_sent=None):
+        """向一个聊天按顺序发送，失败即停止以保持顺序；返回 (成功条数, 异常或 None)"""
+        for i, msg in enumerate(messages):
+            try:
+                await self.sender.send(session, chat_id, msg)
+            except TelegramSendError as e:
+                print(f"Telegram 发送异常 (chat {chat_id}): {e}")
+                return i, e
+            if on_sent is not None:
+                on_sent(i)
+        print(f"Telegram 报告发送成功！(chat {chat_id})")
+        return len(messages), None
+
+    def render(self, processed_articles, warning=None):
+        """渲染报告为按 UTF-16 长度切分的消息列表"""
+        return split_message(renderer.render_telegram(renderer.prepare(processed_articles), warning=warning))
+
+async def send_all_reports(cfg, processed_articles, warning=None, http=None):
+    """根据配置并发发送所有启用的通知，总耗时取决于最慢的渠道"""
+    # 文章只转换一次，各渠道与归档共用
+    items = renderer.prepare(processed_articles)
+    archive_report(cfg, items, warning=warning)
+
+    async def _email():
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                _get_smtp_executor(),
+                lambda: EmailNotifier(cfg).send_items(items, warning=warning)
+            )
+        except Exception as e:
+            print(f"邮件发送失败，跳过: {e}")
+
+    tasks = [_email()]
     if cfg.config.getboolean('TELEGRAM', 'Enabled', fallback=False):
-        tg_notifier = TelegramNotifier(cfg)
-        await tg_notifier.send_report(processed_articles, warning=warning)
+        tasks.append(TelegramNotifier(cfg, http=http).send_items(items, warning=warning))
+    await asyncio.gather(*tasks)
+
+
+def archive_report(cfg, items, warning=None):
+    """[SYSTEM] ArchiveDir 非空时，将本轮报告以 Markdown 追加到按日期命名的归档文件"""
+    archive_dir = cfg.config.get('SYSTEM', 'ArchiveDir', fallback='').strip()
+    if not archive_dir:
+        return None
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{time.strftime('%Y-%m-%d')}.md")
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(renderer.render_markdown(items, warning=warning, date=time.strftime('%Y-%m-%d %H:%M')))
+    return path
+
+
+def enabled_channels(cfg):
+    """已配置的投递渠道"""
+    channels = []
+    if cfg.SENDER and cfg.RECEIVER:
+        channels.append('email')
+    if cfg.config.getboolean('TELEGRAM', 'Enabled', fallback=False):
+        channels.append('telegram')
+    return channels
+
+
+def enqueue_reports(cfg, outbox, processed_articles, warning=None):
+    """按渠道渲染报告并写入发件箱；写入后即可安全地将文章标记为已处理"""
+    # 文章只转换一次，各渠道与归档共用
+    items = renderer.prepare(processed_articles)
+    archive_report(cfg, items, warning=warning)
+    for channel in enabled_channels(cfg):
+        if channel == 'email':
+            payloads = [renderer.render_email(items, warning=warning)]
+        else:
+            # 每个聊天独立排队，某个聊天失败重试时不会向其他聊天重复发送
+            notifier = TelegramNotifier(cfg)
+            messages = split_message(renderer.render_telegram(items, warning=warning))
+            payloads = [{"chat_id": chat_id, "text": msg} for chat_id in notifier.chat_ids for msg in messages]
+        outbox.enqueue(channel, payloads)
+
+
+async def flush_outbox(cfg, outbox, http=None):
+    """并发投递各渠道发件箱中的待发消息，返回 (成功数, 失败数)
+
+    每个渠道按入队顺序发送，遇到失败即停止该渠道（保留顺序，避免反复冲击故障服务），
+    失败的消息留在发件箱中，下次运行或 --flush-outbox 时重试。
+    """
+    counts = await asyncio.gather(_flush_email(cfg, outbox), _flush_telegram(cfg, outbox, http))
+    sent = sum(c[0] for c in counts)
+    failed = sum(c[1] for c in counts)
+    remaining = outbox.count_pending()
+    if remaining:
+        print(f"📮 发件箱仍有 {remaining} 条消息待投递，将在下次运行时重试。")
+    return sent, failed
+
+
+async def _flush_email(cfg, outbox):
+    items = outbox.pending('email')
+    if not items:
+        return 0, 0
+    # 发件箱只在事件循环线程中读写，SMTP 线程仅负责发送
+    sent, error = await EmailNotifier(cfg).deliver_async([payload for _, payload in items])
+    for item_id, _ in items[:sent]:
+        outbox.mark_delivered(item_id)
+    if error is not None:
+        outbox.mark_failed(items[sent][0], str(error))
+        return sent, 1
+    return sent, 0
+
+
+async def _flush_telegram(cfg, outbox, http=None):
+    items = outbox.pending('telegram')
+    if not items:
+        return 0, 0
+    notifier = TelegramNotifier(cfg, http=http)
+    by_chat = {}
+    for item_id, payload in items:
+        by_chat.setdefault(payload['chat_id'], []).append((item_id, payload['text']))
+
+    async def _chat(session, chat_id, chat_items):
+        total_sent = failed = 0
+        while chat_items:
+            sent, error = await notifier.deliver_chat(
+                session, chat_id, [text for _, text in chat_items],
+                on_sent=lambda i, items=chat_items: outbox.mark_delivered(items[i][0])
+            )
+            total_sent += sent
+            if error is None:
+                break
+            failed += 1
+            if not isinstance(error, TelegramPermanentError):
+                outbox.mark_failed(chat_items[sent][0], str(error))
+                break
+            # 永久失败的消息直接放弃，继续投递该聊天后续的消息，避免堵塞队列
+            outbox.mark_dead(chat_items[sent][0], str(error))
+            chat_items = chat_items[sent + 1:]
+        return total_sent, failed
+
+    async with notifier.session() as session:
+        counts = await asyncio.gather(*(_chat(session, c, chat_items) for c, chat_items in by_chat.items()))
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import time
+
+
+class Outbox:
+    """持久化发件箱（SQLite）：渲染好的报告按渠道排队，确认送达后才标记完成
+
+    投递失败不影响 AI 处理结果：文章在报告入队后即可标记为已处理，
+    未送达的消息在后续运行或 --flush-outbox 时重试，不会重复消耗 AI 配额。
+    """
+
+    def __init__(self, path="outbox.db", max_attempts=10, retention_days=7):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retention = retention_days * 24 * 3600
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                delivered REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (channel, delivered, id);
+        """)
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, cfg):
+        """[SYSTEM] OutboxDB 为空时不启用发件箱（直接发送，失败不重试）"""
+        path = cfg.config.get('SYSTEM', 'OutboxDB', fallback='').strip()
+        if not path:
+            return None
+        return cls(
+            path,
+            max_attempts=cfg.config.getint('SYSTEM', 'OutboxMaxAttempts', fallback=10),
+            retention_days=cfg.config.getint('SYSTEM', 'RetentionDays', fallback=7),
+        )
+
+    def enqueue(self, channel, payloads):
+        """按顺序写入同一渠道的多条消息"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO outbox (channel, payload, created) VALUES (?, ?, ?)",
+            [(channel, json.dumps(p, ensure_ascii=False), now) for p in payloads]
+        )
+        self.conn.commit()
+
+    def pending(self, channel):
+        """该渠道待投递的消息 [(id, payload), ...]，按入队顺序；超过重试上限的不再返回"""
+        rows = self.conn.execute(
+            "SELECT id, payload FROM outbox WHERE channel = ? AND delivered IS NULL AND attempts < ? ORDER BY id",
+            (channel, self.max_attempts)
+        )
+        return [(item_id, json.loads(payload)) for item_id, payload in rows]
+
+    def count_pending(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE delivered IS NULL AND attempts < ?", (self.max_attempts,)
+        ).fetchone()[0]
+
+    def mark_delivered(self, item_id):
+        self.conn.execute("UPDATE outbox SET delivered = ? WHERE id = ?", (time.time(), item_id))
+        self.conn.commit()
+
+    def mark_failed(self, item_id, error):
+        self.conn.execute(
+            "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?", (error[:500], item_id)
+        )
+        self.conn.commit()
+
+    def mark_dead(self, item_id, error):
+        """永久失败（重试无益）的消息直接放弃，不再占用该渠道的投递顺序"""
+        self.conn.execute(
+            "UPDATE outbox SET attempts = MAX(attempts + 1, ?), last_error = ? WHERE id = ?",
+            (self.max_attempts, error[:500], item_id)
+        )
+        self.conn.commit()
+
+    def prune(self):
+        """删除已送达或放弃重试、且超过保留期的消息"""
+        cutoff = time.time() - self.retention
+        self.conn.execute(
+            "DELETE FROM outbox WHERE created < ? AND (delivered IS NOT NULL OR attempts >= ?)",
+            (cutoff, self.max_attempts)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.prune()
+        self.conn.close()
@@ -1,130 +1,362 @@
 import asyncio
+import calendar
 import hashlib
-import json
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 import aiohttp
-import feedparser
+from src.feed_state import FeedStateStore
+from src.history import open_history_store
+from src.ai_hub import has_result
+from src.dedup import signature, signature_perms
+from src.extract import extract_text, DEFAULT_TOKEN_BUDGET
+from src.http_pool import HttpPool, fetch_timeout
+
+
+def parse_feed(body, token_budget=DEFAULT_TOKEN_BUDGET, sig_perms=0):
+    """在解析进程中运行：解析原始字节并提取正文，只返回后续流程需要的字段（便于跨进程传递）
+
+    sig_perms 非 0 时同时计算近重复检测的 MinHash 签名，避免在事件循环中做 CPU 密集计算。
+    """
+    # feedparser 只在解析进程（或 ParseWorkers = 0 时的主进程）中加载
+    import feedparser
+    parsed = feedparser.parse(body)
+    entries = []
+    for entry in parsed.entries:
+        link = entry.get('link')
+        if not link:
+            continue
+        # 取发布/更新时间中较新的一个作为条目时间戳，均缺失时为 None
+        # dict.get 绕过 feedparser 对 updated_parsed 的兼容映射（会触发弃用警告）
+        stamps = [calendar.timegm(t) for t in (dict.get(entry, 'published_parsed'), dict.get(entry, 'updated_parsed')) if t]
+        content = entry.get('content', [{}])[0].get('value', entry.get('summary', ''))
+        # 正文提取同样在解析进程中完成，AI 侧直接使用
+        text = extract_text(content, token_budget)
+        item = {
+            "title": entry.get('title', 'Untitled'),
+            "link": link,
+            "content": content,
+            "text": text,
+            "id": entry.get('id') or link,
+            "ts": max(stamps) if stamps else None,
+        }
+        if sig_perms:
+            item["sig"] = signature(text, sig_perms)
+        entries.append(item)
+    return {"title": parsed.feed.get('title', 'Unknown Source'), "entries": entries}
+
+
+def parse_opml(path):
+    """用标准库解析 OPML，返回 [(xmlUrl, priority 属性), ...]
+
+    priority 可写在订阅源 outline 上，也可写在分组 outline 上由其下的订阅源继承；
+    文件不是合法 XML 时回退到容错的 BeautifulSoup 解析。
+    """
+    import xml.etree.ElementTree as ET
+    try:
+        root = ET.parse(path).getroot()
+    except ET.ParseError:
+        return _parse_opml_lenient(path)
+
+    feeds = []
+
+    def _walk(node, inherited):
+        for child in node:
+            priority = inherited
+            if child.tag == 'outline':
+                priority = child.get('priority', inherited)
+                if child.get('xmlUrl'):
+                    feeds.append((child.get('xmlUrl'), priority))
+            _walk(child, priority)
+
+    _walk(root, None)
+    return feeds
+
+
+def _parse_opml_lenient(path):
+    from bs4 import BeautifulSoup
+    with open(path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'xml')
+    feeds = []
+    for o in soup.find_all('outline'):
+        if not o.get('xmlUrl'):
+            continue
+        priority = o.get('priority')
+        for parent in o.find_parents('outline'):
+            if priority is not None:
+                break
+            priority = parent.get('priority')
+        feeds.append((o.get('xmlUrl'), priority))
+    return feeds
+
+
+def parse_feed_list(path):
+    """feeds.txt：每行一个 URL，# 开头为注释"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(l.strip(), None) for l in f if l.strip() and not l.startswith("#")]
+
+
+# 订阅列表解析缓存 {路径: ((mtime_ns, size), feeds)}，文件未修改时直接复用
+_feed_list_cache = {}
+
+
+def load_cached(path, parse):
+    """按修改时间与大小校验的解析缓存：同一轮内多次读取及常驻模式的后续轮次不再重复解析"""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _feed_list_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return list(cached[1]), False
+    feeds = parse(path)
+    _feed_list_cache[path] = (key, feeds)
+    return list(feeds), True
+
+
+# 检查点中保存的 AI 结果字段（已总结、未投递的文章在下次运行时直接复用）
+SUMMARY_FIELDS = ('ai_html', 'ai_data', 'related')
+
 
 class RSSManager:
-    def __init__(self, cfg, opml="subscriptions.opml", txt="feeds.txt", db="history.json"):
+    def __init__(self, cfg, opml="subscriptions.opml", txt="feeds.txt", db=None, state="feed_state.json", http=None):
         self.opml = opml
         self.txt = txt
-        self.db = db
+        self.feed_state = FeedStateStore(state)
         self.retention_days = cfg.config.getint('SYSTEM', 'RetentionDays', fallback=30)
-        self.semaphore = asyncio.Semaphore(cfg.config.getint('SYSTEM', 'MaxConcurrency', fallback=10))
-        self.history = self._load_history()
-
-    def _load_history(self):
-        if os.path.exists(self.db):
-            try:
-                with open(self.db, 'r', encoding='utf-8') as f:
-                    raw = json.load(f)
-                    
-                    # 自动迁移旧格式 (hash: timestamp) -> 新格式 (hash: {ts, processed})
-                    upgraded = {}
-                    for k, v in raw.items():
-                        if isinstance(v, (int, float)):
-                            upgraded[k] = {"ts": float(v), "processed": True}
-                        else:
-                            upgraded[k] = v
-                    return upgraded
-            except:
-                return {}
-        return {}
+        # 共享连接池（全局 / 单主机连接上限、DNS 缓存、keep-alive）；未传入时自建，每轮抓取结束后关闭
+        self.http = http or HttpPool.from_config(cfg)
+        self._owns_http = http is None
+        self.timeout = fetch_timeout(cfg)
+        conf = cfg.config
+        # 熔断：连续失败 FailureThreshold 次后跳过该源，按指数退避（秒）推迟下次尝试
+        self.failure_threshold = conf.getint('SYSTEM', 'FailureThreshold', fallback=3)
+        self.breaker_backoff = conf.getfloat('SYSTEM', 'BreakerBackoff', fallback=3600)
+        self.breaker_max_backoff = conf.getfloat('SYSTEM', 'BreakerMaxBackoff', fallback=86400)
+        # 自适应超时：单源总超时 = p95 耗时 × TimeoutFactor，限制在 [MinFetchTimeout, FetchTimeout] 之间
+        self.adaptive_timeout = conf.getboolean('SYSTEM', 'AdaptiveTimeout', fallback=True)
+        self.min_fetch_timeout = conf.getfloat('SYSTEM', 'MinFetchTimeout', fallback=5)
+        self.timeout_factor = conf.getfloat('SYSTEM', 'TimeoutFactor', fallback=3)
+        # 自适应轮询：按各源的发布间隔决定是否到期（小时），ForceRefresh 时抓取全部源
+        self.adaptive_polling = conf.getboolean('SYSTEM', 'AdaptivePolling', fallback=True)
+        self.poll_min = conf.getfloat('SYSTEM', 'PollMinHours', fallback=1) * 3600
+        self.poll_max = conf.getfloat('SYSTEM', 'PollMaxHours', fallback=24) * 3600
+        self.force_refresh = conf.getboolean('SYSTEM', 'ForceRefresh', fallback=False)
+        # 解析进程数，0 表示在当前进程内直接解析（调试用）
+        self.parse_workers = cfg.config.getint('SYSTEM', 'ParseWorkers', fallback=os.cpu_count() or 1)
+        self._parse_pool = None
+        # 送入 AI 的正文 token 预算，在段落边界截断
+        self.token_budget = cfg.config.getint('AI', 'ContentTokenBudget', fallback=DEFAULT_TOKEN_BUDGET)
+        # 启用近重复检测时由解析进程顺带计算 MinHash 签名
+        self.sig_perms = signature_perms(cfg)
+        self.history = open_history_store(cfg, db)
 
     def save_and_clean(self):
         """清理已处理且过期的条目，并保存历史记录"""
+        # 只有已处理且时间过期才清理
         cutoff = time.time() - (self.retention_days * 24 * 3600)
-        cleaned = {}
-        for h, info in self.history.items():
-            # 只有已处理且时间过期才清理
-            is_processed = info.get('processed', False)
-            ts = info.get('ts', 0)
-            if not is_processed or ts > cutoff:
-                cleaned[h] = info
-        
-        with open(self.db, 'w', encoding='utf-8') as f:
-            json.dump(cleaned, f, ensure_ascii=False, indent=2)
-        self.history = cleaned
+        self.history.prune(cutoff)
+        self.history.flush()
+        # 历史写入后再保存校验值，保证 304 跳过的内容一定已入库
+        self.feed_state.save()
 
-    async def fetch_all(self):
-        """获取源更新，并与历史记录中的待处理文章合并"""
-        urls = []
+    def _load_feeds(self):
+        """从 OPML（优先）或 feeds.txt 读取订阅源 [(url, priority 属性), ...]
+
+        priority 可写在订阅源 outline 上，也可写在分组 outline 上由其下的订阅源继承。
+        """
         if os.path.exists(self.opml):
-            from bs4 import BeautifulSoup
-            with open(self.opml, 'r', encoding='utf-8') as f:
-                soup = BeautifulSoup(f.read(), 'xml')
-                urls = [o.get('xmlUrl') for o in soup.find_all('outline') if o.get('xmlUrl')]
-            print(f"✅ Found {len(urls)} URLs in OPML")
-        elif os.path.exists(self.txt):
-            with open(self.txt, 'r', encoding='utf-8') as f:
-                urls = [l.strip() for l in f if l.strip() and not l.startswith("#")]
-        
-        # 1. 抓取 RSS 订阅源并存入历史（标记为未处理）
-        if urls:
-            async with aiohttp.ClientSession() as session:
-                tasks = [self._fetch_one(session, u) for u in urls]
-                feeds = await asyncio.gather(*tasks)
-                
-                now = time.time()
-                for feed in filter(None, feeds):
-                    source = feed.feed.get('title', 'Unknown Source')
-                    for entry in feed.entries:
-                        link = entry.get('link')
-                        if not link: continue
-                        
-                        u_hash = hashlib.md5(link.encode()).hexdigest()
-                        # 如果是全新文章，存入历史，带上正文，标记为未处理
-                        if u_hash not in self.history:
-                            content = entry.get('content', [{}])[0].get('value', entry.get('summary', ''))
-                            self.history[u_hash] = {
-                                "ts": now,
-                                "processed": False,
-                                "data": {
-                                    "title": entry.get('title', 'Untitled'),
-                                    "link": link,
-                                    "content": content,
-                                    "source": source,
-                                    "hash": u_hash
-                                }
-                            }
-
-        # 2. 从历史记录中提取所有待处理 (processed: False) 的文章
-        pending_data = []
-        for info in self.history.values():
-            if not info.get('processed', False) and 'data' in info:
-                pending_data.append(info)
-        
-        # 按时间从近到远排序 (ts 降序)
-        pending_data.sort(key=lambda x: x.get('ts', 0), reverse=True)
-        
-        return [item['data'] for item in pending_data]
+            feeds, parsed = load_cached(self.opml, parse_opml)
+            if parsed:
+                print(f"✅ Found {len(feeds)} URLs in OPML")
+            return feeds
+        if os.path.exists(self.txt):
+            return load_cached(self.txt, parse_feed_list)[0]
+        return []
+
+    def _load_urls(self):
+        return [url for url, _ in self._load_feeds()]
+
+    def _due_urls(self, urls, now=None):
+        """只保留已到下次抓取时间的源，请求量随实际更新频率而非运行次数增长"""
+        if self.force_refresh or not self.adaptive_polling:
+            return urls
+        now = now or time.time()
+        due = [u for u in urls if self.feed_state.is_poll_due(u, now, self.poll_min, self.poll_max)]
+        if len(due) < len(urls):
+            print(f"🗓️ {len(urls) - len(due)} 个订阅源尚未到下次抓取时间，本轮跳过。")
+        return due
+
+    def feed_priorities(self):
+        """订阅源优先级 {url: 权重}，供调度器使用"""
+        from src.scheduler import parse_priority
+        return {url: parse_priority(p) for url, p in self._load_feeds()}
+
+    def _store_entries(self, url, feed, now):
+        """将一个源中的全新文章存入历史（带正文，标记为未处理），返回这些文章"""
+        source = feed['title']
+        self.feed_state.learn_cadence(url, feed['entries'])
+        # 高水位线之前的已知条目直接跳过，只对候选条目做哈希去重
+        candidates = self.feed_state.advance_watermark(url, feed['entries'])
+        hashed = {hashlib.md5(e['link'].encode()).hexdigest(): e for e in candidates}
+        known = self.history.known(hashed)
+        records = [
+            (u_hash, now, {
+                "title": entry['title'],
+                "link": entry['link'],
+                "content": entry['content'],
+                "text": entry['text'],
+                "source": source,
+                "hash": u_hash,
+                # 调度用：所属订阅源、文章自身发布时间、首次入库时间
+                "feed": url,
+                "published": entry.get('ts'),
+                "seen": now
+            })
+            for u_hash, entry in hashed.items() if u_hash not in known
+        ]
+        self.history.add_pending(records)
+        # 解析进程算好的签名只随本轮文章传递，不写入历史
+        return [dict(data, _sig=hashed[data['hash']]['sig']) if 'sig' in hashed[data['hash']] else data
+                for _, _, data in records]
+
+    async def fetch_all(self):
+        """一次性获取源更新与往期待处理文章：stream 的非流式包装，抓取结束后一并返回"""
+        queue = asyncio.Queue()
+        await self.stream(queue)
+        articles = []
+        while (art := queue.get_nowait()) is not None:
+            articles.append(art)
+        return articles
+
+    async def stream(self, queue, accept=None):
+        """流式抓取：每个源一完成就把其中的新文章放入队列，随后补上往期遗留的待处理文章，最后放入结束标记 None
+
+        队列有界时 put 会等待消费者，形成背压；accept 为协程函数，返回 False 的文章只入库不入队（如近重复）。
+        """
+        emitted = set()
+
+        async def _emit(data):
+            emitted.add(data['hash'])
+            if accept is None or await accept(data):
+                await queue.put(data)
+
+        try:
+            # 已有 AI 结果的待处理文章（检查点）最先入队：不占 AI 调用，且在近重复检测中先成为代表文章，
+            # 其转载随后到达时并入它，而不是反过来把已付费的总结当作转载丢弃
+            for data in self.history.pending():
+                if has_result(data):
+                    await _emit(data)
+
+            urls = self._due_urls(self._load_urls())
+            if urls:
+                try:
+                    async with self.http.session(self.timeout) as session:
+                        async def _fetch_tagged(url):
+                            return url, await self._fetch_one(session, url)
+
+                        for fut in asyncio.as_completed([_fetch_tagged(u) for u in urls]):
+                            url, feed = await fut
+                            if feed:
+                                for data in self._store_entries(url, feed, time.time()):
+                                    await _emit(data)
+                finally:
+                    await self._release_http()
+
+            for data in self.history.pending():
+                if data['hash'] not in emitted:
+                    await _emit(data)
+        except Exception as e:
+            print(f"❌ 抓取流程异常: {e}")
+        await queue.put(None)
+
+    def checkpoint(self, art):
+        """AI 总结完成后立即原子写入历史，崩溃或中断后下次运行无需再次调用 AI"""
+        if art.get('hash'):
+            self.history.save_summary(art['hash'], {k: art[k] for k in SUMMARY_FIELDS if k in art})
 
     def mark_as_processed(self, articles):
-        """将文章标记为已处理，并清除正文以减小体积"""
-        now = time.time()
+        """将文章标记为已处理（包括合并到其中的近重复文章），并清除正文以减小体积"""
+        hashes = []
         for art in articles:
-            u_hash = art.get('hash')
-            if u_hash in self.history:
-                self.history[u_hash]['processed'] = True
-                self.history[u_hash]['ts'] = now
-                # 清除正文数据
-                if 'data' in self.history[u_hash]:
-                    del self.history[u_hash]['data']
+            hashes.extend(a['hash'] for a in [art, *art.get('related', [])] if a.get('hash'))
+        self.history.mark_processed(hashes, time.time())
 
     async def _fetch_one(self, session, url):
-        """带信号量限制的单源抓取"""
+        """单源抓取（条件请求，304 时跳过下载与解析）；并发由连接池的全局与单主机上限控制
+
+        每次抓取的耗时与成败记入订阅源健康统计：熔断中的源直接跳过，超时按该源的历史耗时自适应。
+        """
+        if not self.feed_state.is_due(url):
+            print(f"⏸️ 跳过熔断中的订阅源: {url}")
+            return None
         headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         }
-        async with self.semaphore:
-            try:
-                async with session.get(url, timeout=15, headers=headers, ssl=False) as res:
-                    if res.status == 200:
-                        return feedparser.parse(await res.text())
-                    else:
-                        print(f"⚠️ Fetch failed for {url}: Status {res.status}")
-            except Exception as e:
-                print(f"❌ Fetch error for {url}: {e}")
-            return None
\ No newline at end of file
+        headers.update(self.feed_state.conditional_headers(url))
+        # 连接只在网络下载期间占用，解析交给进程池，不占用连接名额
+        start = time.monotonic()
+        try:
+            async with session.get(url, headers=headers, timeout=self._timeout_for(url)) as res:
+                if res.status == 304:
+                    self.feed_state.record_success(url, time.monotonic() - start)
+                    return None
+                if res.status != 200:
+                    print(f"⚠️ Fetch failed for {url}: Status {res.status}")
+                    self._record_failure(url, f"HTTP {res.status}")
+                    return None
+                body = await res.read()
+                validators = res.headers
+        except Exception as e:
+            print(f"❌ Fetch error for {url}: {e!r}")
+            self._record_failure(url, repr(e))
+            return None
+        latency = time.monotonic() - start
+
+        try:
+            feed = await self._parse(body)
+        except Exception as e:
+            print(f"❌ Parse error for {url}: {e}")
+            self._record_failure(url, f"Parse error: {e}")
+            return None
+        self.feed_state.update_validators(url, validators)
+        self.feed_state.record_success(url, latency)
+        return feed
+
+    def _timeout_for(self, url):
+        """按该源的历史耗时收紧总超时；连接与读取超时不超过总超时"""
+        if not self.adaptive_timeout or not self.timeout.total:
+            return self.timeout
+        total = self.feed_state.adaptive_timeout(url, self.min_fetch_timeout, self.timeout.total, self.timeout_factor)
+        return aiohttp.ClientTimeout(
+            total=total,
+            sock_connect=min(self.timeout.sock_connect or total, total),
+            sock_read=min(self.timeout.sock_read or total, total),
+        )
+
+    def _record_failure(self, url, error):
+        failures = self.feed_state.record_failure(
+            url, error, threshold=self.failure_threshold,
+            backoff=self.breaker_backoff, max_backoff=self.breaker_max_backoff,
+        )
+        if self.failure_threshold and failures >= self.failure_threshold:
+            print(f"🔌 订阅源连续失败 {failures} 次，暂停抓取: {url}")
+
+    async def _release_http(self):
+        """自建的连接池在抓取结束后关闭；外部传入的共享连接池留给通知阶段继续使用"""
+        if self._owns_http:
+            await self.http.close()
+
+    async def _parse(self, body):
+        """将原始字节交给解析进程池，避免 CPU 密集的解析阻塞事件循环"""
+        if self.parse_workers <= 0:
+            return parse_feed(body, self.token_budget, self.sig_perms)
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._parse_pool, parse_feed, body, self.token_budget, self.sig_perms)
+
+    def close(self):
+        """关闭解析进程池与历史存储"""
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+        self.history.close()
\ No newline at end of file
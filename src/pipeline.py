@@ -0,0 +1,74 @@
+import asyncio
+
+
+async def _planned(rss, queue, accept, scheduler):
+    """预算不构成约束时文章随到随入队；候选总成本超出流式份额后，其余候选收集起来，抓取结束后由调度器按价值在剩余预算内挑选"""
+    # 往期积压在抓取结束后才入队，先登记其成本，预算紧张时从一开始就按价值规划
+    scheduler.expect(rss.history.pending())
+    arrived = asyncio.Queue()
+    fetch = asyncio.create_task(rss.stream(arrived, accept=accept))
+    held = []
+    try:
+        while (art := await arrived.get()) is not None:
+            if scheduler.admit(art):
+                await queue.put(art)
+            else:
+                held.append(art)
+        await fetch
+    except BaseException:
+        fetch.cancel()
+        raise
+    if held:
+        selected, deferred = scheduler.plan(held)
+        if deferred:
+            print(f"📋 配额有限：剩余预算内再处理价值最高的 {len(selected)} 篇，{len(deferred)} 篇留待下次。")
+        for art in selected:
+            await queue.put(art)
+    await queue.put(None)
+
+
+async def run_pipeline(rss, hub_factory, dedup=None, queue_size=20, scheduler=None):
+    """抓取 → 去重 → AI 总结的流式流水线，返回 (processed, quota_exceeded)
+
+    快速的订阅源一抓取完成，其文章即进入有界队列交给 AI worker，无需等待慢源；
+    队列满时抓取端等待（背压）。第一篇文章到达时才创建 IntelligenceHub，无新文章的运行不初始化 AI 客户端。
+    传入 scheduler 时在剩余配额内放行：预算不构成约束时照常流式处理，超出预算后其余候选按价值挑选。
+    """
+    queue = asyncio.Queue(maxsize=max(1, queue_size))
+    duplicates = []
+
+    async def accept(art):
+        if dedup is None:
+            return True
+        # 签名通常已在解析进程中算好，旧的待处理文章在线程中补算
+        await dedup.prepare(art)
+        verdict = dedup.check(art)
+        if verdict == 'skipped':
+            duplicates.append(art)
+        return verdict == 'unique'
+
+    if scheduler is None:
+        producer = asyncio.create_task(rss.stream(queue, accept=accept))
+    else:
+        producer = asyncio.create_task(_planned(rss, queue, accept, scheduler))
+    processed, quota_exceeded = [], False
+    hub = None
+    try:
+        first = await queue.get()
+        if first is not None:
+            hub = hub_factory()
+            # 每篇总结完成即写入检查点，中途崩溃不会丢失已付费的 AI 结果
+            hub.on_result = rss.checkpoint
+            processed, quota_exceeded = await hub.process_stream(queue, first=first)
+        await producer
+    except BaseException:
+        producer.cancel()
+        raise
+    finally:
+        if hub is not None:
+            await hub.close()
+
+    # 与往期文章重复的无需 AI 处理，直接标记完成
+    if duplicates:
+        rss.mark_as_processed(duplicates)
+    return processed, quota_exceeded
@@ -0,0 +1,182 @@
+import asyncio
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+# CJK 统一表意文字、假名、谚文及全角符号
+_CJK_RE = re.compile(r'[\u3000-\u30ff\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算 Gemini token 数：CJK 字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+try:
+    from zoneinfo import ZoneInfo
+    # Gemini 每日配额在太平洋时间午夜重置（含夏令时）
+    QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except (ImportError, LookupError):
+    # 系统缺少时区数据库（如未安装 tzdata 的 Windows）时按 UTC-8 近似
+    QUOTA_TZ = timezone(timedelta(hours=-8))
+
+
+def quota_day(now=None):
+    """Gemini 每日配额所属的日期（太平洋时间）"""
+    return datetime.fromtimestamp(time.time() if now is None else now, QUOTA_TZ).strftime('%Y-%m-%d')
+
+
+class UsageLedger:
+    """按配额日持久化的每日请求计数（SQLite quota_usage 表），使 RPD 限制跨运行、跨进程生效"""
+
+    # 只保留最近几天的计数
+    RETENTION_DAYS = 7
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS quota_usage (
+                day TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                used INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, endpoint)
+            )
+        """)
+        self.conn.execute("DELETE FROM quota_usage WHERE day < ?",
+                          (quota_day(time.time() - self.RETENTION_DAYS * 86400),))
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, cfg):
+        """[AI] UsageDB 为空时不持久化，每日计数只在当前进程内有效"""
+        path = cfg.config.get('AI', 'UsageDB', fallback='').strip()
+        if not path:
+            return None
+        return cls(path)
+
+    def used(self, day, endpoint):
+        row = self.conn.execute(
+            "SELECT used FROM quota_usage WHERE day = ? AND endpoint = ?", (day, endpoint)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add(self, day, endpoint, count=1):
+        self.conn.execute(
+            "INSERT INTO quota_usage (day, endpoint, used) VALUES (?, ?, ?) "
+            "ON CONFLICT(day, endpoint) DO UPDATE SET used = used + excluded.used",
+            (day, endpoint, count)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class QuotaExhausted(Exception):
+    """每日请求配额 (RPD) 已用尽"""
+
+
+class TokenBucket:
+    """经典令牌桶：容量 capacity，每 period 秒匀速补满"""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """距离可取出 amount 个令牌还需等待的秒数"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """共享的 Gemini 限流器：同时约束 RPM、TPM 与 RPD，0 表示不限制"""
+
+    def __init__(self, rpm=0, tpm=0, rpd=0, ledger=None, ledger_key=""):
+        self.rpm = TokenBucket(rpm, 60) if rpm > 0 else None
+        self.tpm = TokenBucket(tpm, 60) if tpm > 0 else None
+        self.rpd = rpd
+        # 传入 UsageLedger 时，每日计数按 ledger_key（端点标识）持久化
+        self.ledger = ledger
+        self.ledger_key = ledger_key
+        self.day = quota_day()
+        self.used_today = 0
+        self._sync_usage()
+        self._lock = asyncio.Lock()
+
+    def _sync_usage(self):
+        """从持久化计数读取当日已用次数（包含当日其他运行 / 进程的用量）"""
+        if self.ledger is not None:
+            self.used_today = self.ledger.used(self.day, self.ledger_key)
+
+    @property
+    def remaining_today(self):
+        """当日剩余请求数，未设置 RPD 时返回 None"""
+        if not self.rpd:
+            return None
+        if quota_day() != self.day:
+            return self.rpd
+        return max(0, self.rpd - self.used_today)
+
+    @classmethod
+    def from_config(cls, cfg, ledger=None, ledger_key=""):
+        conf = cfg.config
+        # 兼容旧配置：未设置 RPM 时由 RequestDelay 推算
+        delay = conf.getfloat('AI', 'RequestDelay', fallback=4)
+        default_rpm = int(60 / delay) if delay > 0 else 0
+        return cls(
+            rpm=conf.getint('AI', 'RPM', fallback=default_rpm),
+            tpm=conf.getint('AI', 'TPM', fallback=0),
+            rpd=conf.getint('AI', 'RPD', fallback=0),
+            ledger=ledger,
+            ledger_key=ledger_key,
+        )
+
+    def wait_time(self, tokens=0, now=None):
+        """不消耗配额，估算发出一次消耗约 tokens 的请求还需等待的秒数"""
+        now = time.monotonic() if now is None else now
+        return max(
+            self.rpm.wait_time(1, now) if self.rpm else 0.0,
+            self.tpm.wait_time(tokens, now) if self.tpm else 0.0,
+        )
+
+    async def acquire(self, tokens=0):
+        """等待直到预算允许发出一次消耗约 tokens 的请求；当日额度用尽时抛出 QuotaExhausted"""
+        # 持锁等待，保证等待者按先后顺序获得配额
+        async with self._lock:
+            while True:
+                # 常驻运行跨过配额日时重新计数
+                today = quota_day()
+                if today != self.day:
+                    self.day = today
+                    self.used_today = 0
+                self._sync_usage()
+                if self.rpd and self.used_today >= self.rpd:
+                    raise QuotaExhausted(f"RPD limit {self.rpd} reached")
+                wait = self.wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.rpm:
+                self.rpm.consume(1)
+            if self.tpm:
+                self.tpm.consume(tokens)
+            self.used_today += 1
+            if self.ledger is not None:
+                self.ledger.add(self.day, self.ledger_key)
@@ -0,0 +1,195 @@
+import html
+import re
+
+# Telegram 仅支持少量 HTML 标签：标题转粗体，段落/列表转换为纯文本换行，其余标签剥离
+_TG_HEADING_RE = re.compile(r'<h[1-6][^>]*>(.*?)</h[1-6]>', re.S)
+_TG_REPLACEMENTS = {'<p>': '', '</p>': '\n', '<ul>': '', '</ul>': '', '<li>': '• ', '</li>': '\n'}
+_TG_REPLACE_RE = re.compile('|'.join(map(re.escape, _TG_REPLACEMENTS)))
+_TG_STRIP_RE = re.compile(r'<(?!/?(b|strong|i|em|u|ins|s|strike|del|a|code|pre)\b)[^>]+>')
+
+# HTML -> Markdown（归档用）
+_MD_TABLE_RE = re.compile(r'<table[^>]*>.*?</table>', re.S)
+_MD_ROW_RE = re.compile(r'<tr[^>]*>(.*?)</tr>', re.S)
+_MD_CELL_RE = re.compile(r'<t[hd][^>]*>(.*?)</t[hd]>', re.S)
+_MD_TAG_RE = re.compile(r'<(/?)(h[1-6]|p|ul|ol|li|strong|b|em|i|code|br)\b[^>]*>')
+_MD_ANY_TAG_RE = re.compile(r'<[^>]+>')
+_MD_BLANK_RE = re.compile(r'\n{3,}')
+
+EMAIL_WARNING = (
+    "<div style='background-color: #fff3cd; color: #856404; border: 1px solid #ffeeba; padding: 15px; "
+    "margin-bottom: 20px; border-radius: 4px;'><strong>⚠️ 注意:</strong> {warning}</div>"
+)
+EMAIL_EMPTY = (
+    "<div style='text-align: center; padding: 50px 20px; color: #666;'>"
+    "<h2 style='color: #1a73e8;'>☕ 今日暂无新情报</h2>"
+    "<p>系统运行正常，所有订阅源均已同步，暂未发现符合条件的更新。</p></div>"
+)
+EMAIL_ITEM = (
+    "<div style='margin-bottom: 40px; border-left: 4px solid #1a73e8; padding-left: 15px;'>"
+    "<h2 style='margin-top: 0;'><a href='{link}' style='text-decoration: none; color: #1a73e8;'>{title}</a></h2>"
+    "<p style='font-size: 0.9em; color: #666;'>来源: {source}{related}</p>"
+    "<div style='line-height: 1.6;'>{html}</div></div>"
+)
+
+
+def prepare(articles):
+    """将文章一次性转换为渲染中间形式，各输出格式共用"""
+    return [
+        {
+            "title": art['title'],
+            "link": art['link'],
+            "source": art['source'],
+            "related": [(r['source'], r['link']) for r in art.get('related', [])],
+            "html": art.get('ai_html', ''),
+            # 结构化输出模式的字段，存在时直接渲染，无需解析 HTML
+            "data": art.get('ai_data'),
+        }
+        for art in articles
+    ]
+
+
+def data_to_email_html(data):
+    esc = html.escape
+    parts = ["<h2>1. 速览 (Summary)</h2><ul>"]
+    parts.extend(f"<li>{esc(point)}</li>" for point in data['summary'])
+    parts.append("</ul>")
+    if data['insights']:
+        parts.append("<h2>2. 深度 (Insights)</h2><table style='border-collapse: collapse;'>"
+                     "<tr><th align='left'>Key Insight (English)</th><th align='left'>核心观点 (Chinese)</th></tr>")
+        parts.extend(f"<tr><td>{esc(i['en'])}</td><td>{esc(i['zh'])}</td></tr>" for i in data['insights'])
+        parts.append("</table>")
+    return "".join(parts)
+
+
+def data_to_telegram(data):
+    esc = html.escape
+    parts = ["<b>1. 速览 (Summary)</b>\n"]
+    parts.extend(f"• {esc(point)}\n" for point in data['summary'])
+    if data['insights']:
+        parts.append("<b>2. 深度 (Insights)</b>\n")
+        parts.extend(f"• {esc(i['en'])}\n  {esc(i['zh'])}\n" for i in data['insights'])
+    return "".join(parts).strip()
+
+
+def data_to_markdown(data):
+    parts = ["### 1. 速览 (Summary)\n\n"]
+    parts.extend(f"- {point}\n" for point in data['summary'])
+    if data['insights']:
+        parts.append("\n### 2. 深度 (Insights)\n\n| Key Insight (English) | 核心观点 (Chinese) |\n| :--- | :--- |\n")
+        parts.extend(f"| {i['en']} | {i['zh']} |\n" for i in data['insights'])
+    return "".join(parts).strip()
+
+
+def html_to_telegram(fragment):
+    """AI 报告 HTML -> Telegram 支持的 HTML 子集"""
+    text = _TG_HEADING_RE.sub(r'<b>\1</b>', fragment)
+    text = _TG_REPLACE_RE.sub(lambda m: _TG_REPLACEMENTS[m.group(0)], text)
+    return _TG_STRIP_RE.sub('', text).strip()
+
+
+def _md_table(match):
+    rows = [[_md_inline(c) for c in _MD_CELL_RE.findall(row)]
+            for row in _MD_ROW_RE.findall(match.group(0))]
+    rows = [r for r in rows if r]
+    if not rows:
+        return ''
+    lines = ['| ' + ' | '.join(rows[0]) + ' |', '|' + ' :--- |' * len(rows[0])]
+    lines.extend('| ' + ' | '.join(r) + ' |' for r in rows[1:])
+    return '\n' + '\n'.join(lines) + '\n\n'
+
+
+def _md_inline(fragment):
+    text = _MD_TAG_RE.sub(_md_tag, fragment)
+    return html.unescape(_MD_ANY_TAG_RE.sub('', text)).replace('\n', ' ').strip()
+
+
+def _md_tag(match):
+    closing, tag = match.group(1), match.group(2)
+    if tag[0] == 'h':
+        return '\n' if closing else '\n' + '#' * (int(tag[1]) + 1) + ' '
+    if tag in ('strong', 'b'):
+        return '**'
+    if tag in ('em', 'i'):
+        return '*'
+    if tag == 'code':
+        return '`'
+    if tag == 'li':
+        return '' if closing else '- '
+    return '\n'
+
+
+def html_to_markdown(fragment):
+    """AI 报告 HTML -> Markdown；报告内的标题降一级以嵌套在文章标题之下"""
+    text = _MD_TABLE_RE.sub(_md_table, fragment)
+    text = _MD_TAG_RE.sub(_md_tag, text)
+    text = html.unescape(_MD_ANY_TAG_RE.sub('', text))
+    return _MD_BLANK_RE.sub('\n\n', text).strip()
+
+
+def render_email(items, warning=None):
+    """渲染邮件报告，返回 {"subject", "html"}"""
+    if not items:
+        subject = "RSS 智能情报局 - 今日暂无新情报"
+    else:
+        subject = f"RSS 智能情报局 - {len(items)} 篇新更新"
+
+    parts = ["<html><body style='font-family: Arial, sans-serif; color: #333; max-width: 800px; margin: 0 auto;'>"]
+    if warning:
+        parts.append(EMAIL_WARNING.format(warning=warning))
+    if not items:
+        parts.append(EMAIL_EMPTY)
+    else:
+        parts.append("<h1 style='color: #1a73e8; border-bottom: 2px solid #1a73e8; padding-bottom: 10px;'>今日情报摘要</h1>")
+        esc = html.escape
+        for item in items:
+            # 近重复合并的其他来源
+            related = "".join(f" · <a href='{esc(link)}' style='color: #666;'>{esc(name)}</a>"
+                              for name, link in item['related'])
+            parts.append(EMAIL_ITEM.format(
+                link=esc(item['link']), title=esc(item['title']), source=esc(item['source']), related=related,
+                html=data_to_email_html(item['data']) if item['data'] else item['html']
+            ))
+    parts.append("</body></html>")
+    return {"subject": subject, "html": "".join(parts)}
+
+
+def render_telegram(items, warning=None):
+    """渲染 Telegram 报告，返回文本段列表（由调用方按长度打包为消息）"""
+    if not items:
+        header = "☕ <b>RSS 智能情报局 - 今日暂无新情报</b>\n\n系统运行正常，暂未发现新文章。"
+        if warning:
+            header += f"\n\n⚠️ <b>注意: {warning}</b>"
+        return [header]
+
+    esc = html.escape
+    header = f"🚀 <b>RSS 智能情报局 - {len(items)} 篇新更新</b>\n"
+    if warning:
+        header += f"\n⚠️ <b>注意: {warning}</b>\n"
+    parts = [header + "\n"]
+    for item in items:
+        # 标题与来源是订阅源提供的纯文本，需转义后再嵌入 HTML
+        sources = " · ".join([esc(item['source'])] +
+                             [f"<a href='{esc(link)}'>{esc(name)}</a>" for name, link in item['related']])
+        parts.append(
+            f"<b><a href='{esc(item['link'])}'>{esc(item['title'])}</a></b>\n"
+            f"<i>来源: {sources}</i>\n"
+            f"{data_to_telegram(item['data']) if item['data'] else html_to_telegram(item['html'])}\n\n"
+        )
+    return parts
+
+
+def render_markdown(items, warning=None, date=None):
+    """渲染 Markdown 归档"""
+    parts = [f"# RSS 智能情报局 - {date}\n\n" if date else "# RSS 智能情报局\n\n"]
+    if warning:
+        parts.append(f"> ⚠️ 注意: {warning}\n\n")
+    if not items:
+        parts.append("☕ 今日暂无新情报。\n")
+    for item in items:
+        sources = " · ".join([item['source']] + [f"[{name}]({link})" for name, link in item['related']])
+        parts.append(
+            f"## [{item['title']}]({item['link']})\n\n"
+            f"来源: {sources}\n\n"
+            f"{data_to_markdown(item['data']) if item['data'] else html_to_markdown(item['html'])}\n\n"
+        )
+    return "".join(parts)
@@ -0,0 +1,167 @@
+import time
+from src.ai_hub import EXPECTED_OUTPUT_TOKENS, clean_text, has_result
+from src.rate_limit import estimate_tokens
+from src.model_pool import pool_size, remaining_requests
+
+# OPML 中 priority 属性的文字取值
+PRIORITY_WORDS = {"high": 2.0, "normal": 1.0, "low": 0.5}
+
+
+def parse_priority(value):
+    """OPML outline 的 priority 属性：数字或 high / normal / low，缺失或非法时为 1"""
+    if value is None:
+        return 1.0
+    value = str(value).strip().lower()
+    if value in PRIORITY_WORDS:
+        return PRIORITY_WORDS[value]
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return 1.0
+
+
+class Scheduler:
+    """配额感知的文章调度：按价值排序，并在剩余 RPD / token 预算内挑选价值最高的一组
+
+    价值 = 订阅源优先级 × (时效性 + 积压补偿)：
+    时效性按文章自身发布时间指数衰减；积压补偿随文章在待处理队列中等待的时间增长，避免旧文章永远排不上。
+    已知候选（往期积压）与已到达文章的总成本在预算的 (1 - reserve) 以内时，文章随到随放行（admit），保持流式处理；
+    一旦超出，说明预算将构成约束，此后的候选全部收集起来，连同预留的预算交给 plan 按价值挑选，
+    晚到的高价值文章不会因为低价值文章先到而被挤掉。max_requests / max_tokens 为 None 表示不限制。
+    """
+
+    def __init__(self, priorities=None, max_requests=None, max_tokens=None,
+                 half_life_hours=24, backlog_weight=0.5, backlog_horizon_hours=72, reserve=0.5):
+        self.priorities = priorities or {}
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.half_life = half_life_hours * 3600
+        self.backlog_weight = backlog_weight
+        self.backlog_horizon = backlog_horizon_hours * 3600
+        # 留给 plan 按价值分配的预算比例
+        self.reserve = min(1.0, max(0.0, reserve))
+        # 本轮已放行文章占用的预算
+        self.requests = 0
+        self.tokens = 0
+        # 本轮已知候选（已到达 + 预先登记的积压）的总成本；超出流式份额后进入受限状态
+        self.seen_requests = 0
+        self.seen_tokens = 0
+        self._expected = set()
+        self.binding = False
+
+    @classmethod
+    def from_config(cls, cfg, priorities=None, remaining=None):
+        """[AI] Scheduling 为 false 时返回 None（保持纯流式处理）
+
+        remaining 为模型池当日剩余请求数（常驻模式下由已创建的模型池给出），
+        缺省时按持久化的当日用量 ([AI] UsageDB) 估算。
+        """
+        conf = cfg.config
+        if not conf.getboolean('AI', 'Scheduling', fallback=True):
+            return None
+        if remaining is None:
+            remaining = remaining_requests(cfg)
+        # token 预算 = TPM × 单次运行时长上限 × 端点数；未设置运行时长时不限制 token 总量
+        minutes = conf.getfloat('AI', 'MaxRunMinutes', fallback=0)
+        tokens = int(conf.getint('AI', 'TPM', fallback=0) * minutes * pool_size(cfg))
+        return cls(
+            priorities,
+            max_requests=remaining,
+            max_tokens=tokens or None,
+            half_life_hours=conf.getfloat('AI', 'RecencyHalfLifeHours', fallback=24),
+            reserve=conf.getfloat('AI', 'PlanningReserve', fallback=0.5),
+        )
+
+    def cost(self, art):
+        """单篇文章预估消耗的 token 数"""
+        return estimate_tokens(clean_text(art)) + EXPECTED_OUTPUT_TOKENS
+
+    def score(self, art, now=None):
+        now = now or time.time()
+        priority = self.priorities.get(art.get('feed'), 1.0)
+        published = art.get('published') or art.get('seen') or now
+        recency = 0.5 ** (max(0.0, now - published) / self.half_life) if self.half_life > 0 else 1.0
+        waited = max(0.0, now - art.get('seen', now))
+        backlog = min(1.0, waited / self.backlog_horizon) if self.backlog_horizon > 0 else 0.0
+        return priority * (recency + self.backlog_weight * backlog)
+
+    def _fits(self, cost):
+        """在已占用的预算之上再加一篇成本为 cost 的文章是否仍在预算内"""
+        if self.max_requests is not None and self.requests + 1 > self.max_requests:
+            return False
+        return self.max_tokens is None or self.tokens + cost <= self.max_tokens
+
+    def _take(self, cost):
+        self.requests += 1
+        self.tokens += cost
+
+    def _within_stream_share(self):
+        """已知候选的总成本是否仍在可流式放行的预算份额 (1 - reserve) 以内"""
+        share = 1.0 - self.reserve
+        if self.max_requests is not None and self.seen_requests > self.max_requests * share:
+            return False
+        return self.max_tokens is None or self.seen_tokens <= self.max_tokens * share
+
+    def _see(self, art):
+        if not has_result(art):
+            self.seen_requests += 1
+            self.seen_tokens += self.cost(art)
+
+    def _is_expected(self, art):
+        return bool(art.get('hash')) and art['hash'] in self._expected
+
+    def expect(self, articles):
+        """预先登记本轮稍后才会到达的已知候选（往期积压），使其从一开始就计入预算判断"""
+        for art in articles:
+            if not self._is_expected(art):
+                self._expected.add(art.get('hash'))
+                self._see(art)
+        if not self._within_stream_share():
+            self.binding = True
+
+    def admit(self, art):
+        """流式阶段逐篇决定是否立即放行：预算不构成约束时占用预算并返回 True
+
+        已知候选总成本超出流式份额后进入受限状态，此后到达的文章都返回 False，
+        由调用方收集后交给 plan 在剩余预算（含预留部分）内按价值挑选。已有 AI 结果的文章不占预算，总是放行。
+        """
+        if has_result(art):
+            return True
+        if not self._is_expected(art):
+            self._see(art)
+        if self.binding or not self._within_stream_share():
+            self.binding = True
+            return False
+        cost = self.cost(art)
+        if not self._fits(cost):
+            self.binding = True
+            return False
+        self._take(cost)
+        return True
+
+    def plan(self, articles, now=None):
+        """返回 (本轮处理的文章, 推迟到下次的文章)，处理列表按价值从高到低排列
+
+        预算紧张时按“价值 / 占用预算比例”贪心挑选（多维背包的经典近似），已放行文章占用的预算先行扣除；
+        已有 AI 结果的文章（检查点、缓存）不占预算，总是入选。
+        """
+        now = now or time.time()
+        free = [a for a in articles if has_result(a)]
+        scored = [(self.score(a, now), self.cost(a), a) for a in articles if not has_result(a)]
+
+        def density(item):
+            value, tokens, _ = item
+            used = (1 / self.max_requests if self.max_requests else 0) + \
+                   (tokens / self.max_tokens if self.max_tokens else 0)
+            return value / used if used else value
+
+        selected, deferred = [], []
+        for item in sorted(scored, key=density, reverse=True):
+            value, cost, art = item
+            if not self._fits(cost):
+                deferred.append(art)
+                continue
+            selected.append(item)
+            self._take(cost)
+        selected.sort(key=lambda item: item[0], reverse=True)
+        return free + [art for _, _, art in selected], deferred
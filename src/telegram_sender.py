@@ -0,0 +1,132 @@
+import asyncio
+import time
+import aiohttp
+from src.rate_limit import TokenBucket
+
+# Telegram 单条消息上限：4096 个 UTF-16 码元（按实体解析后的文本计，这里保守地按含标签的原文计算）
+MAX_MESSAGE_LENGTH = 4096
+
+
+def utf16_len(text):
+    """Telegram 按 UTF-16 码元计算长度，emoji 等 BMP 以外字符计 2"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _hard_split(text, limit):
+    """按 UTF-16 长度硬切，不拆开代理对"""
+    chunks, current, size = [], [], 0
+    for ch in text:
+        width = 2 if ord(ch) > 0xFFFF else 1
+        if size + width > limit:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(ch)
+        size += width
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def split_message(parts, limit=MAX_MESSAGE_LENGTH):
+    """将若干段文本按 UTF-16 长度贪心打包成消息；单段超长时先按行切分，仍超长再硬切"""
+    pieces = []
+    for part in parts:
+        if utf16_len(part) <= limit:
+            pieces.append(part)
+            continue
+        for line in part.splitlines(keepends=True):
+            pieces.extend([line] if utf16_len(line) <= limit else _hard_split(line, limit))
+
+    messages, current, size = [], [], 0
+    for piece in pieces:
+        width = utf16_len(piece)
+        if current and size + width > limit:
+            messages.append("".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += width
+    if current:
+        messages.append("".join(current))
+    return messages
+
+
+class TelegramSendError(Exception):
+    """消息未能送达（不可重试的错误或重试次数用尽）"""
+
+
+class TelegramPermanentError(TelegramSendError):
+    """429 以外的 4xx（消息格式错误、chat 不存在等）：同一条消息以后重试也不会成功"""
+
+
+class TelegramSender:
+    """Telegram 投递引擎：遵守全局与单聊天限速，429 时按 retry_after 等待后重试
+
+    Telegram 限制约为全局 30 条/秒、同一聊天 1 条/秒（群组 20 条/分钟）。
+    同一聊天内按顺序发送，不同聊天共享一个连接池并发发送。
+    """
+
+    def __init__(self, token, global_rate=30, chat_interval=1.0, max_retries=3):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.global_bucket = TokenBucket(global_rate, 1.0) if global_rate > 0 else None
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._lock = asyncio.Lock()
+
+    async def _throttle(self, chat_id):
+        """先按单聊天限速等待（不阻塞其他聊天），再取全局令牌"""
+        if self.chat_interval > 0:
+            bucket = self._chat_buckets.setdefault(chat_id, TokenBucket(1, self.chat_interval))
+            await self._take(bucket)
+        if self.global_bucket:
+            async with self._lock:
+                await self._take(self.global_bucket)
+
+    @staticmethod
+    async def _take(bucket):
+        while True:
+            wait = bucket.wait_time(1, time.monotonic())
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        bucket.consume(1)
+
+    async def send(self, session, chat_id, text):
+        """发送一条消息，确认送达后返回；失败时抛出 TelegramSendError"""
+        payload = {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True
+        }
+        error = "Telegram 限流重试次数用尽"
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(chat_id)
+            try:
+                async with session.post(self.url, json=payload) as resp:
+                    if resp.status == 200:
+                        return
+                    if resp.status == 429:
+                        retry_after = await self._retry_after(resp)
+                        print(f"⏳ Telegram 限流，{retry_after} 秒后重试 (chat {chat_id})")
+                        await asyncio.sleep(retry_after)
+                        error = "Telegram 限流重试次数用尽"
+                        continue
+                    err_text = await resp.text()
+                    if resp.status < 500:
+                        # 4xx（格式错误、chat 不存在等）重试无益
+                        raise TelegramPermanentError(f"Telegram 发送失败 ({resp.status}): {err_text}")
+                    error = f"Telegram 服务端错误 ({resp.status}): {err_text}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"Telegram 网络异常: {e!r}"
+            if attempt < self.max_retries:
+                await asyncio.sleep(2 ** attempt)
+        raise TelegramSendError(error)
+
+    @staticmethod
+    async def _retry_after(resp):
+        try:
+            data = await resp.json(content_type=None)
+            return float(data.get('parameters', {}).get('retry_after', 1))
+        except Exception:
+            return 1.0
@@ -9,6 +9,7 @@ class MockConfig:
         self.config.add_section('SYSTEM')
         self.config.set('SYSTEM', 'RetentionDays', '30')
         self.config.set('SYSTEM', 'MaxConcurrency', '10')
+        self.config.set('SYSTEM', 'ParseWorkers', '0')
         
         self.config.add_section('AI')
         self.config.set('AI', 'ModelName', 'gemini-1.5-flash')
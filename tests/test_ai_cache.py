@@ -0,0 +1,46 @@
+import pytest
+import time
+from src.ai_cache import ResultCache, cache_key
+
+@pytest.fixture
+def cache(tmp_path):
+    c = ResultCache(str(tmp_path / "ai_cache.db"), max_entries=2, max_age_days=1)
+    yield c
+    c.conn.close()
+
+def test_cache_key_depends_on_text_model_and_version():
+    base = cache_key("text", "model-a", "1")
+    assert base == cache_key("text", "model-a", "1")
+    assert base != cache_key("text2", "model-a", "1")
+    assert base != cache_key("text", "model-b", "1")
+    assert base != cache_key("text", "model-a", "2")
+
+def test_get_put_roundtrip(cache):
+    assert cache.get("k") is None
+    cache.put("k", {"ai_html": "<p>中文</p>"})
+    assert cache.get("k") == {"ai_html": "<p>中文</p>"}
+
+def test_expired_entries_are_misses_and_evicted(cache):
+    cache.put("old", {"ai_html": "x"})
+    cache.conn.execute("UPDATE ai_cache SET created = ?", (time.time() - 2 * 24 * 3600,))
+    assert cache.get("old") is None
+    cache.evict()
+    assert len(cache) == 0
+
+def test_evict_keeps_most_recently_used(cache):
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, {"ai_html": key})
+        cache.conn.execute("UPDATE ai_cache SET last_used = ? WHERE key = ?", (1000 + i, key))
+    cache.conn.execute("UPDATE ai_cache SET last_used = 5000 WHERE key = 'a'")
+    cache.evict()
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+def test_from_config(mock_config, tmp_path):
+    assert ResultCache.from_config(mock_config) is None
+    mock_config.config.set('AI', 'CacheDB', str(tmp_path / "c.db"))
+    mock_config.config.set('AI', 'CacheMaxEntries', '10')
+    c = ResultCache.from_config(mock_config)
+    assert c.max_entries == 10
+    c.close()
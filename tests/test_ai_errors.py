@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from src.ai_errors import (
+    classify, retry_delay, backoff_delay, RequestAborted, THROTTLED, EXHAUSTED, TRANSIENT, ABORTED, FATAL,
+)
+from src.rate_limit import QuotaExhausted
+
+PER_MINUTE = ("429 RESOURCE_EXHAUSTED. {'error': {'details': [{'violations': [{'quotaId': "
+              "'GenerateRequestsPerMinutePerProjectPerModel-FreeTier'}]}, "
+              "{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '34s'}]}}")
+PER_DAY = "429 RESOURCE_EXHAUSTED. {'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}"
+
+class FakeAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+def test_classify_quota_errors():
+    assert classify(Exception(PER_MINUTE)) == THROTTLED
+    assert classify(Exception("429 Too Many Requests")) == THROTTLED
+    assert classify(Exception(PER_DAY)) == EXHAUSTED
+    assert classify(QuotaExhausted("RPD limit 1 reached")) == EXHAUSTED
+
+def test_classify_transient_and_fatal():
+    assert classify(Exception("503 UNAVAILABLE. The model is overloaded.")) == TRANSIENT
+    assert classify(FakeAPIError(500, "Internal error")) == TRANSIENT
+    assert classify(asyncio.TimeoutError()) == TRANSIENT
+    assert classify(ConnectionResetError()) == TRANSIENT
+    assert classify(RequestAborted()) == ABORTED
+    assert classify(Exception("400 INVALID_ARGUMENT")) == FATAL
+    assert classify(ValueError("结构化响应缺少字段")) == FATAL
+
+def test_retry_delay_from_server():
+    assert retry_delay(Exception(PER_MINUTE)) == 34
+    assert retry_delay(Exception("503 UNAVAILABLE")) is None
+
+def test_backoff_delay():
+    with patch('random.uniform', side_effect=lambda lo, hi: hi):
+        assert backoff_delay(0, base=2, cap=60) == 2
+        assert backoff_delay(3, base=2, cap=60) == 16
+        # 指数退避有上限
+        assert backoff_delay(10, base=2, cap=60) == 60
+        # 服务端给出等待时间时照办，只加少量抖动
+        assert backoff_delay(5, base=2, cap=60, server_delay=34) == 35
+    assert 0 <= backoff_delay(2, base=2, cap=60) <= 8
@@ -1,6 +1,6 @@
 import pytest
 import asyncio
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from src.ai_hub import IntelligenceHub
 
 @pytest.fixture
@@ -11,12 +11,12 @@ def mock_genai_client():
 @pytest.mark.asyncio
 async def test_process_articles_success(mock_config, mock_genai_client):
     hub = IntelligenceHub(mock_config)
-    hub.client = MagicMock()
+    client = hub.pool.primary.client
     
     mock_response = MagicMock()
     mock_response.text = "## Summary\n* Sentence 1\n* Sentence 2\n* Sentence 3"
     
-    hub.client.models.generate_content.return_value = mock_response
+    client.models.generate_content.return_value = mock_response
     
     articles = [
         {
@@ -39,8 +39,8 @@ async def test_process_articles_success(mock_config, mock_genai_client):
         with patch('markdown.markdown') as mock_md:
             mock_md.return_value = "<html>Summary</html>"
             
-            # Reduce delay for testing
-            hub.delay = 0
+            # 测试线程池回退路径
+            hub.use_async = False
             
             results, quota_exceeded = await hub.process_articles(articles)
             
@@ -51,8 +51,8 @@ async def test_process_articles_success(mock_config, mock_genai_client):
 @pytest.mark.asyncio
 async def test_process_articles_failure(mock_config, mock_genai_client):
     hub = IntelligenceHub(mock_config)
-    hub.client = MagicMock()
-    hub.client.models.generate_content.side_effect = Exception("API Error")
+    client = hub.pool.primary.client
+    client.models.generate_content.side_effect = Exception("API Error")
     hub.delay = 0
     
     articles = [{"title": "Fail", "content": "Content"}]
@@ -64,8 +64,8 @@ async def test_process_articles_failure(mock_config, mock_genai_client):
 @pytest.mark.asyncio
 async def test_process_articles_quota_exceeded(mock_config, mock_genai_client):
     hub = IntelligenceHub(mock_config)
-    hub.client = MagicMock()
-    hub.delay = 0
+    client = hub.pool.primary.client
+    hub.use_async = False
     
     articles = [{"title": "Art 1", "content": "Content 1"}, {"title": "Art 2", "content": "Content 2"}]
     
@@ -82,7 +82,7 @@ async def test_process_articles_quota_exceeded(mock_config, mock_genai_client):
             if mock_run_gen.call_count == 0:
                 mock_run_gen.call_count += 1
                 return mock_response
-            raise Exception("429 RESOURCE_EXHAUSTED")
+            raise Exception("429 RESOURCE_EXHAUSTED. {'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}")
         
         mock_run_gen.call_count = 0
         mock_l.run_in_executor = mock_run_gen
@@ -94,3 +94,342 @@ async def test_process_articles_quota_exceeded(mock_config, mock_genai_client):
             
             assert len(results) == 1
             assert quota_exceeded is True
+
+@pytest.mark.asyncio
+async def test_process_articles_daily_limit(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'RPD', '1')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    hub.use_async = False
+    mock_response = MagicMock()
+    mock_response.text = "Summary"
+    client.models.generate_content.return_value = mock_response
+
+    articles = [{"title": "Art 1", "content": "Content 1"}, {"title": "Art 2", "content": "Content 2"}]
+    results, quota_exceeded = await hub.process_articles(articles)
+
+    # 本地 RPD 预算只允许一次请求，第二篇不会再调用 API
+    assert len(results) == 1
+    assert quota_exceeded is True
+    assert client.models.generate_content.call_count == 1
+
+@pytest.mark.asyncio
+async def test_process_articles_native_async(mock_config, mock_genai_client):
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Summary"
+    client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+    client.aio.aclose = AsyncMock()
+
+    articles = [{"title": "T", "content": "<p>C</p>", "link": "l", "source": "s"}]
+    results, quota_exceeded = await hub.process_articles(articles)
+
+    assert len(results) == 1
+    assert "Summary" in results[0]['ai_html']
+    client.aio.models.generate_content.assert_awaited_once()
+    # 原生异步路径不应占用线程池
+    client.models.generate_content.assert_not_called()
+
+    await hub.close()
+    client.aio.aclose.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_quota_exceeded_cancels_inflight_requests(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'Concurrency', '3')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    cancelled = []
+
+    async def fake_generate(model, contents):
+        if "Quota" in contents:
+            await asyncio.sleep(0.01)
+            raise Exception("429 RESOURCE_EXHAUSTED. {'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(contents)
+            raise
+
+    client.aio.models.generate_content = fake_generate
+    articles = [
+        {"title": "Slow 1", "content": "a"},
+        {"title": "Quota", "content": "b"},
+        {"title": "Slow 2", "content": "c"},
+    ]
+    results, quota_exceeded = await asyncio.wait_for(hub.process_articles(articles), timeout=2)
+
+    assert results == []
+    assert quota_exceeded is True
+    assert len(cancelled) == 2
+
+def test_take_batch_packs_ready_short_articles(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'BatchTokenBudget', '1000')
+    mock_config.config.set('AI', 'BatchMaxArticles', '3')
+    hub = IntelligenceHub(mock_config)
+    short = [{"title": f"S{i}", "content": "x" * 400} for i in range(5)]
+    long = {"title": "L", "content": "y" * 4000}
+
+    queue = asyncio.Queue()
+    for art in short[1:4] + [long, short[4], None]:
+        queue.put_nowait(art)
+    carry = []
+    # 短文按篇数上限打包
+    unit = hub._take_batch(short[0], queue, carry, [])
+    assert [a['title'] for a in unit] == ["S0", "S1", "S2"]
+    assert carry == []
+    # 放不下的长文留给下一轮，单独成组
+    unit = hub._take_batch(queue.get_nowait(), queue, carry, [])
+    assert [a['title'] for a in unit] == ["S3"]
+    assert carry == [long]
+    assert hub._take_batch(carry.pop(), queue, carry, []) == [long]
+
+def test_split_reports():
+    text = (
+        "===REPORT 2===\n## 1. 速览\n- b\n"
+        "===REPORT 1===\n## 1. 速览\n- a\n"
+        "===REPORT 3===\nno heading here\n"
+        "===REPORT 9===\n## out of range\n"
+    )
+    sections = IntelligenceHub._split_reports(text, 3)
+    assert set(sections) == {1, 2}
+    assert "- a" in sections[1]
+    assert "- b" in sections[2]
+
+@pytest.mark.asyncio
+async def test_batch_mode_requeues_missing_reports(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'BatchTokenBudget', '4000')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    calls = []
+
+    async def fake_generate(model, contents):
+        calls.append(contents)
+        response = MagicMock()
+        if "===ARTICLE" in contents:
+            # 第二篇的报告缺失，需要单独重试
+            response.text = "===REPORT 1===\n## 1. 速览\n- batch one\n"
+        else:
+            response.text = "## 1. 速览\n- single"
+        return response
+
+    client.aio.models.generate_content = fake_generate
+    articles = [
+        {"title": "A1", "content": "short one", "link": "l1", "source": "s"},
+        {"title": "A2", "content": "short two", "link": "l2", "source": "s"},
+    ]
+    results, quota_exceeded = await hub.process_articles(articles)
+
+    assert len(calls) == 2
+    assert "A1" in calls[0] and "A2" in calls[0]
+    assert "A2" in calls[1] and "A1" not in calls[1]
+    by_title = {a['title']: a['ai_html'] for a in results}
+    assert "batch one" in by_title["A1"]
+    assert "single" in by_title["A2"]
+    assert quota_exceeded is False
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_api_and_limiter(mock_config, mock_genai_client, tmp_path):
+    mock_config.config.set('AI', 'CacheDB', str(tmp_path / "ai_cache.db"))
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Cached summary"
+    client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+
+    # 同一正文以不同链接出现两次
+    await hub.process_articles([{"title": "A", "content": "<p>same</p>", "link": "l1"}])
+    limiter = hub.pool.primary.limiter = MagicMock()
+    results, _ = await hub.process_articles([{"title": "A", "content": "<p>same</p>", "link": "l2"}])
+
+    assert client.aio.models.generate_content.await_count == 1
+    limiter.acquire.assert_not_called()
+    assert "Cached summary" in results[0]['ai_html']
+    hub.cache.close()
+
+@pytest.mark.asyncio
+async def test_cache_is_keyed_on_the_model_that_answered(mock_config, mock_genai_client, tmp_path):
+    from src.ai_cache import cache_key
+    from src.ai_hub import PROMPT_VERSION, clean_text
+    mock_config.config.set('AI', 'ModelName', 'model-a, model-b')
+    mock_config.config.set('AI', 'CacheDB', str(tmp_path / "ai_cache.db"))
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Fallback summary"
+
+    async def fake_generate(model, contents):
+        if model == "model-a":
+            raise Exception("429 RESOURCE_EXHAUSTED. {'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}")
+        return mock_response
+
+    client.aio.models.generate_content = AsyncMock(side_effect=fake_generate)
+    art = {"title": "A", "content": "<p>same</p>", "link": "l1"}
+    await hub.process_articles([art])
+
+    # 备用模型生成的结果记在备用模型名下
+    text = clean_text(art)
+    assert hub.cache.get(cache_key(text, "model-b", PROMPT_VERSION)) is not None
+    assert hub.cache.get(cache_key(text, "model-a", PROMPT_VERSION)) is None
+
+    # 首选模型恢复后，同一正文仍命中备用模型的缓存结果
+    client.aio.models.generate_content.reset_mock()
+    hub.pool.endpoints[0].exhausted = False
+    results, _ = await hub.process_articles([{"title": "A", "content": "<p>same</p>", "link": "l2"}])
+    client.aio.models.generate_content.assert_not_awaited()
+    assert "Fallback summary" in results[0]['ai_html']
+    hub.cache.close()
+
+@pytest.mark.asyncio
+async def test_structured_output_mode(mock_config, mock_genai_client, tmp_path):
+    mock_config.config.set('AI', 'StructuredOutput', 'true')
+    mock_config.config.set('AI', 'CacheDB', str(tmp_path / "ai_cache.db"))
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = '{"summary": ["要点一", "要点二"], "insights": [{"en": "Fast", "zh": "快"}]}'
+    client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+
+    results, _ = await hub.process_articles([{"title": "A", "content": "<p>body</p>", "link": "l"}])
+
+    _, kwargs = client.aio.models.generate_content.call_args
+    assert kwargs['config']['response_mime_type'] == "application/json"
+    # 结构化模式不再发送 Markdown 格式模板
+    assert "## 1." not in kwargs['contents']
+    assert results[0]['ai_data'] == {"summary": ["要点一", "要点二"], "insights": [{"en": "Fast", "zh": "快"}]}
+    assert 'ai_html' not in results[0]
+
+    # 缓存按模式区分，结构化结果可直接复用
+    results, _ = await hub.process_articles([{"title": "A", "content": "<p>body</p>", "link": "l2"}])
+    assert client.aio.models.generate_content.await_count == 1
+    assert results[0]['ai_data']['insights'][0]['zh'] == "快"
+    hub.cache.close()
+
+@pytest.mark.asyncio
+async def test_structured_output_invalid_response(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'StructuredOutput', 'true')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = '{"summary": "not a list"}'
+    client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+
+    results, quota_exceeded = await hub.process_articles([{"title": "A", "content": "x", "link": "l"}])
+    assert results == []
+    assert quota_exceeded is False
+
+def test_split_structured():
+    text = ('[{"index": 2, "summary": ["b"], "insights": []},'
+            ' {"index": 1, "summary": [], "insights": []},'
+            ' {"index": 9, "summary": ["x"], "insights": []}]')
+    sections = IntelligenceHub._split_structured(text, 2)
+    assert set(sections) == {2}
+    assert IntelligenceHub._split_structured("not json", 2) == {}
+
+@pytest.mark.asyncio
+async def test_model_pool_fails_over_to_next_model(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'ModelName', 'model-a, model-b')
+    mock_config.config.set('AI', 'Concurrency', '1')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Summary"
+    calls = []
+
+    async def fake_generate(model, contents):
+        calls.append(model)
+        if model == "model-a":
+            raise Exception("429 RESOURCE_EXHAUSTED. {'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}")
+        return mock_response
+
+    client.aio.models.generate_content = fake_generate
+    articles = [{"title": "Art 1", "content": "a"}, {"title": "Art 2", "content": "b"}]
+    results, quota_exceeded = await hub.process_articles(articles)
+
+    # 首选模型被限额后该端点不再使用，两篇都由备用模型完成
+    assert len(results) == 2
+    assert quota_exceeded is False
+    assert calls.count("model-a") == 1
+    assert calls.count("model-b") == 2
+
+@pytest.mark.asyncio
+async def test_model_pool_daily_limit_per_endpoint(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'ModelName', 'model-a, model-b')
+    mock_config.config.set('AI', 'RPD', '1')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Summary"
+    client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+
+    articles = [{"title": f"Art {i}", "content": str(i)} for i in range(3)]
+    results, quota_exceeded = await hub.process_articles(articles)
+
+    # 每个端点各自的 RPD 额度用完后才整体停止
+    assert len(results) == 2
+    assert quota_exceeded is True
+    models = [c.kwargs['model'] for c in client.aio.models.generate_content.call_args_list]
+    assert models == ["model-a", "model-b"]
+
+@pytest.mark.asyncio
+async def test_throttle_spike_is_retried_not_fatal(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'Concurrency', '1')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Summary"
+    client.aio.models.generate_content = AsyncMock(side_effect=[
+        Exception("429 RESOURCE_EXHAUSTED. {'retryDelay': '0s'}"),
+        Exception("503 UNAVAILABLE"),
+        mock_response,
+        mock_response,
+    ])
+    hub.retry_base = 0.01
+
+    articles = [{"title": "Art 1", "content": "a"}, {"title": "Art 2", "content": "b"}]
+    results, quota_exceeded = await asyncio.wait_for(hub.process_articles(articles), timeout=2)
+
+    # 每分钟限流与 5xx 均在退避后重试，不会提前结束本轮
+    assert len(results) == 2
+    assert quota_exceeded is False
+    assert client.aio.models.generate_content.await_count == 4
+
+@pytest.mark.asyncio
+async def test_retries_capped_per_article(mock_config, mock_genai_client):
+    mock_config.config.set('AI', 'Concurrency', '1')
+    mock_config.config.set('AI', 'MaxRetries', '2')
+    mock_config.config.set('AI', 'RetryBaseDelay', '0.01')
+    hub = IntelligenceHub(mock_config)
+    client = hub.pool.primary.client
+    mock_response = MagicMock()
+    mock_response.text = "## Summary"
+
+    async def fake_generate(model, contents):
+        if "Flaky" in contents:
+            raise Exception("503 UNAVAILABLE")
+        return mock_response
+
+    client.aio.models.generate_content = AsyncMock(side_effect=fake_generate)
+    articles = [{"title": "Flaky", "content": "a"}, {"title": "Fine", "content": "b"}]
+    results, quota_exceeded = await asyncio.wait_for(hub.process_articles(articles), timeout=2)
+
+    # 达到重试上限的文章被放弃（留待下次运行），其余文章照常处理
+    assert [r['title'] for r in results] == ["Fine"]
+    assert quota_exceeded is False
+    assert client.aio.models.generate_content.await_count == 3 + 1
+
+@pytest.mark.asyncio
+async def test_shared_pool_survives_hub_close(mock_config, mock_genai_client):
+    from src.ai_hub import create_pool
+    pool = create_pool(mock_config)
+    client = MagicMock()
+    client.aio.aclose = AsyncMock()
+    pool.primary.client = client
+
+    hub = IntelligenceHub(mock_config, pool=pool)
+    await hub.close()
+    # 常驻模式下模型池跨轮复用，由调用方在退出时关闭
+    client.aio.aclose.assert_not_awaited()
+    assert IntelligenceHub(mock_config, pool=pool).pool is pool
+    await pool.aclose()
+    client.aio.aclose.assert_awaited_once()
@@ -0,0 +1,92 @@
+import pytest
+from unittest.mock import patch
+from src.dedup import MinHasher, NearDuplicateIndex
+
+BASE = (
+    "Apple announced today that the new developer tools will ship with support for on-device "
+    "language models, letting third party apps call the same private foundation model that powers "
+    "system features. The company says the framework is free to use and works offline, and that "
+    "developers can adapt it with lightweight adapters for their own tasks."
+)
+
+def make_art(h, text, title=None, source="Src"):
+    return {"hash": h, "title": title or h, "link": f"http://ex.com/{h}", "source": source,
+            "content": f"<p>{text}</p>"}
+
+@pytest.fixture
+def index(tmp_path):
+    idx = NearDuplicateIndex(str(tmp_path / "dedup.db"), threshold=0.5)
+    yield idx
+    idx.conn.close()
+
+def test_signature_similarity():
+    hasher = MinHasher()
+    a = hasher.signature(BASE)
+    b = hasher.signature(BASE + " Quoted by another blog with a short comment.")
+    c = hasher.signature("A completely different post about bread baking, sourdough starters, "
+                         "hydration ratios and oven temperatures for a crisp crust at home every time.")
+    assert MinHasher.similarity(a, b) > 0.7
+    assert MinHasher.similarity(a, c) < 0.2
+    # 过短的正文不参与比较
+    assert hasher.signature("too short") is None
+
+def verdicts(index, articles):
+    return [index.check(a) for a in articles]
+
+def test_check_within_run(index):
+    original = make_art("h1", BASE, source="Daring Fireball")
+    repost = make_art("h2", BASE + " Via a link blog.", source="Simon Willison")
+    other = make_art("h3", "Sourdough bread baking guide with hydration ratios, starter feeding "
+                           "schedules, shaping techniques and oven temperatures for a crisp crust.")
+    assert verdicts(index, [original, repost, other]) == ['unique', 'related', 'unique']
+    assert original['related'] == [{"title": "h2", "link": "http://ex.com/h2",
+                                    "source": "Simon Willison", "hash": "h2"}]
+
+def test_check_across_runs(index, tmp_path):
+    first = make_art("h1", BASE)
+    assert index.check(first) == 'unique'
+    index.add([first])
+    index.conn.close()
+
+    # 重新打开索引：新链接下的转载应识别为往期重复
+    reopened = NearDuplicateIndex(str(tmp_path / "dedup.db"), threshold=0.5)
+    # 仍待处理的自身（同一哈希）不算重复
+    assert reopened.check(make_art("h1", BASE)) == 'unique'
+    reopened.reset()
+    assert reopened.check(make_art("h9", BASE + " Reposted.")) == 'skipped'
+    index.conn = reopened.conn
+
+def test_checkpointed_article_is_never_merged_away(index):
+    # 上一轮已总结的代表文章（related 中记录了转载）与尚未标记完成的转载一起恢复
+    summarised = dict(make_art("r", BASE), ai_html="<p>paid</p>",
+                      related=[{"title": "d", "link": "http://ex.com/d", "source": "Src", "hash": "d"}])
+    repost = make_art("d", BASE + " Via a link blog.")
+    assert verdicts(index, [summarised, repost]) == ['unique', 'related']
+    # 转载不会重复追加
+    assert [r['hash'] for r in summarised['related']] == ["d"]
+
+    # 转载先到时，已有总结的文章也不会被当作转载丢弃
+    index.reset()
+    summarised['related'] = []
+    assert verdicts(index, [make_art("d", BASE + " Via a link blog."), summarised]) == ['unique', 'unique']
+
+@pytest.mark.asyncio
+async def test_precomputed_signature_is_used(index):
+    from src.dedup import signature
+    fresh = dict(make_art("h1", BASE), _sig=signature(BASE))
+    legacy = make_art("h2", BASE + " Via a link blog.")
+    await index.prepare(fresh)
+    # 旧的待处理文章在线程中补算签名
+    await index.prepare(legacy)
+    assert legacy['_sig'] is not None
+    with patch.object(index.hasher, 'signature', side_effect=AssertionError("不应在事件循环中计算")):
+        assert index.check(fresh) == 'unique'
+        assert index.check(legacy) == 'related'
+
+def test_from_config(mock_config, tmp_path):
+    assert NearDuplicateIndex.from_config(mock_config) is None
+    mock_config.config.add_section('DEDUP')
+    mock_config.config.set('DEDUP', 'IndexDB', str(tmp_path / "d.db"))
+    idx = NearDuplicateIndex.from_config(mock_config)
+    assert idx.threshold == 0.7
+    idx.close()
@@ -0,0 +1,33 @@
+import pytest
+from src.extract import extract_text, paragraphs
+from src.rate_limit import estimate_tokens
+
+def test_noise_is_removed_and_blocks_split():
+    html = ("<nav>Home | About</nav><h1>Title</h1><p>Hello <b>world</b></p>"
+            "<script>var x = 1;</script><figure><img src='a.png'/><figcaption>Caption</figcaption></figure>"
+            "<!-- comment --><ul><li>one</li><li>two</li></ul><footer>© 2024</footer>")
+    assert paragraphs(html) == ["Title", "Hello world", "one", "two"]
+
+def test_text_around_blocks_is_split():
+    # 块级元素前后的裸文字各自成段，不与块内容粘连
+    assert paragraphs("<p>a</p>tail<p>b</p>") == ["a", "tail", "b"]
+    assert paragraphs("foo<div>bar</div>baz") == ["foo", "bar", "baz"]
+    assert paragraphs("line one<br>line two") == ["line one", "line two"]
+    assert paragraphs("<p>Hello <b>world</b></p>") == ["Hello world"]
+
+def test_plain_text_and_empty_content():
+    assert paragraphs("just text") == ["just text"]
+    assert extract_text("") == ""
+
+def test_truncates_at_paragraph_boundary():
+    paras = [f"<p>{'word ' * 40}{i}</p>" for i in range(10)]
+    text = extract_text("".join(paras), token_budget=120)
+    lines = text.split("\n")
+    # 每段约 51 token，只保留完整的前两段
+    assert len(lines) == 2
+    assert lines[-1].endswith("1")
+
+def test_cjk_budget_counts_characters():
+    text = extract_text("<p>" + "中" * 500 + "</p><p>后文</p>", token_budget=100)
+    assert estimate_tokens(text) <= 100
+    assert "后文" not in text
@@ -0,0 +1,163 @@
+import pytest
+import os
+import json
+import time
+from src.history import JsonHistoryStore, SQLiteHistoryStore, migrate_json_history, open_history_store
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        s = JsonHistoryStore(str(tmp_path / "history.json"))
+    else:
+        s = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    yield s
+    s.close()
+
+def test_add_pending_and_known(store):
+    store.add_pending([("h1", 1000, {"title": "A", "hash": "h1"})])
+    # 已存在的哈希不会被覆盖
+    store.add_pending([("h1", 3000, {"title": "Changed", "hash": "h1"}), ("h2", 2000, {"title": "B", "hash": "h2"})])
+    assert store.known(["h1", "h2", "h3"]) == {"h1", "h2"}
+    assert "h1" in store
+    assert [d["title"] for d in store.pending()] == ["B", "A"]
+
+def test_mark_processed_and_prune(store):
+    now = time.time()
+    old = now - 10 * 24 * 3600
+    store.add_pending([
+        ("new", now, {"hash": "new"}),
+        ("old", old, {"hash": "old"}),
+        ("pending_old", old, {"hash": "pending_old"}),
+    ])
+    store.mark_processed(["new"], now)
+    store.mark_processed(["old"], old)
+    assert "data" not in store.get("new")
+    assert store.pending() == [{"hash": "pending_old"}]
+
+    store.prune(now - 7 * 24 * 3600)
+    assert store.known(["new", "old", "pending_old"]) == {"new", "pending_old"}
+
+def test_save_summary_checkpoint(store):
+    store.add_pending([("h1", 1000, {"title": "A", "hash": "h1"})])
+    store.save_summary("h1", {"ai_html": "<p>S</p>"})
+    assert store.pending() == [{"title": "A", "hash": "h1", "ai_html": "<p>S</p>"}]
+    # 投递完成后检查点随正文一起清除
+    store.mark_processed(["h1"], 2000)
+    assert store.pending() == []
+    assert "summary" not in store.get("h1")
+
+def test_sqlite_upgrades_v1_schema(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE history (hash TEXT PRIMARY KEY, ts REAL NOT NULL, "
+                 "processed INTEGER NOT NULL DEFAULT 0, data TEXT)")
+    conn.execute("INSERT INTO history VALUES ('h1', 1000, 0, '{\"hash\": \"h1\"}')")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    s = SQLiteHistoryStore(path)
+    assert s.conn.execute("PRAGMA user_version").fetchone()[0] == SQLiteHistoryStore.SCHEMA_VERSION
+    s.save_summary("h1", {"ai_html": "x"})
+    assert s.pending() == [{"hash": "h1", "ai_html": "x"}]
+    s.close()
+
+def test_json_store_migrates_v1_format(tmp_path):
+    path = str(tmp_path / "history.json")
+    data = {
+        "legacy_h1": 1000.5,
+        "modern_h2": {"ts": 2000.5, "processed": False, "data": {"title": "X"}}
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+    store = JsonHistoryStore(path)
+    assert store.get("legacy_h1") == {"ts": 1000.5, "processed": True}
+    assert store.get("modern_h2")["processed"] is False
+
+def test_json_store_corrupt_file(tmp_path):
+    path = tmp_path / "history.json"
+    path.write_text("{not json")
+    assert JsonHistoryStore(str(path)).records == {}
+
+def test_sqlite_schema_has_index(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    plan = store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT data FROM history WHERE processed = 0 ORDER BY ts DESC"
+    ).fetchall()
+    assert any("idx_history_processed_ts" in row[-1] for row in plan)
+    store.close()
+
+def test_sqlite_persists_between_connections(tmp_path):
+    path = str(tmp_path / "history.db")
+    store = SQLiteHistoryStore(path)
+    store.add_pending([("h1", 1000, {"title": "中文", "hash": "h1"})])
+    store.close()
+
+    reopened = SQLiteHistoryStore(path)
+    assert reopened.pending() == [{"title": "中文", "hash": "h1"}]
+    reopened.close()
+
+def test_migrate_json_history(tmp_path):
+    json_path = str(tmp_path / "history.json")
+    with open(json_path, 'w') as f:
+        json.dump({
+            "legacy_h1": 1000.5,
+            "modern_h2": {"ts": 2000.5, "processed": False, "data": {"title": "X", "hash": "modern_h2"}},
+            "modern_h3": {"ts": 3000.5, "processed": True},
+        }, f)
+
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"), legacy_json=json_path)
+    assert store.get("legacy_h1") == {"ts": 1000.5, "processed": True}
+    assert store.get("modern_h3") == {"ts": 3000.5, "processed": True}
+    assert store.pending() == [{"title": "X", "hash": "modern_h2"}]
+    # 原文件被重命名，迁移只进行一次
+    assert not os.path.exists(json_path)
+    assert os.path.exists(json_path + ".migrated")
+    assert migrate_json_history(json_path + ".migrated", store) == 0
+    store.close()
+
+def test_open_history_store_backend(mock_config, tmp_path):
+    store = open_history_store(mock_config, str(tmp_path / "history.db"))
+    assert isinstance(store, SQLiteHistoryStore)
+    store.close()
+
+    mock_config.config.set('SYSTEM', 'HistoryBackend', 'json')
+    store = open_history_store(mock_config, str(tmp_path / "history.json"))
+    assert isinstance(store, JsonHistoryStore)
+
+    mock_config.config.set('SYSTEM', 'HistoryBackend', 'redis')
+    with pytest.raises(ValueError):
+        open_history_store(mock_config)
+
+def test_open_history_store_migrates_only_default_store(mock_config, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("history.json", 'w') as f:
+        json.dump({"legacy_h1": 1000.5}, f)
+
+    # 调试库等非默认路径不迁移生产 history.json
+    debug = open_history_store(mock_config, "debug_history.db")
+    assert debug.get("legacy_h1") is None
+    debug.close()
+    assert os.path.exists("history.json")
+
+    store = open_history_store(mock_config)
+    assert store.get("legacy_h1") == {"ts": 1000.5, "processed": True}
+    store.close()
+    assert os.path.exists("history.json.migrated")
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_mark_processed_unknown_hash_consistent(tmp_path, backend):
+    if backend == "json":
+        store = JsonHistoryStore(str(tmp_path / "history.json"))
+    else:
+        store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.mark_processed(["unseen"], 1000)
+    assert store.get("unseen") == {"ts": 1000, "processed": True}
+    store.close()
+
+def test_history_store_is_abstract():
+    from src.history import HistoryStore
+    with pytest.raises(TypeError):
+        HistoryStore()
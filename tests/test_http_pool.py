@@ -0,0 +1,33 @@
+import pytest
+from src.http_pool import HttpPool, fetch_timeout
+
+def test_from_config(mock_config):
+    mock_config.config.set('SYSTEM', 'MaxPerHost', '3')
+    mock_config.config.set('SYSTEM', 'DnsCacheTTL', '600')
+    pool = HttpPool.from_config(mock_config)
+    assert (pool.limit, pool.limit_per_host, pool.dns_ttl) == (10, 3, 600)
+
+    mock_config.config.set('SYSTEM', 'ConnectTimeout', '3')
+    timeout = fetch_timeout(mock_config)
+    assert (timeout.sock_connect, timeout.sock_read, timeout.total) == (3, 15, 30)
+
+@pytest.mark.asyncio
+async def test_sessions_share_connector():
+    pool = HttpPool(limit=5, limit_per_host=2, dns_ttl=120)
+    connector = pool.connector
+    assert connector.limit == 5
+    assert connector.limit_per_host == 2
+    assert connector.use_dns_cache
+
+    # 会话关闭不影响连接器，后续阶段继续复用
+    async with pool.session() as session:
+        assert session.connector is connector
+    assert not connector.closed
+    async with pool.session() as session:
+        assert session.connector is connector
+
+    await pool.close()
+    assert connector.closed
+    # 关闭后再次使用时重建
+    assert pool.connector is not connector
+    await pool.close()
@@ -0,0 +1,68 @@
+import pytest
+import asyncio
+import signal
+from unittest.mock import MagicMock, patch
+import main
+
+@pytest.fixture
+def daemon_env(mock_config):
+    """驱动 daemon()：配置、订阅源管理器与信号注册均替换为可观察的测试替身"""
+    mock_config.config.set('SYSTEM', 'DaemonIntervalMinutes', '0.0005')
+    mock_config.config.set('SYSTEM', 'ShutdownGrace', '0.2')
+    rss = MagicMock(force_refresh=False)
+    handlers = {}
+
+    def register(sig, callback):
+        handlers[sig] = callback
+
+    with patch('main.load_config', return_value=mock_config), \
+         patch('main.RSSManager', return_value=rss):
+        yield rss, handlers, register
+
+async def run_daemon(handlers, register, cycle, **kwargs):
+    loop = asyncio.get_running_loop()
+    with patch.object(loop, 'add_signal_handler', side_effect=register), \
+         patch('main.run_cycle', side_effect=cycle):
+        await asyncio.wait_for(main.daemon(**kwargs), timeout=2)
+
+@pytest.mark.asyncio
+async def test_daemon_finishes_cycle_and_saves_on_sigterm(daemon_env):
+    rss, handlers, register = daemon_env
+    refresh, finished = [], []
+
+    async def cycle(cfg, rss, hub_factory, **kwargs):
+        refresh.append(rss.force_refresh)
+        if len(refresh) == 3:
+            # 本轮进行中收到 SIGTERM：在宽限期内完成本轮后退出，不再开始新的一轮
+            handlers[signal.SIGTERM]()
+            await asyncio.sleep(0.05)
+        finished.append(len(refresh))
+        return [], False
+
+    await run_daemon(handlers, register, cycle, force_refresh=True)
+
+    # --force-refresh 只作用于第一轮
+    assert refresh == [True, False, False]
+    assert finished == [1, 2, 3]
+    rss.save_and_clean.assert_called_once()
+    rss.close.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_daemon_cancels_cycle_after_grace(daemon_env):
+    rss, handlers, register = daemon_env
+    cancelled = asyncio.Event()
+
+    async def cycle(cfg, rss, hub_factory, **kwargs):
+        handlers[signal.SIGINT]()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    await run_daemon(handlers, register, cycle)
+
+    # 超过 ShutdownGrace 的一轮被取消，历史仍然写回
+    assert cancelled.is_set()
+    rss.save_and_clean.assert_called_once()
+    rss.close.assert_called_once()
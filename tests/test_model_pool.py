@@ -0,0 +1,86 @@
+import pytest
+from unittest.mock import MagicMock
+from src.model_pool import ModelPool, Endpoint, endpoint_id
+from src.rate_limit import RateLimiter
+
+def test_from_config_builds_key_model_grid(mock_config):
+    mock_config.GEMINI_KEY = "key1, key2"
+    mock_config.config.set('AI', 'ModelName', 'model-a, model-b')
+    factory = MagicMock(side_effect=lambda api_key: f"client-{api_key}")
+    pool = ModelPool.from_config(mock_config, factory)
+
+    assert [(e.model_name, e.client) for e in pool.endpoints] == [
+        ("model-a", "client-key1"), ("model-a", "client-key2"),
+        ("model-b", "client-key1"), ("model-b", "client-key2"),
+    ]
+    # 同一 Key 的客户端只创建一次，每个端点有独立的限流器
+    assert factory.call_count == 2
+    assert len({id(e.limiter) for e in pool.endpoints}) == 4
+    assert pool.clients() == ["client-key1", "client-key2"]
+
+def test_pick_prefers_least_loaded_endpoint():
+    busy = Endpoint("c1", "model-a", RateLimiter(rpm=1))
+    idle = Endpoint("c2", "model-a", RateLimiter(rpm=1))
+    busy.limiter.rpm.consume(1)
+    pool = ModelPool([busy, idle])
+    assert pool.pick() is idle
+
+    # 等待时间相同时选择进行中请求更少的端点
+    a, b = Endpoint("c1", "model-a", RateLimiter()), Endpoint("c2", "model-a", RateLimiter())
+    a.inflight = 2
+    assert ModelPool([a, b]).pick() is b
+
+def test_pick_falls_back_to_next_model_in_order():
+    primary = Endpoint("c1", "model-a", RateLimiter())
+    fallback = Endpoint("c1", "model-b", RateLimiter())
+    pool = ModelPool([primary, fallback])
+    # 首选模型即使更忙也优先使用
+    primary.inflight = 5
+    assert pool.pick() is primary
+
+    pool.mark_exhausted(primary)
+    assert pool.pick() is fallback
+    assert not pool.exhausted
+    pool.mark_exhausted(fallback)
+    assert pool.pick() is None
+    assert pool.exhausted
+
+def test_empty_pool_rejected():
+    with pytest.raises(ValueError):
+        ModelPool([])
+
+def test_exhausted_endpoints_recover_on_new_day():
+    from unittest.mock import patch
+    endpoint = Endpoint("c1", "model-a", RateLimiter())
+    pool = ModelPool([endpoint])
+    pool.mark_exhausted(endpoint)
+    assert pool.exhausted
+    with patch('src.model_pool.quota_day', return_value="2099-01-01"):
+        assert pool.pick() is endpoint
+    assert not endpoint.exhausted
+
+def test_usage_persisted_per_endpoint(mock_config, tmp_path):
+    mock_config.config.set('AI', 'RPD', '10')
+    mock_config.config.set('AI', 'UsageDB', str(tmp_path / "history.db"))
+    pool = ModelPool.from_config(mock_config, MagicMock())
+    primary = pool.primary
+    pool.ledger.add(primary.limiter.day, endpoint_id("gemini-1.5-flash", "test_key"), 4)
+    pool.ledger.close()
+
+    # 新进程中的模型池读取当日已用次数，剩余预算随之减少
+    pool = ModelPool.from_config(mock_config, MagicMock())
+    assert pool.primary.limiter.used_today == 4
+    assert pool.remaining_requests() == 6
+    # 持久化的端点标识中不含明文 Key
+    assert "test_key" not in pool.primary.limiter.ledger_key
+    pool.ledger.close()
+
+def test_remaining_requests_unlimited_without_rpd():
+    pool = ModelPool([Endpoint("c1", "model-a", RateLimiter())])
+    assert pool.remaining_requests() is None
+    pool = ModelPool([Endpoint("c1", "model-a", RateLimiter(rpd=5)),
+                      Endpoint("c2", "model-a", RateLimiter(rpd=5))])
+    pool.endpoints[0].limiter.used_today = 2
+    assert pool.remaining_requests() == 8
+    pool.mark_exhausted(pool.endpoints[1])
+    assert pool.remaining_requests() == 3
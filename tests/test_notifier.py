@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import MagicMock, patch, AsyncMock
 from src.notifier import EmailNotifier, TelegramNotifier, send_all_reports
+from src import renderer
 
 def test_email_notifier_success(mock_config):
     notifier = EmailNotifier(mock_config)
@@ -61,13 +62,17 @@ async def test_send_all_reports(mock_config):
     processed_articles = [{"title": "Art", "link": "link", "source": "src", "ai_html": "html"}]
     warning = "test warning"
     
-    with patch('src.notifier.EmailNotifier.send_report') as mock_email, \
-         patch('src.notifier.TelegramNotifier.send_report', new_callable=AsyncMock) as mock_tg:
+    with patch('src.notifier.EmailNotifier.send_items') as mock_email, \
+         patch('src.notifier.TelegramNotifier.send_items', new_callable=AsyncMock) as mock_tg, \
+         patch('src.renderer.prepare', wraps=renderer.prepare) as mock_prepare:
         
         await send_all_reports(mock_config, processed_articles, warning=warning)
         
-        mock_email.assert_called_once_with(processed_articles, warning=warning)
-        mock_tg.assert_called_once_with(processed_articles, warning=warning)
+        # 文章只转换一次，归档与各渠道共用
+        mock_prepare.assert_called_once_with(processed_articles)
+        items = renderer.prepare(processed_articles)
+        mock_email.assert_called_once_with(items, warning=warning)
+        mock_tg.assert_called_once_with(items, warning=warning)
 
 def test_email_notifier_standby(mock_config):
     notifier = EmailNotifier(mock_config)
@@ -105,3 +110,45 @@ async def test_telegram_notifier_standby(mock_config):
         
         args, kwargs = mock_post.call_args
         assert "今日暂无新情报" in kwargs['json']['text']
+
+def test_email_reuses_one_connection(mock_config):
+    notifier = EmailNotifier(mock_config)
+    payloads = [notifier.render([]), notifier.render([], warning="w")]
+    with patch('smtplib.SMTP_SSL') as mock_smtp_ssl:
+        mock_instance = MagicMock()
+        mock_instance.__enter__.return_value = mock_instance
+        mock_smtp_ssl.return_value = mock_instance
+        mock_instance.sendmail.side_effect = [None, Exception("421 closed")]
+
+        sent, error = notifier.deliver_many(payloads)
+
+    mock_smtp_ssl.assert_called_once()
+    mock_instance.login.assert_called_once()
+    assert sent == 1
+    assert "421" in str(error)
+
+@pytest.mark.asyncio
+async def test_channels_are_sent_concurrently(mock_config):
+    import asyncio
+    import threading
+    import time
+    email_started = threading.Event()
+    tg_saw_email_running = []
+
+    def slow_email(self, articles, warning=None):
+        email_started.set()
+        time.sleep(0.3)
+
+    async def fake_tg(self, articles, warning=None):
+        await asyncio.sleep(0.05)
+        tg_saw_email_running.append(email_started.is_set())
+
+    with patch('src.notifier.EmailNotifier.send_items', slow_email), \
+         patch('src.notifier.TelegramNotifier.send_items', fake_tg):
+        start = time.monotonic()
+        await send_all_reports(mock_config, [])
+        elapsed = time.monotonic() - start
+
+    # 邮件在线程中阻塞期间 Telegram 仍在事件循环中推进
+    assert tg_saw_email_running == [True]
+    assert elapsed < 0.5
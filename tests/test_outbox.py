@@ -0,0 +1,94 @@
+import pytest
+import time
+from unittest.mock import MagicMock, AsyncMock, patch
+from src.outbox import Outbox
+from src.notifier import enqueue_reports, flush_outbox
+from src.telegram_sender import TelegramSendError, TelegramPermanentError
+
+ARTICLES = [{"title": "Art 1", "link": "http://ex.com/1", "source": "Src 1", "ai_html": "<p>Sum 1</p>"}]
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"), max_attempts=2)
+    yield box
+    box.conn.close()
+
+def test_enqueue_and_deliver(outbox):
+    outbox.enqueue("telegram", [{"text": "a"}, {"text": "b"}])
+    items = outbox.pending("telegram")
+    assert [p["text"] for _, p in items] == ["a", "b"]
+    outbox.mark_delivered(items[0][0])
+    assert [p["text"] for _, p in outbox.pending("telegram")] == ["b"]
+    assert outbox.pending("email") == []
+
+def test_gives_up_after_max_attempts(outbox):
+    outbox.enqueue("email", [{"subject": "s", "html": "h"}])
+    item_id = outbox.pending("email")[0][0]
+    outbox.mark_failed(item_id, "down")
+    assert outbox.count_pending() == 1
+    outbox.mark_failed(item_id, "down")
+    assert outbox.count_pending() == 0
+
+def test_prune_keeps_undelivered(outbox):
+    outbox.enqueue("telegram", [{"text": "a"}, {"text": "b"}])
+    first = outbox.pending("telegram")[0][0]
+    outbox.mark_delivered(first)
+    outbox.conn.execute("UPDATE outbox SET created = ?", (time.time() - 30 * 24 * 3600,))
+    outbox.prune()
+    assert [p["text"] for _, p in outbox.pending("telegram")] == ["b"]
+
+@pytest.mark.asyncio
+async def test_failed_delivery_is_retried_later(mock_config, outbox):
+    enqueue_reports(mock_config, outbox, ARTICLES)
+    assert outbox.count_pending() == 2
+
+    with patch('src.notifier.EmailNotifier.deliver_many', return_value=(0, Exception("SMTP down"))), \
+         patch('src.telegram_sender.TelegramSender.send', new_callable=AsyncMock) as mock_tg:
+        sent, failed = await flush_outbox(mock_config, outbox)
+    assert (sent, failed) == (1, 1)
+    mock_tg.assert_awaited_once()
+    assert [c for c in ("email", "telegram") if outbox.pending(c)] == ["email"]
+
+    # 下次运行（或 --flush-outbox）重试，报告内容无需重新生成
+    with patch('src.notifier.EmailNotifier.deliver_many', return_value=(1, None)) as mock_email:
+        sent, failed = await flush_outbox(mock_config, outbox)
+    assert (sent, failed) == (1, 0)
+    assert "Art 1" in mock_email.call_args[0][0][0]["html"]
+    assert outbox.count_pending() == 0
+
+@pytest.mark.asyncio
+async def test_telegram_rows_are_per_chat(mock_config, outbox):
+    mock_config.TELEGRAM_CHAT_ID = "111, 222"
+    mock_config.SENDER = ""
+    enqueue_reports(mock_config, outbox, ARTICLES)
+    assert sorted(p["chat_id"] for _, p in outbox.pending("telegram")) == ["111", "222"]
+
+    async def fake_send(self, session, chat_id, text):
+        if chat_id == "222":
+            raise TelegramSendError("400 chat not found")
+
+    with patch('src.telegram_sender.TelegramSender.send', fake_send):
+        sent, failed = await flush_outbox(mock_config, outbox)
+    # 仅失败的聊天保留待重试，不会向已送达的聊天重复发送
+    assert (sent, failed) == (1, 1)
+    assert [p["chat_id"] for _, p in outbox.pending("telegram")] == ["222"]
+
+@pytest.mark.asyncio
+async def test_permanent_telegram_error_does_not_block_chat(mock_config, outbox):
+    mock_config.SENDER = ""
+    outbox.enqueue("telegram", [{"chat_id": "111", "text": t} for t in ("bad", "next")])
+    delivered = []
+
+    async def fake_send(self, session, chat_id, text):
+        if text == "bad":
+            raise TelegramPermanentError("Telegram 发送失败 (400): can't parse entities")
+        delivered.append(text)
+
+    with patch('src.telegram_sender.TelegramSender.send', fake_send):
+        sent, failed = await flush_outbox(mock_config, outbox)
+    # 不可重试的消息立即放弃，同一聊天后续的消息照常投递
+    assert (sent, failed) == (1, 1)
+    assert delivered == ["next"]
+    assert outbox.count_pending() == 0
+    row = outbox.conn.execute("SELECT attempts, last_error FROM outbox WHERE delivered IS NULL").fetchone()
+    assert row[0] >= outbox.max_attempts and "400" in row[1]
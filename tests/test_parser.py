@@ -1,104 +1,120 @@
 import pytest
-import os
-import json
+import hashlib
 import time
 from unittest.mock import AsyncMock, patch, MagicMock
-from src.parser import RSSManager
+from src.parser import RSSManager, parse_feed
 
 @pytest.fixture
-def temp_db(tmp_path):
-    db_path = tmp_path / "test_history.json"
-    return str(db_path)
-
-def test_load_history_empty(mock_config, temp_db):
-    rss = RSSManager(mock_config, db=temp_db)
-    assert rss.history == {}
-
-def test_load_history_migration(mock_config, temp_db):
-    data = {
-        "legacy_h1": 1000.5,
-        "modern_h2": {"ts": 2000.5, "processed": False, "data": {"title": "X"}}
-    }
-    with open(temp_db, 'w') as f:
-        json.dump(data, f)
-        
-    rss = RSSManager(mock_config, db=temp_db)
-    # legacy_h1 should be upgraded
-    assert isinstance(rss.history["legacy_h1"], dict)
-    assert rss.history["legacy_h1"]["ts"] == 1000.5
-    assert rss.history["legacy_h1"]["processed"] is True
-    # modern_h2 should be untouched
-    assert rss.history["modern_h2"]["processed"] is False
-
-def test_load_history_existing(mock_config, temp_db):
-    data = {"hash1": {"ts": time.time(), "processed": True}}
-    with open(temp_db, 'w') as f:
-        json.dump(data, f)
-    
-    rss = RSSManager(mock_config, db=temp_db)
-    assert rss.history == data
+def make_rss(mock_config, tmp_path):
+    """在临时目录中创建 RSSManager，避免测试写入工作目录"""
+    created = []
+
+    def _make(**kwargs):
+        kwargs.setdefault('db', str(tmp_path / "test_history.db"))
+        kwargs.setdefault('state', str(tmp_path / "feed_state.json"))
+        rss = RSSManager(mock_config, **kwargs)
+        created.append(rss)
+        return rss
 
-def test_save_and_clean(mock_config, temp_db):
+    yield _make
+    for rss in created:
+        rss.close()
+
+def test_save_and_clean(make_rss):
     now = time.time()
     old = now - (10 * 24 * 3600)  # 10 days ago (Retention is 7)
-    
-    data = {
-        "processed_new": {"ts": now, "processed": True},
-        "processed_old": {"ts": old, "processed": True},
-        "pending_old": {"ts": old, "processed": False, "data": {"title": "X"}}
-    }
-    
-    with open(temp_db, 'w') as f:
-        json.dump(data, f)
-        
-    rss = RSSManager(mock_config, db=temp_db)
+
+    rss = make_rss()
+    rss.history.add_pending([
+        ("processed_new", now, {"title": "A", "hash": "processed_new"}),
+        ("processed_old", old, {"title": "B", "hash": "processed_old"}),
+        ("pending_old", old, {"title": "X", "hash": "pending_old"}),
+    ])
+    rss.history.mark_processed(["processed_new"], now)
+    rss.history.mark_processed(["processed_old"], old)
     rss.retention_days = 7
     rss.save_and_clean()
-    
-    with open(temp_db, 'r') as f:
-        saved = json.load(f)
-    
+
     # processed_new should stay
-    assert "processed_new" in saved
+    assert "processed_new" in rss.history
     # processed_old should be cleaned (processed AND old)
-    assert "processed_old" not in saved
+    assert "processed_old" not in rss.history
     # pending_old should stay (not processed)
-    assert "pending_old" in saved
+    assert "pending_old" in rss.history
+
+SAMPLE_RSS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>Test Feed</title>
+<item><title>Post 1</title><link>http://example.com/1</link><description>Body 1</description></item>
+<item><title>No Link</title><description>Skipped</description></item>
+</channel></rss>"""
 
 @pytest.mark.asyncio
-async def test_fetch_one_success(mock_config):
-    rss = RSSManager(mock_config)
+async def test_fetch_one_success(make_rss):
+    rss = make_rss()
     mock_session = MagicMock()
     mock_response = AsyncMock()
     mock_response.status = 200
-    mock_response.text.return_value = "<rss><channel><title>Test</title></channel></rss>"
+    mock_response.headers = {}
+    mock_response.read.return_value = SAMPLE_RSS
     
     mock_session.get.return_value.__aenter__.return_value = mock_response
     
+    result = await rss._fetch_one(mock_session, "http://example.com")
+    assert result["title"] == "Test Feed"
+    assert result["entries"] == [
+        {"title": "Post 1", "link": "http://example.com/1", "content": "Body 1",
+         "text": "Body 1", "id": "http://example.com/1", "ts": None}
+    ]
+
+@pytest.mark.asyncio
+async def test_fetch_one_parse_in_process_pool(mock_config, make_rss):
+    mock_config.config.set('SYSTEM', 'ParseWorkers', '1')
+    rss = make_rss()
+    mock_session = MagicMock()
+    mock_response = AsyncMock()
+    mock_response.status = 200
+    mock_response.headers = {}
+    mock_response.read.return_value = SAMPLE_RSS
+    mock_session.get.return_value.__aenter__.return_value = mock_response
+
+    result = await rss._fetch_one(mock_session, "http://example.com")
+    assert rss._parse_pool is not None
+    assert result["entries"][0]["link"] == "http://example.com/1"
+
+@pytest.mark.asyncio
+async def test_fetch_one_conditional_get(make_rss):
+    rss = make_rss()
+    mock_session = MagicMock()
+    mock_response = AsyncMock()
+    mock_response.status = 200
+    mock_response.headers = {"ETag": '"abc"', "Last-Modified": "Wed, 04 Feb 2026 10:00:00 GMT"}
+    mock_response.read.return_value = SAMPLE_RSS
+    mock_session.get.return_value.__aenter__.return_value = mock_response
+
+    await rss._fetch_one(mock_session, "http://example.com/feed")
+    rss.feed_state.save()
+
+    # 重新加载后，第二次请求应带上校验值；304 时不解析
+    rss2 = make_rss()
+    mock_response.status = 304
     with patch('feedparser.parse') as mock_parse:
-        mock_parse.return_value = MagicMock()
-        result = await rss._fetch_one(mock_session, "http://example.com")
-        assert result is not None
-        mock_parse.assert_called_once()
+        result = await rss2._fetch_one(mock_session, "http://example.com/feed")
+        assert result is None
+        mock_parse.assert_not_called()
+
+    _, kwargs = mock_session.get.call_args
+    assert kwargs['headers']['If-None-Match'] == '"abc"'
+    assert kwargs['headers']['If-Modified-Since'] == "Wed, 04 Feb 2026 10:00:00 GMT"
 
 @pytest.mark.asyncio
-async def test_fetch_all_with_pending(mock_config, tmp_path):
-    db = tmp_path / "test.json"
-    rss = RSSManager(mock_config, db=str(db))
+async def test_fetch_all_with_pending(make_rss):
+    rss = make_rss()
     
     # 1. Setup history with two pending items
-    rss.history = {
-        "h1": {
-            "ts": 1000,
-            "processed": False,
-            "data": {"title": "Old", "hash": "h1"}
-        },
-        "h2": {
-            "ts": 2000,
-            "processed": False,
-            "data": {"title": "New", "hash": "h2"}
-        }
-    }
+    rss.history.add_pending([
+        ("h1", 1000, {"title": "Old", "hash": "h1"}),
+        ("h2", 2000, {"title": "New", "hash": "h2"}),
+    ])
     
     # 2. Mock fetch_all to find nothing new
     with patch('src.parser.RSSManager._fetch_one', new_callable=AsyncMock) as mock_fetch:
@@ -113,18 +129,276 @@ async def test_fetch_all_with_pending(mock_config, tmp_path):
             assert result[0]['title'] == "New"
             assert result[1]['title'] == "Old"
 
-def test_mark_as_processed(mock_config):
-    rss = RSSManager(mock_config)
-    rss.history = {
-        "h1": {
-            "ts": 1000,
-            "processed": False,
-            "data": {"title": "Old", "hash": "h1"}
-        }
-    }
+@pytest.mark.asyncio
+async def test_fetch_all_stores_new_entries(make_rss, tmp_path):
+    feeds_txt = tmp_path / "feeds.txt"
+    feeds_txt.write_text("# comment\nhttp://ex.com/feed\n")
+    rss = make_rss(opml=str(tmp_path / "missing.opml"), txt=str(feeds_txt))
+    feed = {"title": "Src", "entries": [
+        {"title": "A", "link": "http://ex.com/a", "content": "a", "text": "a"},
+        {"title": "B", "link": "http://ex.com/b", "content": "b", "text": "b"},
+    ]}
+
+    with patch('src.parser.RSSManager._fetch_one', new_callable=AsyncMock, return_value=feed):
+        first = await rss.fetch_all()
+        assert {a['title'] for a in first} == {"A", "B"}
+        assert first[0]['source'] == "Src"
+
+        # 已入库的文章不会重复写入
+        rss.mark_as_processed([first[0]])
+        second = await rss.fetch_all()
+        assert len(second) == 1
+
+def test_mark_as_processed(make_rss):
+    rss = make_rss()
+    rss.history.add_pending([("h1", 1000, {"title": "Old", "hash": "h1"})])
     articles = [{"hash": "h1"}]
     rss.mark_as_processed(articles)
     
-    assert rss.history["h1"]["processed"] is True
-    assert "data" not in rss.history["h1"]
-    assert rss.history["h1"]["ts"] > 1000
+    info = rss.history.get("h1")
+    assert info["processed"] is True
+    assert "data" not in info
+    assert info["ts"] > 1000
+
+def test_parse_feed_entry_timestamp():
+    body = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>T</title>
+<item><title>P</title><link>http://ex.com/p</link><guid>guid-1</guid>
+<pubDate>Wed, 04 Feb 2026 10:00:00 GMT</pubDate></item>
+</channel></rss>"""
+    entry = parse_feed(body)["entries"][0]
+    assert entry["id"] == "guid-1"
+    assert entry["ts"] == 1770199200
+
+def test_parse_feed_computes_dedup_signature_in_worker(mock_config, make_rss, tmp_path):
+    from src.dedup import signature
+    text = " ".join(f"word{i}" for i in range(60))
+    body = f"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>T</title>
+<item><title>P</title><link>http://ex.com/p</link><description>{text}</description></item>
+</channel></rss>""".encode()
+    assert "sig" not in parse_feed(body)["entries"][0]
+    feed = parse_feed(body, sig_perms=64)
+    assert feed["entries"][0]["sig"] == signature(text)
+
+    # 签名随本轮文章传递给去重，但不写入历史
+    mock_config.config.add_section('DEDUP')
+    mock_config.config.set('DEDUP', 'IndexDB', str(tmp_path / "dedup.db"))
+    rss = make_rss()
+    assert rss.sig_perms == 64
+    stored = rss._store_entries("http://ex.com/feed", feed, time.time())
+    assert stored[0]["_sig"] == signature(text)
+    assert "_sig" not in rss.history.pending()[0]
+
+@pytest.mark.asyncio
+async def test_fetch_all_skips_entries_below_watermark(make_rss, tmp_path):
+    feeds_txt = tmp_path / "feeds.txt"
+    feeds_txt.write_text("http://ex.com/feed\n")
+    rss = make_rss(opml=str(tmp_path / "missing.opml"), txt=str(feeds_txt))
+    old = {"title": "Old", "link": "http://ex.com/old", "content": "", "text": "", "id": "old", "ts": 1000}
+    feed = {"title": "Src", "entries": [old]}
+
+    with patch('src.parser.RSSManager._fetch_one', new_callable=AsyncMock, return_value=feed):
+        await rss.fetch_all()
+        new = {"title": "New", "link": "http://ex.com/new", "content": "", "text": "", "id": "new", "ts": 2000}
+        feed["entries"] = [new, old]
+        with patch('hashlib.md5', wraps=hashlib.md5) as md5:
+            result = await rss.fetch_all()
+            # 只有高水位线之上的新条目需要哈希
+            assert md5.call_count == 1
+
+    assert {a['title'] for a in result} == {"New", "Old"}
+    assert rss.feed_state.get("http://ex.com/feed")["hwm"] == 2000
+
+def test_advance_watermark(tmp_path):
+    from src.feed_state import FeedStateStore
+    store = FeedStateStore(str(tmp_path / "state.json"))
+    url = "http://ex.com/feed"
+    e1 = {"id": "a", "ts": 100}
+    e2 = {"id": "b", "ts": 200}
+    undated = {"id": "c", "ts": None}
+
+    assert store.advance_watermark(url, [e2, e1, undated]) == [e2, e1, undated]
+    e3 = {"id": "d", "ts": 300}
+    # 已见过的条目被跳过，无日期条目始终保留
+    assert store.advance_watermark(url, [e3, e2, e1, undated]) == [e3, undated]
+    # 回溯发布（时间早于高水位线但 ID 未见过）的条目仍是候选
+    late = {"id": "late", "ts": 150}
+    assert store.advance_watermark(url, [e3, late, e2, e1]) == [late]
+    # 早于窗口下界的条目属于已知区域，不再扫描
+    ancient = {"id": "ancient", "ts": 50}
+    assert store.advance_watermark(url, [e3, late, e2, e1, ancient]) == []
+    assert store.get(url)["hwm"] == 300
+
+def test_mark_as_processed_includes_related(make_rss):
+    rss = make_rss()
+    rss.history.add_pending([
+        ("h1", 1000, {"title": "Rep", "hash": "h1"}),
+        ("h2", 1000, {"title": "Dup", "hash": "h2"}),
+    ])
+    rss.mark_as_processed([{"hash": "h1", "related": [{"hash": "h2"}]}])
+    assert rss.history.pending() == []
+
+def test_feed_priorities_from_opml(make_rss, tmp_path):
+    opml = tmp_path / "subs.opml"
+    opml.write_text(
+        '<?xml version="1.0"?><opml version="2.0"><body>'
+        '<outline text="Must read" priority="high">'
+        '<outline type="rss" xmlUrl="http://a/feed"/>'
+        '<outline type="rss" xmlUrl="http://b/feed" priority="0.3"/>'
+        '</outline>'
+        '<outline type="rss" xmlUrl="http://c/feed"/>'
+        '</body></opml>', encoding='utf-8')
+    rss = make_rss(opml=str(opml))
+    assert rss._load_urls() == ["http://a/feed", "http://b/feed", "http://c/feed"]
+    assert rss.feed_priorities() == {"http://a/feed": 2.0, "http://b/feed": 0.3, "http://c/feed": 1.0}
+
+@pytest.mark.asyncio
+async def test_stream_reuses_shared_http_pool(make_rss, tmp_path):
+    from src.http_pool import HttpPool
+    import asyncio
+    pool = HttpPool()
+    feeds = tmp_path / "feeds.txt"
+    feeds.write_text("http://example.com/feed\n", encoding='utf-8')
+    rss = make_rss(txt=str(feeds), opml=str(tmp_path / "none.opml"), http=pool)
+    connectors = []
+
+    async def fake_fetch(session, url):
+        connectors.append(session.connector)
+        return None
+
+    with patch.object(rss, '_fetch_one', side_effect=fake_fetch):
+        await rss.stream(asyncio.Queue())
+
+    # 抓取使用共享连接器，结束后连接器仍保持打开，供通知阶段复用
+    assert connectors == [pool.connector]
+    assert not pool.connector.closed
+    await pool.close()
+
+def test_feed_health_circuit_breaker(tmp_path):
+    from src.feed_state import FeedStateStore
+    store = FeedStateStore(str(tmp_path / "state.json"))
+    url = "http://ex.com/dead"
+    now = 10_000
+
+    store.record_failure(url, "timeout", now=now, threshold=2, backoff=100)
+    assert store.is_due(url, now)
+    store.record_failure(url, "timeout", now=now, threshold=2, backoff=100)
+    # 达到阈值后熔断，到期后放行一次试探，再失败时退避翻倍
+    assert not store.is_due(url, now + 99)
+    assert store.is_due(url, now + 100)
+    store.record_failure(url, "timeout", now=now + 100, threshold=2, backoff=100)
+    assert not store.is_due(url, now + 299)
+    assert store.is_due(url, now + 300)
+
+    store.record_success(url, 0.5, now=now + 300)
+    assert store.is_due(url, now + 300)
+    assert "failures" not in store.get(url)
+    assert store.get(url)["last_success"] == now + 300
+
+def test_feed_latency_percentiles_and_adaptive_timeout(tmp_path):
+    from src.feed_state import FeedStateStore
+    store = FeedStateStore(str(tmp_path / "state.json"))
+    url = "http://ex.com/feed"
+    # 样本不足时使用上限
+    store.record_success(url, 1.0)
+    assert store.adaptive_timeout(url, 5, 30) == 30
+    for latency in (0.5, 0.8, 1.2, 0.9, 2.0, 0.7, 1.1, 0.6, 1.0):
+        store.record_success(url, latency)
+    assert store.latency(url, 50) == 0.9
+    assert store.latency(url, 95) == 2.0
+    assert store.adaptive_timeout(url, 5, 30) == 6.0
+    assert store.adaptive_timeout(url, 10, 30) == 10
+    # 只保留最近的样本
+    for _ in range(store.LATENCY_SAMPLES):
+        store.record_success(url, 0.1)
+    assert store.latency(url, 95) == 0.1
+
+@pytest.mark.asyncio
+async def test_fetch_one_trips_breaker_on_repeated_failures(make_rss):
+    rss = make_rss()
+    rss.failure_threshold = 2
+    mock_session = MagicMock()
+    mock_session.get.side_effect = TimeoutError()
+    url = "http://ex.com/slow"
+
+    assert await rss._fetch_one(mock_session, url) is None
+    assert await rss._fetch_one(mock_session, url) is None
+    assert mock_session.get.call_count == 2
+    # 熔断后不再发出请求
+    assert await rss._fetch_one(mock_session, url) is None
+    assert mock_session.get.call_count == 2
+    assert rss.feed_state.get(url)["failures"] == 2
+
+def test_learn_cadence_and_poll_due(tmp_path):
+    from src.feed_state import FeedStateStore
+    store = FeedStateStore(str(tmp_path / "state.json"))
+    url = "http://ex.com/feed"
+    hour = 3600
+    # 从未抓取过的源总是到期
+    assert store.is_poll_due(url, 0)
+
+    store.learn_cadence(url, [{"id": str(i), "ts": i * 6 * hour} for i in range(4)])
+    store.learn_cadence(url, [{"id": "4", "ts": 24 * hour}, {"id": "undated", "ts": None}])
+    assert store.get(url)["interval"] == 6 * hour
+
+    store.record_success(url, 0.2, now=100 * hour)
+    assert not store.is_poll_due(url, 103 * hour)
+    # 少许提前量容忍定时任务的抖动
+    assert store.is_poll_due(url, 105.5 * hour)
+    # 间隔受上下限约束
+    assert not store.is_poll_due(url, 105.5 * hour, min_interval=12 * hour)
+    assert store.is_poll_due(url, 101 * hour, max_interval=hour)
+
+@pytest.mark.asyncio
+async def test_stream_fetches_only_due_feeds(make_rss, tmp_path):
+    import asyncio
+    feeds = tmp_path / "feeds.txt"
+    feeds.write_text("http://ex.com/busy\nhttp://ex.com/quiet\n", encoding='utf-8')
+    rss = make_rss(txt=str(feeds), opml=str(tmp_path / "none.opml"))
+    now = time.time()
+    # quiet 每周发布一次且刚刚抓取过；busy 每小时发布一次，上次抓取在两小时前
+    rss.feed_state.get("http://ex.com/quiet").update(interval=7 * 86400, last_success=now - 3600)
+    rss.feed_state.get("http://ex.com/busy").update(interval=3600, last_success=now - 7200)
+    fetched = []
+
+    async def fake_fetch(session, url):
+        fetched.append(url)
+        return None
+
+    with patch.object(rss, '_fetch_one', side_effect=fake_fetch):
+        await rss.stream(asyncio.Queue())
+        assert fetched == ["http://ex.com/busy"]
+
+        rss.force_refresh = True
+        fetched.clear()
+        await rss.stream(asyncio.Queue())
+        assert sorted(fetched) == ["http://ex.com/busy", "http://ex.com/quiet"]
+
+def test_feed_list_parse_is_cached_by_mtime(make_rss, tmp_path):
+    import os
+    from src import parser as parser_mod
+    opml = tmp_path / "subs.opml"
+    opml.write_text('<opml version="2.0"><body><outline type="rss" xmlUrl="http://a/feed"/></body></opml>',
+                    encoding='utf-8')
+    rss = make_rss(opml=str(opml))
+    with patch.object(parser_mod, 'parse_opml', wraps=parser_mod.parse_opml) as parse:
+        assert rss._load_urls() == ["http://a/feed"]
+        rss.feed_priorities()
+        assert parse.call_count == 1
+
+        # 文件修改后重新解析
+        opml.write_text('<opml version="2.0"><body><outline type="rss" xmlUrl="http://a/feed"/>'
+                        '<outline type="rss" xmlUrl="http://b/feed"/></body></opml>', encoding='utf-8')
+        stat = opml.stat()
+        os.utime(opml, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert rss._load_urls() == ["http://a/feed", "http://b/feed"]
+        assert parse.call_count == 2
+
+def test_parse_opml_falls_back_on_malformed_xml(tmp_path):
+    from src.parser import parse_opml
+    opml = tmp_path / "broken.opml"
+    # 未转义的 & 不是合法 XML
+    opml.write_text('<opml><body><outline text="A & B" priority="high">'
+                    '<outline xmlUrl="http://a/feed"/></outline></body></opml>', encoding='utf-8')
+    assert parse_opml(str(opml)) == [("http://a/feed", "high")]
@@ -0,0 +1,213 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+from src.parser import RSSManager
+from src.ai_hub import IntelligenceHub
+from src.pipeline import run_pipeline
+
+def make_feed(name, n):
+    return {"title": name, "entries": [
+        {"title": f"{name}-{i}", "link": f"http://{name}/{i}", "content": f"{name} {i}", "text": f"{name} {i}", "id": f"{name}-{i}", "ts": None}
+        for i in range(n)
+    ]}
+
+@pytest.fixture
+def rss(mock_config, tmp_path):
+    feeds_txt = tmp_path / "feeds.txt"
+    feeds_txt.write_text("http://fast/feed\nhttp://slow/feed\n")
+    manager = RSSManager(mock_config, opml=str(tmp_path / "none.opml"), txt=str(feeds_txt),
+                         db=str(tmp_path / "h.db"), state=str(tmp_path / "s.json"))
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def hub(mock_config):
+    with patch('google.genai.Client'):
+        h = IntelligenceHub(mock_config)
+    h.pool.primary.client.aio.aclose = AsyncMock()
+    return h
+
+@pytest.mark.asyncio
+async def test_ai_starts_before_slow_feed_finishes(rss, hub):
+    slow_released = asyncio.Event()
+    timeline = []
+
+    async def fake_fetch(session, url):
+        if "slow" in url:
+            await slow_released.wait()
+            timeline.append("slow fetched")
+            return make_feed("slow", 1)
+        return make_feed("fast", 2)
+
+    async def fake_generate(model, contents):
+        timeline.append("ai call")
+        # 快源的文章处理完后才放行慢源
+        slow_released.set()
+        response = MagicMock()
+        response.text = "## Summary"
+        return response
+
+    hub.pool.primary.client.aio.models.generate_content = fake_generate
+    with patch.object(rss, '_fetch_one', side_effect=fake_fetch):
+        processed, quota_exceeded = await asyncio.wait_for(
+            run_pipeline(rss, lambda: hub, queue_size=1), timeout=2)
+
+    assert timeline[0] == "ai call"
+    assert len(processed) == 3
+    assert quota_exceeded is False
+    hub.pool.primary.client.aio.aclose.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_quota_exhaustion_drains_queue_and_keeps_articles(rss, hub):
+    hub.pool.primary.client.aio.models.generate_content = AsyncMock(side_effect=Exception("429 RESOURCE_EXHAUSTED. {'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}"))
+
+    async def fake_fetch(session, url):
+        return make_feed("fast" if "fast" in url else "slow", 10)
+
+    with patch.object(rss, '_fetch_one', side_effect=fake_fetch):
+        processed, quota_exceeded = await asyncio.wait_for(
+            run_pipeline(rss, lambda: hub, queue_size=2), timeout=2)
+
+    assert processed == []
+    assert quota_exceeded is True
+    # 生产者在背压下也能正常结束，所有文章都已入库待下次处理
+    assert len(rss.history.pending()) == 20
+
+@pytest.mark.asyncio
+async def test_no_articles_does_not_create_hub(rss):
+    factory = MagicMock()
+    with patch.object(rss, '_fetch_one', new_callable=AsyncMock, return_value=None):
+        processed, quota_exceeded = await run_pipeline(rss, factory)
+    assert processed == []
+    factory.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_backlog_is_streamed_after_new_articles(rss, hub):
+    rss.history.add_pending([("old", 1, {"title": "Old", "link": "l", "content": "c", "source": "s", "hash": "old"})])
+    order = []
+
+    async def fake_generate(model, contents):
+        order.append(contents.rsplit("Title: ", 1)[1].split("\n")[0])
+        response = MagicMock()
+        response.text = "## Summary"
+        return response
+
+    hub.concurrency = 1
+    hub.pool.primary.client.aio.models.generate_content = fake_generate
+    with patch.object(rss, '_fetch_one', new_callable=AsyncMock, side_effect=[make_feed("fast", 1), None]):
+        processed, _ = await run_pipeline(rss, lambda: hub)
+    assert order == ["fast-0", "Old"]
+    assert len(processed) == 2
+
+@pytest.mark.asyncio
+async def test_checkpointed_summaries_resume_without_ai(rss, hub, mock_config):
+    async def fake_generate(model, contents):
+        response = MagicMock()
+        response.text = "## Summary"
+        return response
+
+    hub.pool.primary.client.aio.models.generate_content = fake_generate
+    with patch.object(rss, '_fetch_one', new_callable=AsyncMock, side_effect=[make_feed("fast", 2), None]):
+        processed, _ = await run_pipeline(rss, lambda: hub)
+    assert len(processed) == 2
+    # 模拟投递前崩溃：不调用 mark_as_processed，重新打开历史
+    rss.history.close()
+    from src.history import open_history_store
+    rss.history = open_history_store(mock_config, rss.history.path)
+
+    hub.pool.primary.client.aio.models.generate_content = AsyncMock(side_effect=AssertionError("不应再调用 AI"))
+    with patch.object(rss, '_fetch_one', new_callable=AsyncMock, return_value=None):
+        processed, quota_exceeded = await run_pipeline(rss, lambda: hub)
+    assert sorted(a['title'] for a in processed) == ["fast-0", "fast-1"]
+    assert all(a['ai_html'] for a in processed)
+    assert quota_exceeded is False
+
+def gated_fetch(feeds, released, timeline):
+    """慢源等待 released 后才返回，用于验证 AI 处理不必等待全部抓取完成"""
+    async def fake_fetch(session, url):
+        if "slow" in url:
+            await released.wait()
+            timeline.append("slow fetched")
+        return feeds[url]
+    return fake_fetch
+
+def recording_generate(released, timeline):
+    async def fake_generate(model, contents):
+        timeline.append(contents.rsplit("Title: ", 1)[1].split("\n")[0])
+        released.set()
+        response = MagicMock()
+        response.text = "## Summary"
+        return response
+    return fake_generate
+
+@pytest.mark.asyncio
+async def test_scheduler_streams_while_budget_not_binding(rss, hub):
+    from src.scheduler import Scheduler
+    released, timeline = asyncio.Event(), []
+    feeds = {"http://fast/feed": make_feed("fast", 2), "http://slow/feed": make_feed("slow", 1)}
+    hub.concurrency = 1
+    hub.pool.primary.client.aio.models.generate_content = recording_generate(released, timeline)
+    with patch.object(rss, '_fetch_one', side_effect=gated_fetch(feeds, released, timeline)):
+        processed, _ = await asyncio.wait_for(
+            run_pipeline(rss, lambda: hub, queue_size=1, scheduler=Scheduler(max_requests=10)), timeout=2)
+
+    # 启用调度但预算充足时，AI 处理在慢源抓取完成之前就已开始
+    assert timeline.index("fast-0") < timeline.index("slow fetched")
+    assert len(processed) == 3
+
+@pytest.mark.asyncio
+async def test_scheduler_defers_articles_beyond_remaining_budget(rss, hub):
+    from src.scheduler import Scheduler
+    released, timeline = asyncio.Event(), []
+    feeds = {"http://fast/feed": make_feed("fast", 1), "http://slow/feed": make_feed("slow", 3)}
+    hub.concurrency = 1
+    hub.pool.primary.client.aio.models.generate_content = recording_generate(released, timeline)
+    scheduler = Scheduler({"http://slow/feed": 2.0}, max_requests=2)
+    with patch.object(rss, '_fetch_one', side_effect=gated_fetch(feeds, released, timeline)):
+        processed, _ = await asyncio.wait_for(
+            run_pipeline(rss, lambda: hub, scheduler=scheduler), timeout=2)
+
+    # 预算内的文章随到随处理，超出剩余预算的留在历史中待下次
+    assert timeline[0] == "fast-0"
+    assert sorted(a['title'] for a in processed) == ["fast-0", "slow-0"]
+    pending = [a for a in rss.history.pending() if 'ai_html' not in a]
+    assert sorted(a['title'] for a in pending) == ["slow-1", "slow-2"]
+
+@pytest.mark.asyncio
+async def test_resume_keeps_checkpointed_summary_of_near_duplicates(rss, hub, mock_config, tmp_path):
+    from src.dedup import NearDuplicateIndex
+    from src.history import open_history_store
+    text = ("Apple announced today that the new developer tools will ship with support for on-device "
+            "language models, letting third party apps call the same private foundation model that powers "
+            "system features. The company says the framework is free to use and works offline.")
+    feed = {"title": "fast", "entries": [
+        {"title": title, "link": f"http://fast/{title}", "content": body, "text": body, "id": title, "ts": None}
+        for title, body in (("original", text), ("repost", text + " Via a link blog."))
+    ]}
+    calls = []
+
+    async def fake_generate(model, contents):
+        calls.append(contents)
+        response = MagicMock()
+        response.text = "## Summary"
+        return response
+
+    hub.pool.primary.client.aio.models.generate_content = fake_generate
+    dedup = NearDuplicateIndex(str(tmp_path / "dedup.db"), threshold=0.5)
+    with patch.object(rss, '_fetch_one', new_callable=AsyncMock, side_effect=[feed, None]):
+        processed, _ = await run_pipeline(rss, lambda: hub, dedup=dedup)
+    assert len(calls) == 1 and len(processed) == 1
+    # 模拟投递前崩溃：代表文章已写入检查点，转载仍在待处理队列中
+    rss.history.close()
+    rss.history = open_history_store(mock_config, rss.history.path)
+
+    dedup.reset()
+    with patch.object(rss, '_fetch_one', new_callable=AsyncMock, return_value=None):
+        processed, _ = await run_pipeline(rss, lambda: hub, dedup=dedup)
+    dedup.conn.close()
+
+    # 不再调用 AI，已付费的总结保留，转载不重复追加
+    assert len(calls) == 1
+    assert [a['title'] for a in processed] == ["original"]
+    assert processed[0]['ai_html']
+    assert [r['title'] for r in processed[0]['related']] == ["repost"]
@@ -0,0 +1,125 @@
+import pytest
+import asyncio
+import time
+from unittest.mock import patch
+from src.rate_limit import RateLimiter, TokenBucket, QuotaExhausted, UsageLedger, estimate_tokens, quota_day
+
+def test_estimate_tokens():
+    assert estimate_tokens("a" * 400) == 101
+    # CJK 字符按每字 1 token 计
+    assert estimate_tokens("你好世界") == 5
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(60, 60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    # 超过容量的请求按容量计算，避免永远等待
+    assert bucket.wait_time(1000, now + 60) == pytest.approx(0, abs=1e-9)
+
+@pytest.mark.asyncio
+async def test_acquire_without_limits_is_immediate():
+    limiter = RateLimiter()
+    start = time.monotonic()
+    for _ in range(100):
+        await limiter.acquire(10_000)
+    assert time.monotonic() - start < 0.1
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_rpm_budget():
+    limiter = RateLimiter(rpm=2)
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        # 模拟时间流逝：直接补满令牌
+        limiter.rpm.tokens = limiter.rpm.capacity
+
+    with patch('src.rate_limit.asyncio.sleep', side_effect=fake_sleep):
+        await limiter.acquire()
+        await limiter.acquire()
+        assert sleeps == []
+        await limiter.acquire()
+    assert len(sleeps) == 1
+    assert sleeps[0] == pytest.approx(30, rel=0.01)
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_tpm_budget():
+    limiter = RateLimiter(tpm=1000)
+    await limiter.acquire(1000)
+    with patch('src.rate_limit.asyncio.sleep', side_effect=asyncio.CancelledError) as mock_sleep:
+        with pytest.raises(asyncio.CancelledError):
+            await limiter.acquire(500)
+    assert mock_sleep.call_args[0][0] == pytest.approx(30, rel=0.01)
+
+@pytest.mark.asyncio
+async def test_acquire_raises_when_daily_quota_used():
+    limiter = RateLimiter(rpd=2)
+    await limiter.acquire()
+    await limiter.acquire()
+    with pytest.raises(QuotaExhausted):
+        await limiter.acquire()
+
+def test_from_config(mock_config):
+    # 未配置 RPM 时由 RequestDelay 推算
+    mock_config.config.set('AI', 'RequestDelay', '4')
+    assert RateLimiter.from_config(mock_config).rpm.capacity == 15
+
+    mock_config.config.set('AI', 'RPM', '30')
+    mock_config.config.set('AI', 'TPM', '250000')
+    mock_config.config.set('AI', 'RPD', '1000')
+    limiter = RateLimiter.from_config(mock_config)
+    assert limiter.rpm.capacity == 30
+    assert limiter.tpm.capacity == 250000
+    assert limiter.rpd == 1000
+
+@pytest.mark.asyncio
+async def test_daily_quota_resets_on_new_day():
+    limiter = RateLimiter(rpd=1)
+    await limiter.acquire()
+    with pytest.raises(QuotaExhausted):
+        await limiter.acquire()
+    # 常驻运行跨过配额日后重新计数
+    with patch('src.rate_limit.quota_day', return_value="2099-01-01"):
+        await limiter.acquire()
+    assert limiter.used_today == 1
+
+@pytest.mark.asyncio
+async def test_daily_usage_persists_across_runs(tmp_path):
+    path = str(tmp_path / "usage.db")
+    ledger = UsageLedger(path)
+    limiter = RateLimiter(rpd=2, ledger=ledger, ledger_key="model@abc")
+    await limiter.acquire()
+    ledger.close()
+
+    # 下一次运行从持久化计数继续，而不是从 0 开始
+    ledger = UsageLedger(path)
+    limiter = RateLimiter(rpd=2, ledger=ledger, ledger_key="model@abc")
+    assert limiter.used_today == 1
+    assert limiter.remaining_today == 1
+    await limiter.acquire()
+    with pytest.raises(QuotaExhausted):
+        await limiter.acquire()
+    # 其他端点与其他配额日分别计数
+    assert ledger.used(limiter.day, "model@def") == 0
+    assert ledger.used("2099-01-01", "model@abc") == 0
+    ledger.close()
+
+def test_usage_ledger_from_config(mock_config, tmp_path):
+    assert UsageLedger.from_config(mock_config) is None
+    mock_config.config.set('AI', 'UsageDB', str(tmp_path / "history.db"))
+    ledger = UsageLedger.from_config(mock_config)
+    ledger.add("2099-01-01", "model@abc", 3)
+    assert ledger.used("2099-01-01", "model@abc") == 3
+    ledger.close()
+
+def test_quota_day_follows_pacific_time():
+    from datetime import datetime, timezone
+    ts = lambda *args: datetime(*args, tzinfo=timezone.utc).timestamp()
+    # 夏令时 (PDT, UTC-7)：UTC 07:00 即太平洋时间午夜
+    assert quota_day(ts(2026, 7, 1, 6, 30)) == "2026-06-30"
+    assert quota_day(ts(2026, 7, 1, 7, 30)) == "2026-07-01"
+    # 冬令时 (PST, UTC-8)
+    assert quota_day(ts(2026, 1, 15, 7, 30)) == "2026-01-14"
+    assert quota_day(ts(2026, 1, 15, 8, 30)) == "2026-01-15"
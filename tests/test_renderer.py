@@ -0,0 +1,75 @@
+import pytest
+import time
+import markdown
+from src import renderer
+
+REPORT_MD = (
+    "## 1. 速览 (Summary)\n- Point A\n- Point B\n\n"
+    "## 2. 深度 (Insights)\n"
+    "| Key Insight (English) | 核心观点 (Chinese) |\n| :--- | :--- |\n| **Fast** & cheap | 快且便宜 |\n"
+)
+
+ARTICLES = [{
+    "title": "Art 1", "link": "http://ex.com/1", "source": "Src 1",
+    "ai_html": markdown.markdown(REPORT_MD, extensions=['tables']),
+    "related": [{"title": "Copy", "link": "http://mirror/1", "source": "Mirror", "hash": "h"}],
+}]
+
+def test_html_to_telegram():
+    text = renderer.html_to_telegram("<h2>Title</h2>\n<ul>\n<li>A</li>\n</ul>\n<p>x <em>y</em></p><table><tr><td>c</td></tr></table>")
+    assert "<b>Title</b>" in text
+    assert "• A" in text
+    assert "<em>y</em>" in text
+    assert "<table" not in text and "<td" not in text
+
+def test_html_to_markdown_keeps_structure():
+    md = renderer.html_to_markdown(ARTICLES[0]['ai_html'])
+    assert "### 1. 速览 (Summary)" in md
+    assert "- Point A" in md
+    assert "| Key Insight (English) | 核心观点 (Chinese) |" in md
+    assert "| **Fast** & cheap | 快且便宜 |" in md
+
+def test_all_formats_from_one_intermediate_form():
+    items = renderer.prepare(ARTICLES)
+    email = renderer.render_email(items, warning="quota")
+    assert email["subject"].endswith("1 篇新更新")
+    assert "http://mirror/1" in email["html"] and "quota" in email["html"]
+
+    parts = renderer.render_telegram(items)
+    assert "<a href='http://mirror/1'>Mirror</a>" in parts[1]
+
+    md = renderer.render_markdown(items, date="2026-01-01")
+    assert md.startswith("# RSS 智能情报局 - 2026-01-01")
+    assert "## [Art 1](http://ex.com/1)" in md
+    assert "[Mirror](http://mirror/1)" in md
+
+def test_titles_and_sources_are_escaped():
+    items = renderer.prepare([{
+        "title": "A <b> & B", "link": "http://ex.com/?a=1&b=2", "source": "R&D <Blog>", "ai_html": "<p>x</p>",
+        "related": [{"title": "c", "link": "http://m/1", "source": "M&M", "hash": "h"}],
+    }])
+    email = renderer.render_email(items)["html"]
+    assert "A &lt;b&gt; &amp; B" in email and "R&amp;D &lt;Blog&gt;" in email and "M&amp;M" in email
+    parts = renderer.render_telegram(items)
+    assert "A &lt;b&gt; &amp; B" in parts[1] and "R&amp;D &lt;Blog&gt;" in parts[1]
+    assert "href='http://ex.com/?a=1&amp;b=2'" in parts[1]
+
+def test_empty_report():
+    assert "今日暂无新情报" in renderer.render_email([])["subject"]
+    assert len(renderer.render_telegram([], warning="w")) == 1
+
+def test_large_digest_renders_quickly():
+    items = renderer.prepare([dict(ARTICLES[0], title=f"Art {i}") for i in range(2000)])
+    start = time.perf_counter()
+    renderer.render_email(items)
+    renderer.render_telegram(items)
+    renderer.render_markdown(items)
+    assert time.perf_counter() - start < 2
+
+def test_structured_data_is_rendered_from_fields():
+    art = {"title": "S", "link": "http://s", "source": "Src",
+           "ai_data": {"summary": ["要点 <1>"], "insights": [{"en": "Fast", "zh": "快"}]}}
+    items = renderer.prepare([art])
+    assert "<li>要点 &lt;1&gt;</li>" in renderer.render_email(items)["html"]
+    assert "• 要点 &lt;1&gt;" in renderer.render_telegram(items)[1]
+    assert "| Fast | 快 |" in renderer.render_markdown(items)
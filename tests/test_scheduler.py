@@ -0,0 +1,113 @@
+import pytest
+from src.scheduler import Scheduler, parse_priority
+
+NOW = 1_000_000.0
+HOUR = 3600
+
+def art(name, feed="f", published=NOW, seen=NOW, size=100, **extra):
+    return dict({"title": name, "feed": feed, "published": published, "seen": seen,
+                 "text": "word " * size, "content": ""}, **extra)
+
+def test_parse_priority():
+    assert parse_priority("high") == 2.0
+    assert parse_priority("LOW") == 0.5
+    assert parse_priority("3") == 3.0
+    assert parse_priority(None) == 1.0
+    assert parse_priority("oops") == 1.0
+
+def test_score_factors():
+    s = Scheduler({"vip": 2.0}, half_life_hours=24)
+    fresh, day_old = art("a"), art("b", published=NOW - 24 * HOUR)
+    assert s.score(fresh, NOW) == pytest.approx(2 * s.score(day_old, NOW))
+    assert s.score(art("v", feed="vip"), NOW) == pytest.approx(2 * s.score(fresh, NOW))
+    # 在积压中等待越久补偿越多
+    waited = art("w", published=NOW - 24 * HOUR, seen=NOW - 72 * HOUR)
+    assert s.score(waited, NOW) > s.score(day_old, NOW)
+
+def test_plan_respects_request_budget():
+    s = Scheduler({"vip": 2.0}, max_requests=2)
+    articles = [art("old", published=NOW - 48 * HOUR), art("vip", feed="vip"), art("new"),
+                art("done", published=NOW - 99 * HOUR, ai_html="<p>x</p>")]
+    selected, deferred = s.plan(articles, NOW)
+    # 已有结果的文章不占预算
+    assert [a["title"] for a in selected] == ["done", "vip", "new"]
+    assert [a["title"] for a in deferred] == ["old"]
+
+def test_plan_prefers_cheap_articles_when_tokens_are_tight():
+    s = Scheduler(max_tokens=3000)
+    articles = [art("long", size=4000), art("short1", size=100), art("short2", size=100)]
+    selected, deferred = s.plan(articles, NOW)
+    assert {a["title"] for a in selected} == {"short1", "short2"}
+    assert [a["title"] for a in deferred] == ["long"]
+
+def test_unlimited_budget_orders_by_value():
+    s = Scheduler()
+    articles = [art("old", published=NOW - 48 * HOUR), art("new")]
+    selected, deferred = s.plan(articles, NOW)
+    assert [a["title"] for a in selected] == ["new", "old"]
+    assert deferred == []
+
+def test_from_config(mock_config):
+    mock_config.config.set('AI', 'RPD', '50')
+    mock_config.config.set('AI', 'TPM', '1000')
+    mock_config.config.set('AI', 'MaxRunMinutes', '10')
+    s = Scheduler.from_config(mock_config)
+    assert (s.max_requests, s.max_tokens) == (50, 10000)
+    # 常驻模式下由模型池给出当日剩余请求数
+    assert Scheduler.from_config(mock_config, remaining=7).max_requests == 7
+    # 模型池中每个端点各有一份额度
+    mock_config.GEMINI_KEY = "k1,k2"
+    s = Scheduler.from_config(mock_config)
+    assert (s.max_requests, s.max_tokens) == (100, 20000)
+    mock_config.config.set('AI', 'Scheduling', 'false')
+    assert Scheduler.from_config(mock_config) is None
+
+def test_from_config_plans_against_persisted_usage(mock_config, tmp_path):
+    from src.model_pool import endpoint_id
+    from src.rate_limit import UsageLedger, quota_day
+    mock_config.config.set('AI', 'RPD', '50')
+    mock_config.config.set('AI', 'UsageDB', str(tmp_path / "history.db"))
+    ledger = UsageLedger.from_config(mock_config)
+    ledger.add(quota_day(), endpoint_id("gemini-1.5-flash", "test_key"), 45)
+    ledger.close()
+    assert Scheduler.from_config(mock_config).max_requests == 5
+
+def schedule(s, arrivals):
+    """模拟流水线：先到的文章逐篇 admit，受限后收集起来交给 plan，返回实际处理的标题"""
+    streamed, held = [], []
+    for a in arrivals:
+        (streamed if s.admit(a) else held).append(a)
+    selected, _ = s.plan(held, NOW)
+    return [a["title"] for a in streamed + selected]
+
+def test_late_high_priority_beats_early_low_priority():
+    s = Scheduler({"lo": 0.5, "hi": 2.0}, max_requests=5)
+    arrivals = [art(f"lo{i}", feed="lo") for i in range(5)] + [art(f"hi{i}", feed="hi") for i in range(5)]
+    done = schedule(s, arrivals)
+    # 先到的低优先级文章只占用流式份额，预留的预算留给晚到的高优先级文章
+    assert len(done) == 5
+    assert sum(t.startswith("hi") for t in done) > sum(t.startswith("lo") for t in done)
+    assert "hi0" in done and "lo4" not in done
+    # 已有结果的文章不占预算，受限后仍直接放行
+    assert s.admit(dict(art("done"), ai_html="<p>x</p>"))
+
+def test_known_backlog_is_planned_by_value_from_the_start():
+    s = Scheduler(max_requests=2)
+    backlog = [dict(art(f"old{i}", published=NOW - 100 * HOUR, seen=NOW - 72 * HOUR), hash=f"old{i}")
+               for i in range(3)]
+    # 积压本身已超出预算：从第一篇新文章起就收集候选，积压按时效与积压时间参与排序
+    s.expect(backlog)
+    assert s.binding
+    assert schedule(s, [art("new")] + backlog) == ["new", "old0"]
+
+def test_no_reserve_needed_when_budget_is_not_binding():
+    s = Scheduler(max_requests=10)
+    assert all(s.admit(art(f"a{i}")) for i in range(5))
+    assert not s.binding
+
+def test_plan_uses_budget_left_after_admitted_articles():
+    s = Scheduler(max_tokens=2 * Scheduler().cost(art("short1")) + 10)
+    assert s.admit(art("short1"))
+    selected, deferred = s.plan([art("long", size=2000), art("short2")], NOW)
+    assert [a["title"] for a in selected] == ["short2"]
+    assert [a["title"] for a in deferred] == ["long"]
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只在确有文章需要处理、或解析进程中才需要的重量级依赖
+HEAVY_MODULES = ("google.genai", "bs4", "markdown", "feedparser", "lxml")
+
+# main 的累计导入耗时上限（秒），留出较宽的余量以适应较慢的 CI 机器
+IMPORT_BUDGET = 1.5
+
+def _run(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+def test_importing_main_skips_heavy_dependencies():
+    out = _run(f"import sys, main; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    assert out.stdout.strip() == ""
+
+def test_import_time_budget():
+    out = _run("import main", "-X", "importtime")
+    line = next(l for l in reversed(out.stderr.splitlines()) if l.rstrip().endswith("| main"))
+    cumulative_us = int(line.split("|")[1])
+    assert cumulative_us / 1e6 < IMPORT_BUDGET
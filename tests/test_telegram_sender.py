@@ -0,0 +1,85 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+from src.telegram_sender import TelegramSender, TelegramSendError, TelegramPermanentError, split_message, utf16_len
+
+class FakeResponse:
+    def __init__(self, status, json_data=None, text=""):
+        self.status = status
+        self._json = json_data or {}
+        self._text = text
+
+    async def json(self, content_type=None):
+        return self._json
+
+    async def text(self):
+        return self._text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+def make_session(*responses):
+    session = MagicMock()
+    session.post.side_effect = list(responses)
+    return session
+
+def test_utf16_len_counts_surrogate_pairs():
+    assert utf16_len("abc") == 3
+    assert utf16_len("中文") == 2
+    assert utf16_len("🚀") == 2
+
+def test_split_message_respects_utf16_limit():
+    parts = ["🚀" * 3, "ab", "c" * 4]
+    # 🚀x3 占 6 个码元，"ab" 放得下，"cccc" 放不下
+    assert split_message(parts, limit=8) == ["🚀🚀🚀ab", "cccc"]
+
+def test_split_message_breaks_oversized_part():
+    part = "line1\n" + "🚀" * 5
+    chunks = split_message([part], limit=6)
+    assert all(utf16_len(c) <= 6 for c in chunks)
+    assert "".join(chunks) == part
+
+@pytest.mark.asyncio
+async def test_retry_after_is_honoured():
+    sender = TelegramSender("t", global_rate=0, chat_interval=0)
+    session = make_session(
+        FakeResponse(429, {"ok": False, "parameters": {"retry_after": 7}}),
+        FakeResponse(200),
+    )
+    with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+        await sender.send(session, "1", "hi")
+    mock_sleep.assert_any_await(7.0)
+    assert session.post.call_count == 2
+
+@pytest.mark.asyncio
+async def test_client_error_is_not_retried():
+    sender = TelegramSender("t", global_rate=0, chat_interval=0)
+    session = make_session(FakeResponse(400, text="Bad Request: can't parse entities"))
+    with pytest.raises(TelegramPermanentError):
+        await sender.send(session, "1", "hi")
+    assert session.post.call_count == 1
+
+@pytest.mark.asyncio
+async def test_server_error_retries_then_gives_up():
+    sender = TelegramSender("t", global_rate=0, chat_interval=0, max_retries=2)
+    session = make_session(*[FakeResponse(502, text="Bad Gateway") for _ in range(3)])
+    with patch('asyncio.sleep', new_callable=AsyncMock):
+        with pytest.raises(TelegramSendError, match="502"):
+            await sender.send(session, "1", "hi")
+    assert session.post.call_count == 3
+
+@pytest.mark.asyncio
+async def test_per_chat_interval_does_not_block_other_chats():
+    sender = TelegramSender("t", global_rate=0, chat_interval=0.2)
+    session = MagicMock()
+    session.post.side_effect = lambda *a, **k: FakeResponse(200)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.gather(sender.send(session, "a", "1"), sender.send(session, "b", "1"))
+    assert loop.time() - start < 0.1
+    # 同一聊天的第二条需等待间隔
+    await sender.send(session, "a", "2")
+    assert loop.time() - start >= 0.15